@@ -0,0 +1,104 @@
+# V2/src/bench_generate.py
+# tokens/sec of src.infer.generate with and without the KV cache (same seed -> same tokens)
+#   python -m src.bench_generate                 # checkpoints/best_sft.pt, else a random-init model
+#   python -m src.bench_generate --prompt-len 32 --new-tokens 160 --reps 3
+#   python -m src.bench_generate --chat-turns 8  # time-to-first-token per chat turn, reused vs rebuilt
+#   python -m src.bench_generate --batch 32      # 32 prompts of mixed length: one at a time vs batched
+import os, time, argparse, torch
+from src.config import cfg
+from src.model import TinyGPT
+from src.infer import generate, load_checkpoint
+from src.tokenizer_util import AresTokenizer
+from src.chat import ChatSession
+
+USER_LINES = ["Hi, who are you?", "What is 12 + 30?", "Tell me a short fact about the moon.",
+              "Why is the sky blue?", "Say something encouraging.", "What did I ask first?"]
+
+def timed(model, x, new_tokens, use_cache, seed):
+    torch.manual_seed(seed)
+    t0 = time.perf_counter()
+    y = generate(model, x, new_tokens, temperature=0.8, top_k=40, top_p=0.95, min_tokens=0, use_cache=use_cache)
+    return y, time.perf_counter() - t0
+
+def chat_ttft(model, tok, turns, new_tokens):
+    """Per-turn time-to-first-token: one ChatSession reusing its cache vs one re-feeding everything."""
+    rows = []
+    for reuse in (True, False):
+        torch.manual_seed(0)
+        s = ChatSession(model, tok, top_k=40, top_p=0.95, min_tokens=0)
+        for i in range(turns):
+            if not reuse:
+                s.cache.reset(); s.cached = []
+            s.reply(USER_LINES[i % len(USER_LINES)], max_new_tokens=new_tokens)
+            if reuse: rows.append(dict(s.stats))
+            else: rows[i]["rebuilt"] = dict(s.stats)
+    print(f"{'turn':>4} {'prompt':>7} {'fed':>5} {'ttft ms':>8} | {'fed':>5} {'ttft ms':>8} (rebuilt)")
+    for i, r in enumerate(rows):
+        b = r["rebuilt"]
+        print(f"{i+1:>4} {r['prompt_tokens']:>7} {r['fed_tokens']:>5} {r['ttft_s']*1000:>8.1f} | "
+              f"{b['fed_tokens']:>5} {b['ttft_s']*1000:>8.1f}{'  (older turns dropped)' if r['dropped_turns'] else ''}")
+
+def batch_throughput(model, vocab, n_prompts, prompt_len, new_tokens):
+    """tokens/sec for n_prompts mixed-length prompts, serial vs one left-padded batch."""
+    g = torch.Generator().manual_seed(0)
+    lens = torch.randint(max(1, prompt_len // 4), prompt_len + 1, (n_prompts,), generator=g).tolist()
+    prompts = [torch.randint(0, vocab, (L,), generator=g).tolist() for L in lens]
+    kw = dict(temperature=0.8, top_k=40, top_p=0.95, min_tokens=0)
+    torch.manual_seed(0)
+    t0 = time.perf_counter()
+    n_serial = sum(generate(model, torch.tensor([p]), new_tokens, **kw).size(1) - len(p) for p in prompts)
+    serial = time.perf_counter() - t0
+    torch.manual_seed(0)
+    t0 = time.perf_counter()
+    ys = generate(model, prompts, new_tokens, **kw)
+    batched = time.perf_counter() - t0
+    n_batched = sum(len(y) - len(p) for y, p in zip(ys, prompts))
+    print(f"  serial    {n_serial / serial:8.1f} tok/s  ({serial:.2f}s)")
+    print(f"  batched   {n_batched / batched:8.1f} tok/s  ({batched:.2f}s)  x{(n_batched / batched) / (n_serial / serial):.2f}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ckpt", default="checkpoints/best_sft.pt")
+    ap.add_argument("--prompt-len", type=int, default=32)
+    ap.add_argument("--new-tokens", type=int, default=160)
+    ap.add_argument("--reps", type=int, default=3)
+    ap.add_argument("--threads", type=int, default=0, help="torch threads (0 = torch default)")
+    ap.add_argument("--chat-turns", type=int, default=0, help="run the chat TTFT comparison instead")
+    ap.add_argument("--batch", type=int, default=0, help="run the serial vs batched comparison with this many prompts")
+    args = ap.parse_args()
+    if args.threads: torch.set_num_threads(args.threads)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if os.path.exists(args.ckpt):
+        model, tok = load_checkpoint(args.ckpt, device)
+        src = args.ckpt
+    else:
+        tok = AresTokenizer(os.path.join(cfg.tokenizer_dir, "tokenizer.json"))
+        torch.manual_seed(cfg.seed)
+        model = TinyGPT(tok.vocab_size, cfg.block_size, cfg.n_layer, cfg.n_head, cfg.n_embd, cfg.dropout).to(device).eval()
+        src = "random init (cfg shape)"
+    if args.chat_turns:
+        print(f"model: {src} | block_size {model.block_size} | {args.chat_turns} turns, {args.new_tokens} reply tokens max")
+        return chat_ttft(model, tok, args.chat_turns, args.new_tokens)
+    vocab = model.head.weight.size(0)
+    if args.batch:
+        print(f"model: {src} | {args.batch} prompts of <= {args.prompt_len} tokens + {args.new_tokens} new tokens")
+        return batch_throughput(model, vocab, args.batch, args.prompt_len, args.new_tokens)
+    x = torch.randint(0, vocab, (1, args.prompt_len), device=device)
+    print(f"model: {src} | block_size {model.block_size} | prompt {args.prompt_len} + {args.new_tokens} new tokens")
+
+    best = {}
+    outs = {}
+    for use_cache in (False, True):
+        timed(model, x, 8, use_cache, 0)  # warm-up
+        for _ in range(args.reps):
+            y, dt = timed(model, x, args.new_tokens, use_cache, 0)
+            best[use_cache] = min(best.get(use_cache, dt), dt)
+        outs[use_cache] = y
+    n = outs[True].size(1) - args.prompt_len
+    for use_cache, name in ((False, "full recompute"), (True, "kv cache")):
+        print(f"  {name:<15} {n / best[use_cache]:8.1f} tok/s  ({best[use_cache]:.2f}s)")
+    print(f"  speedup x{best[False] / best[True]:.2f} | identical tokens: {torch.equal(outs[False], outs[True])}")
+
+if __name__ == "__main__":
+    main()
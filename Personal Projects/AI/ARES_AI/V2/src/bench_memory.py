@@ -0,0 +1,88 @@
+# V2/src/bench_memory.py
+# peak RAM vs step time of one training step, per context length and activation-checkpointing setting
+#   python -m src.bench_memory                          # cfg shape, block 192/384/768, checkpoint off/every 2/every 1
+#   python -m src.bench_memory --blocks 256,512,1024 --every 0,1 --batch 8
+#   python -m src.bench_memory --amp                    # under bf16 autocast (as train_sft does on a bf16 CPU)
+#   python -m src.bench_memory --packed                 # packed SFT rows: masked attention keeps B×H×T×T
+# Each (block, every) runs in a fresh subprocess, so ru_maxrss is that configuration's own peak.
+# "act MB" is the peak minus the RSS right before the first step (model, optimizer state and the
+# batch already allocated), i.e. what the forward/backward itself needs.
+import os, sys, time, argparse, subprocess, torch
+from contextlib import nullcontext
+from src.config import cfg
+from src.model import TinyGPT
+from src.tokenizer_util import AresTokenizer
+from src.utils import attn_dropout_for
+
+def _rss_mb():
+    import resource   # POSIX only
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r / 1024 / (1024 if sys.platform == "darwin" else 1)   # bytes on macOS, KiB elsewhere
+
+def worker(args):
+    """One configuration in this process; prints 'ms_per_step peak_mb act_mb'."""
+    if args.threads: torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    m = TinyGPT(args.vocab, args.block, cfg.n_layer, cfg.n_head, cfg.n_embd, cfg.dropout,
+                attn_dropout=attn_dropout_for(cfg, "cpu"), checkpoint_every=args.every).train()
+    opt = torch.optim.AdamW(m.parameters(), lr=cfg.lr)
+    for p in m.parameters():       # one zero-grad step allocates AdamW's state before the baseline
+        p.grad = torch.zeros_like(p)
+    opt.step(); opt.zero_grad(set_to_none=True)
+    x = torch.randint(0, args.vocab, (args.batch, args.block))
+    # two documents per row, as sft_batching="pack" produces: SDPA then takes the explicit-mask path
+    seg = (torch.arange(args.block) >= args.block // 2).long().add(1).expand(args.batch, -1) if args.packed else None
+    amp = torch.autocast("cpu", dtype=torch.bfloat16) if args.amp else nullcontext()
+    def step():
+        with amp:
+            _, loss = m(x, x, segment_ids=seg)
+        opt.zero_grad(set_to_none=True); loss.backward(); opt.step()
+    base = _rss_mb()
+    step()   # warm-up (also the first peak)
+    ts = []
+    for _ in range(args.reps):
+        t0 = time.perf_counter(); step(); ts.append(time.perf_counter() - t0)
+    peak = _rss_mb()
+    print(f"{min(ts) * 1000:.1f} {peak:.0f} {peak - base:.0f}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", default="192,384,768", help="context lengths to try")
+    ap.add_argument("--every", default="0,2,1", help="checkpoint_every values (0 = off)")
+    ap.add_argument("--batch", type=int, default=cfg.batch_size)
+    ap.add_argument("--vocab", type=int, default=0, help="vocab size (0 = the trained tokenizer's)")
+    ap.add_argument("--reps", type=int, default=3)
+    ap.add_argument("--threads", type=int, default=0, help="torch threads (0 = torch default)")
+    ap.add_argument("--amp", action="store_true", help="bf16 autocast")
+    ap.add_argument("--packed", action="store_true", help="packed rows with a per-document attention mask")
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--block", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.worker:
+        args.every = int(args.every)
+        return worker(args)
+    if not args.vocab:
+        path = os.path.join(cfg.tokenizer_dir, "tokenizer.json")
+        args.vocab = AresTokenizer(path).vocab_size if os.path.exists(path) else 2048
+
+    print(f"model: {cfg.n_layer}L {cfg.n_head}H {cfg.n_embd}d vocab {args.vocab} | batch {args.batch}"
+          f" | {'bf16 autocast' if args.amp else 'fp32'}{' | packed rows' if args.packed else ''}")
+    print(f"{'block':>6} {'every':>6} {'ms/step':>9} {'tok/s':>8} {'peak MB':>8} {'act MB':>7} {'act vs off':>10}")
+    for block in [int(b) for b in args.blocks.split(",")]:
+        off = None
+        for every in [int(k) for k in args.every.split(",")]:
+            cmd = [sys.executable, "-m", "src.bench_memory", "--worker", "--block", str(block), "--every", str(every),
+                   "--batch", str(args.batch), "--vocab", str(args.vocab), "--reps", str(args.reps),
+                   "--threads", str(args.threads)] + (["--amp"] if args.amp else []) + (["--packed"] if args.packed else [])
+            r = subprocess.run(cmd, capture_output=True, text=True)
+            if r.returncode != 0:
+                print(f"{block:>6} {every:>6}   failed: {(r.stderr.strip().splitlines() or ['?'])[-1]}")
+                continue
+            ms, peak, act = map(float, r.stdout.split()[-3:])
+            off = act if every == 0 else off
+            rel = f"{act / off:9.0%}" if off else f"{'-':>9}"
+            print(f"{block:>6} {every or 'off':>6} {ms:>9.0f} {args.batch * block / (ms / 1000):>8.0f} "
+                  f"{peak:>8.0f} {act:>7.0f} {rel:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,129 @@
 # src/chat.py
-import torch
+import time, torch
 from src.infer import load_checkpoint, generate
 
 SYSTEM = "You are ARES, a concise, helpful, 100% local assistant."
+ROLE_TAGS = ("<|user|>", "<|assistant|>", "<|system|>")
+
+class ChatSession:
+    """
+    Conversation state kept as token ids plus the model's KV cache, across turns.
+    Each turn feeds only the tokens the cache hasn't seen (the new "<|user|> ...\n<|assistant|> "
+    plus the tail of the previous reply). Older turns are dropped only when the next prompt plus
+    `reserve` reply tokens would no longer fit in block_size; that shifts every position, so the
+    whole prompt is re-fed, and the trim goes down to half the budget so it happens rarely.
+    `reserve` defaults to each turn's max_new_tokens (at most half a block), and a reply is capped
+    at the room left in the block, so generation never slides the window and drops the cache.
+    """
+    def __init__(self, model, tok, system=SYSTEM, reserve=None, **gen_kwargs):
+        self.model, self.tok = model, tok
+        self.gen_kwargs = gen_kwargs
+        self.reserve = reserve
+        self.header = [tok.bos] + tok.encode_ids(f"<|system|> {system}\n", add_special=False)
+        self.turns = []          # token ids of each "<|user|> u\n<|assistant|> a\n"
+        self.cache = model.new_cache(1)
+        self.cached = []         # the ids currently held by self.cache (len == cache.pos)
+        self.stats = {}
+
+    @property
+    def ids(self):
+        return self.header + [i for turn in self.turns for i in turn]
+
+    def _fit(self, n_new, reserve):
+        """If the prompt plus `reserve` reply tokens overflows a block, drop the oldest turns."""
+        limit = self.model.block_size - reserve
+        if len(self.ids) + n_new <= limit:
+            return 0
+        dropped = 0
+        while self.turns and len(self.ids) + n_new > limit // 2:
+            self.turns.pop(0)
+            dropped += 1
+        if dropped:              # positions shift: nothing in the cache is valid any more
+            self.cache.reset()
+            self.cached = []
+        return dropped
+
+    def _sync(self, ids):
+        """Roll the cache back to the longest prefix it shares with `ids`."""
+        n = 0
+        for a, b in zip(self.cached, ids):
+            if a != b: break
+            n += 1
+        self.cache.pos = n
+        del self.cached[n:]
+
+    def reply(self, user, max_new_tokens=192):
+        tok = self.tok
+        new = tok.encode_ids(f"<|user|> {user}\n<|assistant|> ", add_special=False)
+        block = self.model.block_size
+        reserve = min(self.reserve if self.reserve is not None else max_new_tokens, block // 2)
+        dropped = self._fit(len(new), reserve)
+        prompt = self.ids + new
+        if len(prompt) < block:
+            max_new_tokens = min(max_new_tokens, block - len(prompt))
+        self._sync(prompt)
+        fed = len(prompt) - self.cache.pos
+
+        t0 = time.perf_counter()
+        first = []
+        def on_token(t, next_id):
+            if t == 0: first.append(time.perf_counter() - t0)
+        x = torch.tensor([prompt], dtype=torch.long, device=self.model.head.weight.device)
+        y = generate(self.model, x, max_new_tokens=max_new_tokens, cache=self.cache,
+                     on_token=on_token, stop_id=tok.eos, **self.gen_kwargs)[0].tolist()
+        # the cache holds y up to cache.pos, unless the reply ran past block_size (window slid)
+        self.cached = y[:self.cache.pos] if len(y) <= self.model.block_size else []
+        if not self.cached:
+            self.cache.reset()
+
+        gen = y[len(prompt):]
+        out = tok.decode(gen).strip("\r\n")
+        # If it generated role tags, cut at the first one
+        for tag in ROLE_TAGS:
+            if tag in out:
+                out = out.split(tag)[0].strip()
+        if tok.decode(gen).strip("\r\n") != out:
+            gen = tok.encode_ids(out, add_special=False)
+        self.turns.append(new + gen + tok.encode_ids("\n", add_special=False))
+        self._sync(self.ids)
+
+        self.stats = {"prompt_tokens": len(prompt), "fed_tokens": fed, "dropped_turns": dropped,
+                      "ttft_s": first[0] if first else None, "total_s": time.perf_counter() - t0}
+        return out
 
 def main():
     device = "cuda" if torch.cuda.is_available() else "cpu"
     model, tok = load_checkpoint(device=device)
-    history = []
-
-    # Ban PAD/BOS and role tokens from sampling; EOS is used only to stop
-    model, tok = load_checkpoint(device=device)
 
     # Ban specials (keep EOS for stopping)
     ban_ids = [tok.pad, tok.bos, tok.system, tok.user, tok.assistant]
 
     # Precompute token ids that decode to *only whitespace*
     id_to_ws = []
-    vocab = tok.tok.get_vocab()              # token -> id
-    inv = {i:t for t,i in vocab.items()}     # id -> token string (ByteLevel)
     for i in range(tok.vocab_size):
         s = tok.decode([i])                  # decode the single token
         if s.strip("") == "" and s != "":    # is whitespace-only?
             id_to_ws.append(i)
 
-    for maybe in ("system", "user", "assistant"):
-        if hasattr(tok, maybe):
-            ban_ids.append(getattr(tok, maybe))
+    session = ChatSession(
+        model, tok,
+        temperature=0.8,
+        top_k=40,
+        top_p=0.95,
+        ban_ids=ban_ids,
+        ws_ban_ids=id_to_ws,
+        min_tokens=12
+    )
 
     print("ARES (local). Type 'exit' to quit.")
     while True:
         user = input("you: ").strip()
         if user.lower() in {"exit","quit"}:
             break
-
-        prompt = f"<|system|> {SYSTEM}\n"
-        for (u, a) in history[-4:]:
-            prompt += f"<|user|> {u}\n<|assistant|> {a}\n"
-        prompt += f"<|user|> {user}\n<|assistant|> "
-
-        # IMPORTANT: add BOS only, NOT EOS (so the model can continue)
-        ids = [tok.bos] + tok.encode_ids(prompt, add_special=False)
-        x = torch.tensor([ids], dtype=torch.long, device=model.head.weight.device)
-
-        y = generate(
-            model, x,
-            max_new_tokens=192,
-            temperature=0.8,
-            top_k=40,
-            top_p=0.95,
-            stop_id=tok.eos,
-            ban_ids=ban_ids,
-            ws_ban_ids=id_to_ws, 
-            min_tokens=12
-        )[0].tolist()
-
-
-        out = tok.decode(y[len(ids):]).strip("\r\n")
-        # If it generated role tags, cut at the first one
-        for tag in ("<|user|>", "<|assistant|>", "<|system|>"):
-            if tag in out:
-                out = out.split(tag)[0].strip()
+        out = session.reply(user, max_new_tokens=model.block_size // 2)
         if not out:
             out = "(no output — try lower temperature or a longer max_new_tokens)"
         print("ARES:", out)
-        history.append((user, out))
 
 if __name__ == "__main__":
     main()
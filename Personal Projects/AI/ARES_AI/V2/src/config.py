@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 @dataclass
 class TrainConfig:
@@ -15,6 +16,10 @@ class TrainConfig:
     n_head: int = 4
     n_embd: int = 256
     dropout: float = 0.1
+    attn_dropout: Optional[float] = None  # dropout on attention probs; None = same as dropout
+    # activation checkpointing: recompute every k-th block in backward instead of storing its
+    # activations (1 = all blocks, 2 = every other, 0 = off); see `python -m src.bench_memory`
+    checkpoint_every: int = 0
 
     # train
     batch_size: int = 16
@@ -22,9 +27,22 @@ class TrainConfig:
     max_steps: int = 1200
     eval_every: int = 150
     ckpt_dir: str = "checkpoints"
+    # SFT batching: "pad" (pad each batch to its longest pair), "bucket" (batch pairs of similar
+    # length together) or "pack" (several pairs per block_size row, attention kept per pair)
+    sft_batching: str = "bucket"
 
     grad_accum = 1
     patience   = 5
 
+    # runtime / CPU profile (the cpu_* settings apply only when training runs on CPU)
+    cpu_threads: int = 0          # intra-op threads; 0 = torch default (one per physical core)
+    cpu_interop_threads: int = 1  # inter-op pool; the model is one sequential chain, 1 is enough
+    cpu_bf16: str = "auto"        # bf16 autocast on CPU: "auto" (if the CPU has native bf16), "on", "off"
+    cpu_fused_attn: bool = False  # drop attention-prob dropout on CPU so SDPA keeps its fused kernel
+    compile: bool = False         # torch.compile the model (needs a working C++ toolchain on CPU)
+    num_workers: int = -1         # DataLoader workers; -1 = auto (0 on Windows or <= 2 cores, else 2)
+    prefetch_factor: int = 4      # batches each worker keeps ready
+    log_every: int = 50           # steps between throughput / step-time reports
+
     
 cfg = TrainConfig()
@@ -1,5 +1,9 @@
 # Minimal eval: PPL over corpus + a tiny arithmetic EM
-import os, math, json, random, torch, numpy as np
+#   python -m src.eval                                  # whole corpus, stride = block/2
+#   python -m src.eval --max-tokens 20000 --stride 64   # quick check on the first 20k tokens
+import os, math, json, time, random, argparse, torch, numpy as np
+import torch.nn.functional as F
+from tqdm import tqdm
 from src.model import TinyGPT
 from src.tokenizer_util import AresTokenizer
 
@@ -8,32 +12,84 @@ def load_ckpt(path, device):
     m = TinyGPT(**ckpt["cfg"]).to(device); m.load_state_dict(ckpt["model"]); m.eval()
     tok = AresTokenizer(ckpt["tok_path"]); return m,tok
 
-@torch.no_grad()
-def perplexity(model, tok, text, block=256):
-    ids = tok.encode_ids(text, add_special=False)
-    if len(ids) <= block+1: return float("nan")
-    xs = torch.tensor([ids[:-1][:block]], dtype=torch.long)
-    ys = torch.tensor([ids[1:][:block]], dtype=torch.long)
-    logits, loss = model(xs, ys)
-    return float(torch.exp(loss))
+def encode_text(tok, text, max_tokens=None, chunk_chars=1 << 16):
+    """Token ids of `text`; with max_tokens, only as many newline-aligned chunks as needed are tokenized."""
+    if not max_tokens:
+        return tok.encode_ids(text, add_special=False)
+    ids, i = [], 0
+    while i < len(text) and len(ids) <= max_tokens:
+        j = text.find("\n", i + chunk_chars)
+        j = len(text) if j < 0 else j + 1
+        ids += tok.encode_ids(text[i:j], add_special=False)
+        i = j
+    return ids[:max_tokens + 1]
 
-def arithmetic_em(model, tok, n=20, device="cpu"):
+@torch.inference_mode()
+def perplexity(model, tok, text, block=None, stride=None, batch_size=16, max_tokens=None, progress=True):
+    """
+    Sliding-window perplexity over the whole token stream (or its first max_tokens tokens).
+    Windows of `block` tokens advance by `stride`; every token is predicted exactly once, by the
+    window that sees the most context for it (the first window scores all of its positions, later
+    ones only their last `stride`). Windows run `batch_size` at a time.
+    """
+    ids = encode_text(tok, text, max_tokens)
+    L = len(ids) - 1                                   # predicted positions
+    if L < 1: return float("nan")
+    block = min(block or model.block_size, model.block_size, L)
+    stride = max(1, min(stride or block // 2, block))
+    starts = list(range(0, L - block, stride)) + [L - block]
+    skip, prev_end = [], 0                             # leading positions already scored
+    for st in starts:
+        skip.append(prev_end - st if prev_end > st else 0)
+        prev_end = st + block
+    device = model.head.weight.device
+    ids = torch.tensor(ids, dtype=torch.long, device=device)
+    ar = torch.arange(block, device=device)
+
+    nll, scored = 0.0, 0
+    t0 = time.perf_counter()
+    bar = tqdm(total=L, desc="ppl", unit="tok", dynamic_ncols=True, disable=not progress)
+    for i in range(0, len(starts), batch_size):
+        st = torch.tensor(starts[i:i+batch_size], device=device)[:, None] + ar
+        x, y = ids[st], ids[st + 1]
+        y[ar[None] < torch.tensor(skip[i:i+batch_size], device=device)[:, None]] = -100
+        logits, _ = model(x)
+        nll += float(F.cross_entropy(logits.flatten(0, 1), y.flatten(), ignore_index=-100, reduction="sum"))
+        n = int((y != -100).sum())
+        scored += n
+        bar.update(n)
+        bar.set_postfix(ppl=f"{math.exp(nll / scored):.2f}")
+    bar.close()
+    dt = time.perf_counter() - t0
+    if progress:
+        print(f"[ppl] {scored} tokens | block {block} stride {stride} | {len(starts)} windows | "
+              f"{scored / dt:.0f} tok/s ({dt:.1f}s)")
+    return math.exp(nll / scored)
+
+def arithmetic_em(model, tok, n=20, device="cpu", batch_size=32):
+    from src.infer import generate
+    pairs = [(random.randint(10,99), random.randint(10,99)) for _ in range(n)]
+    prompts = [tok.encode_ids(f"<|system|> You are ARES.\n<|user|> What is {a} + {b}?\n<|assistant|> ")
+               for a,b in pairs]
     correct = 0
-    for _ in range(n):
-        a,b = random.randint(10,99), random.randint(10,99)
-        prompt = f"<|system|> You are ARES.\n<|user|> What is {a} + {b}?\n<|assistant|> "
-        ids = tok.encode_ids(prompt); x = torch.tensor([ids], dtype=torch.long, device=device)
-        from src.infer import generate
-        y = generate(model, x, 16, 0.7, 20)[0].tolist()
-        out = tok.decode(y[len(ids):]).strip().split()[0]
-        try:
-            if int(out) == a+b: correct += 1
-        except: pass
+    for i in range(0, n, batch_size):   # one padded batch per chunk instead of one prompt at a time
+        ys = generate(model, prompts[i:i+batch_size], 16, 0.7, 20, pad_id=tok.pad)
+        for (a,b), ids, y in zip(pairs[i:i+batch_size], prompts[i:i+batch_size], ys):
+            try:
+                if int(tok.decode(y[len(ids):]).strip().split()[0]) == a+b: correct += 1
+            except: pass
     return correct, n
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ckpt", default=None, help="default: checkpoints/best_sft.pt, else best.pt")
+    ap.add_argument("--stride", type=int, default=None, help="window step in tokens (default block/2)")
+    ap.add_argument("--batch-size", type=int, default=16, help="windows per forward pass")
+    ap.add_argument("--max-tokens", type=int, default=None, help="score only the first N tokens")
+    args = ap.parse_args()
+
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    ckpt = "checkpoints/best_sft.pt"
+    ckpt = args.ckpt or "checkpoints/best_sft.pt"
     if not os.path.exists(ckpt): ckpt = "checkpoints/best.pt"
     if not os.path.exists(ckpt): raise SystemExit("No checkpoint found.")
     model, tok = load_ckpt(ckpt, device)
@@ -41,7 +97,8 @@ def main():
     cpath = "data/processed/corpus.txt"
     if os.path.exists(cpath):
         with open(cpath,"r",encoding="utf-8") as f: txt = f.read()
-    ppl = perplexity(model, tok, txt) if txt else float("nan")
+    ppl = perplexity(model, tok, txt, stride=args.stride, batch_size=args.batch_size,
+                     max_tokens=args.max_tokens) if txt else float("nan")
     correct, n = arithmetic_em(model, tok, 20, device)
     print(f"PPL (corpus): {ppl:.3f}")
     print(f"Arithmetic EM: {correct}/{n}")
@@ -13,11 +13,47 @@ def _apply_bans(logits, ban_ids):
 def generate(
     model, idx, max_new_tokens=128, temperature=0.8,
     top_k=40, top_p=0.95, stop_id=None, ban_ids=None,
-    min_tokens=8, ws_ban_ids=None
+    min_tokens=8, ws_ban_ids=None, use_cache=True, cache=None, on_token=None, pad_id=0
 ):
+    # use_cache: prefill the prompt once, then feed one token per step through the KV cache.
+    # Same tokens as the uncached path; once the context outgrows block_size the window slides
+    # (positions shift), so from then on every step re-prefills the last block_size tokens.
+    # cache: a KVCache that already holds idx[:, :cache.pos] (e.g. earlier chat turns); only the
+    # rest of idx is fed. on_token(t, next_id) is called after each sampled token.
+    # idx may also be a list of prompts (id lists of any length): they are left-padded with pad_id
+    # behind an attention mask and come back as a list of prompt + continuation id lists.
+    # Every row stops on its own at stop_id and leaves the batch; in a tensor result rows that
+    # stopped early are filled with stop_id.
+    as_list = not torch.is_tensor(idx)
+    if as_list:
+        lens = [len(p) for p in idx]
+        T0 = max(lens)
+        idx = torch.tensor([[pad_id] * (T0 - len(p)) + list(p) for p in idx],
+                           dtype=torch.long, device=model.head.weight.device)
+    B, T0 = idx.shape
+    out = torch.full((B, T0 + max_new_tokens), pad_id if stop_id is None else stop_id,
+                     dtype=idx.dtype, device=idx.device)
+    out[:, :T0] = idx
+    valid = None                      # real-token mask, only needed when prompts were padded
+    if as_list and min(lens) < T0:
+        valid = torch.ones(out.shape, dtype=torch.bool, device=idx.device)
+        for i, L in enumerate(lens):
+            valid[i, :T0 - L] = False
+    n = T0
+    rows = torch.arange(B, device=idx.device)   # batch rows still generating
+    ends = [None] * B                 # column where each finished row stopped
+    if cache is None and use_cache:
+        cache = model.new_cache(B)
+    a = 0                             # out[rows, a:n] = tokens not yet in the cache
+    if cache is not None:
+        cache.pos = min(cache.pos, T0 - 1)   # always feed at least one token to get logits
+        a = cache.pos
     for t in range(max_new_tokens):
-        idx_cond = idx[:, -model.block_size:]
-        logits, _ = model(idx_cond)
+        if cache is None or cache.pos + (n - a) > model.block_size:
+            a = max(0, n - model.block_size)
+            if cache is not None: cache.reset()
+        mask = valid[rows, a:n] if valid is not None else None
+        logits, _ = model(out[rows, a:n], cache=cache, attn_mask=mask)
         logits = logits[:, -1, :] / max(1e-5, temperature)
 
         # Always ban specials
@@ -46,12 +82,29 @@ def generate(
 
         probs = torch.softmax(logits, dim=-1)
         next_id = torch.multinomial(probs, num_samples=1)
+        if on_token is not None:
+            on_token(t, next_id)
 
-        if stop_id is not None and t >= min_tokens and int(next_id[0, 0]) == stop_id:
-            break
-
-        idx = torch.cat([idx, next_id], dim=1)
-    return idx
+        stop = None
+        if stop_id is not None and t >= min_tokens:
+            stop = next_id[:, 0] == stop_id
+        if stop is None or not stop.any():
+            out[rows, n] = next_id[:, 0]
+        else:
+            for r in rows[stop].tolist():
+                ends[r] = n
+            go = (~stop).nonzero()[:, 0]
+            if len(go) == 0:
+                break
+            rows = rows[go]
+            out[rows, n] = next_id[go, 0]
+            if cache is not None: cache.keep(go)
+        a = n
+        n += 1
+    ends = [n if e is None else e for e in ends]
+    if as_list:
+        return [out[i, T0 - L:e].tolist() for i, (L, e) in enumerate(zip(lens, ends))]
+    return out[:, :max(ends)]
 
 def load_checkpoint(path="checkpoints/best_sft.pt", device="cpu"):
     ckpt = torch.load(path, map_location=device)
@@ -1,36 +1,83 @@
-import math, torch
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+class KVCache:
+    """
+    Preallocated per-layer key/value buffers for incremental decoding; `pos` = positions filled.
+    `valid` (batch × max_len, bool) marks real tokens once a padded batch has been fed.
+    """
+    def __init__(self, n_layer, batch, n_head, head_dim, max_len, device=None, dtype=None):
+        shape = (n_layer, batch, n_head, max_len, head_dim)
+        self.k = torch.zeros(shape, device=device, dtype=dtype)
+        self.v = torch.zeros(shape, device=device, dtype=dtype)
+        self.valid = None
+        self.max_len = max_len
+        self.pos = 0
+
+    def reset(self):
+        self.pos = 0
+        self.valid = None
+
+    def keep(self, rows):
+        """Keep only batch rows `rows` (finished sequences drop out of the batch)."""
+        self.k = self.k[:, rows]
+        self.v = self.v[:, rows]
+        if self.valid is not None:
+            self.valid = self.valid[rows]
 
 class CausalSelfAttention(nn.Module):
-    def __init__(self, n_embd, n_head, dropout, block_size):
+    def __init__(self, n_embd, n_head, dropout):
         super().__init__()
         self.n_head = n_head
-        self.key = nn.Linear(n_embd, n_embd)
-        self.query = nn.Linear(n_embd, n_embd)
-        self.value = nn.Linear(n_embd, n_embd)
-        self.attn_drop = nn.Dropout(dropout)
+        # dropout here is on the attention probabilities; on CPU any value > 0 makes SDPA fall back
+        # to its unfused math path (full T×T matrix), hence TrainConfig.cpu_fused_attn
+        self.qkv = nn.Linear(n_embd, 3*n_embd)     # fused query/key/value projection
+        self.attn_dropout = dropout
         self.resid_drop = nn.Dropout(dropout)
         self.proj = nn.Linear(n_embd, n_embd)
-        self.register_buffer("mask", torch.tril(torch.ones(block_size, block_size)).view(1,1,block_size,block_size))
+        self._register_load_state_dict_pre_hook(self._upgrade_state_dict)
+
+    @staticmethod
+    def _upgrade_state_dict(state_dict, prefix, *args):
+        # checkpoints from before the fused projection: separate query/key/value Linears + a mask buffer
+        for name in ("weight", "bias"):
+            parts = [state_dict.pop(f"{prefix}{m}.{name}", None) for m in ("query", "key", "value")]
+            if all(t is not None for t in parts):
+                state_dict[f"{prefix}qkv.{name}"] = torch.cat(parts, dim=0)
+        state_dict.pop(f"{prefix}mask", None)
 
-    def forward(self, x):
+    def forward(self, x, cache=None, layer=0, mask=None):
+        # mask: optional bool (B, 1, T, keys) of allowed query->key pairs; replaces the causal default
         B,T,C = x.size()
-        k = self.key(x).view(B,T,self.n_head,C//self.n_head).transpose(1,2)
-        q = self.query(x).view(B,T,self.n_head,C//self.n_head).transpose(1,2)
-        v = self.value(x).view(B,T,self.n_head,C//self.n_head).transpose(1,2)
-        att = (q @ k.transpose(-2,-1)) / math.sqrt(k.size(-1))
-        att = att.masked_fill(self.mask[:,:,:T,:T]==0, float("-inf"))
-        att = torch.softmax(att, dim=-1)
-        att = self.attn_drop(att)
-        y = att @ v
+        q, k, v = self.qkv(x).view(B,T,3,self.n_head,C//self.n_head).permute(2,0,3,1,4)
+        p = 0
+        if cache is not None:
+            # append this chunk's keys/values at the cache offset, attend over everything so far
+            p = cache.pos
+            cache.k[layer, :, :, p:p+T] = k
+            cache.v[layer, :, :, p:p+T] = v
+            k = cache.k[layer, :, :, :p+T]
+            v = cache.v[layer, :, :, :p+T]
+        drop = self.attn_dropout if self.training else 0.0
+        if mask is not None:
+            y = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=drop)
+        elif p == 0:
+            y = F.scaled_dot_product_attention(q, k, v, dropout_p=drop, is_causal=True)
+        elif T == 1:   # one new token sees every cached position
+            y = F.scaled_dot_product_attention(q, k, v, dropout_p=drop)
+        else:          # chunk at offset p: query i sees keys 0..p+i (is_causal would align at 0)
+            mask = torch.ones(T, p+T, dtype=torch.bool, device=x.device).tril(diagonal=p)
+            y = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=drop)
         y = y.transpose(1,2).contiguous().view(B,T,C)
         return self.resid_drop(self.proj(y))
 
 class Block(nn.Module):
-    def __init__(self, n_embd, n_head, dropout, block_size):
+    def __init__(self, n_embd, n_head, dropout, attn_dropout=None):
         super().__init__()
         self.ln1 = nn.LayerNorm(n_embd)
-        self.attn = CausalSelfAttention(n_embd,n_head,dropout,block_size)
+        self.attn = CausalSelfAttention(n_embd,n_head,dropout if attn_dropout is None else attn_dropout)
         self.ln2 = nn.LayerNorm(n_embd)
         self.mlp = nn.Sequential(
             nn.Linear(n_embd, 4*n_embd),
@@ -38,28 +85,96 @@ class Block(nn.Module):
             nn.Linear(4*n_embd, n_embd),
             nn.Dropout(dropout),
         )
-    def forward(self, x):
-        x = x + self.attn(self.ln1(x))
+    def forward(self, x, cache=None, layer=0, mask=None):
+        x = x + self.attn(self.ln1(x), cache, layer, mask)
         x = x + self.mlp(self.ln2(x))
         return x
 
 class TinyGPT(nn.Module):
-    def __init__(self, vocab_size, block_size, n_layer, n_head, n_embd, dropout=0.1):
+    def __init__(self, vocab_size, block_size, n_layer, n_head, n_embd, dropout=0.1, attn_dropout=None,
+                 checkpoint_every=0):
         super().__init__()
         self.tok_emb = nn.Embedding(vocab_size, n_embd)
         self.pos_emb = nn.Embedding(block_size, n_embd)
         self.drop = nn.Dropout(dropout)
-        self.blocks = nn.ModuleList([Block(n_embd,n_head,dropout,block_size) for _ in range(n_layer)])
+        self.blocks = nn.ModuleList([Block(n_embd,n_head,dropout,attn_dropout) for _ in range(n_layer)])
         self.ln_f = nn.LayerNorm(n_embd)
         self.head = nn.Linear(n_embd, vocab_size, bias=False)
         self.block_size = block_size
+        # activation checkpointing (training only): every k-th block keeps just its input and reruns
+        # its forward during backward, so its attention/MLP activations are never held. 0 = off.
+        self.checkpoint_every = checkpoint_every
+
+    def _checkpointed(self, i):
+        k = self.checkpoint_every
+        return k > 0 and i % k == 0 and self.training and torch.is_grad_enabled()
+
+    def new_cache(self, batch=1):
+        """Empty KVCache sized for a full block, on the model's device/dtype."""
+        blk = self.blocks[0].attn
+        w = self.head.weight
+        return KVCache(len(self.blocks), batch, blk.n_head, w.size(1) // blk.n_head,
+                       self.block_size, device=w.device, dtype=w.dtype)
+
+    def _padding_mask(self, valid, start, T):
+        """
+        Attention mask + position ids for left-padded rows. valid: (B, start+T) bool, real tokens.
+        Positions count real tokens only, so a padded row is seen exactly like an unpadded one.
+        """
+        pos = (valid.long().cumsum(1) - 1).clamp(min=0)[:, start:]
+        causal = torch.ones(T, start+T, dtype=torch.bool, device=valid.device).tril(diagonal=start)
+        mask = causal[None] & valid[:, None, :]
+        # padding queries see no real key; let them see themselves so softmax stays finite
+        mask[:, torch.arange(T), torch.arange(start, start+T)] = True
+        return mask[:, None], pos
+
+    @staticmethod
+    def _segment_mask(seg):
+        """
+        Block-diagonal causal mask + per-segment positions for packed rows. seg: (B, T) ints, equal
+        within one packed document; a token sees only earlier tokens of its own document, and
+        positions restart at 0 where a new document begins.
+        """
+        B,T = seg.shape
+        t = torch.arange(T, device=seg.device)
+        new = torch.ones_like(seg, dtype=torch.bool)
+        new[:, 1:] = seg[:, 1:] != seg[:, :-1]
+        first = torch.cummax(torch.where(new, t, torch.zeros_like(t)), dim=1).values
+        causal = torch.ones(T, T, dtype=torch.bool, device=seg.device).tril()
+        mask = causal[None] & (seg[:, :, None] == seg[:, None, :])
+        return mask[:, None], t - first
 
-    def forward(self, idx, targets=None):
+    def forward(self, idx, targets=None, cache=None, attn_mask=None, segment_ids=None):
+        # with a cache, idx holds only the new tokens; they sit at positions cache.pos.. and the
+        # cache advances past them (caller keeps cache.pos + T <= block_size).
+        # attn_mask: optional (B, T) bool, False at (left-)padding; with a cache it is remembered
+        # for later steps, which only pass their new tokens.
+        # segment_ids: optional (B, T) document ids of packed training rows (no cache).
         B,T = idx.shape
-        pos = torch.arange(0,T, device=idx.device)
-        x = self.tok_emb(idx) + self.pos_emb(pos)[None,:,:]
+        start = cache.pos if cache is not None else 0
+        if start + T > self.block_size:
+            raise ValueError(f"sequence of {start + T} tokens exceeds block_size {self.block_size}")
+        mask = None
+        if segment_ids is not None:
+            mask, pos = self._segment_mask(segment_ids)
+        elif cache is not None and (attn_mask is not None or cache.valid is not None):
+            if cache.valid is None:
+                cache.valid = torch.ones(B, cache.max_len, dtype=torch.bool, device=idx.device)
+            cache.valid[:, start:start+T] = True if attn_mask is None else attn_mask
+            mask, pos = self._padding_mask(cache.valid[:, :start+T], start, T)
+        elif attn_mask is not None:
+            mask, pos = self._padding_mask(attn_mask, 0, T)
+        else:
+            pos = torch.arange(start, start+T, device=idx.device)[None]
+        x = self.tok_emb(idx) + self.pos_emb(pos)
         x = self.drop(x)
-        for blk in self.blocks: x = blk(x)
+        for i, blk in enumerate(self.blocks):
+            if cache is None and self._checkpointed(i):
+                # non-reentrant + saved RNG state: the recomputed dropout masks match the originals
+                x = checkpoint(blk, x, None, i, mask, use_reentrant=False)
+            else:
+                x = blk(x, cache, i, mask)
+        if cache is not None: cache.pos = start + T
         x = self.ln_f(x)
         logits = self.head(x)
         if targets is None: return logits, None
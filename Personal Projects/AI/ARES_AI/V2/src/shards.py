@@ -0,0 +1,141 @@
+# Pre-tokenized corpus: uint16 token shards + index.json, memory-mapped for training
+#   python -m src.shards                 # tokenize data/processed/corpus.txt once (skipped if current)
+#   python -m src.shards --force
+# Layout: data/processed/tokens/<tokenizer hash>/{index.json, shard_00000.bin, ...}
+# The index records the tokenizer hash and the source file's size/mtime, so a new tokenizer or an
+# edited corpus gets fresh shards and an unchanged one is reused as-is.
+import os, json, time, argparse, numpy as np, torch
+from src.tokenizer_util import AresTokenizer
+
+TOKENS_DIR = "data/processed/tokens"
+SHARD_TOKENS = 1 << 26          # 64M tokens = 128 MB per shard
+CHUNK_CHARS = 1 << 20           # text is tokenized ~1 MB at a time, split at blank lines
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _text_chunks(path):
+    """~CHUNK_CHARS pieces of the file, each ending at a blank line (paragraph boundary)."""
+    buf, n = [], 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            buf.append(line); n += len(line)
+            if n >= CHUNK_CHARS and not line.strip():
+                yield "".join(buf); buf, n = [], 0
+    if buf: yield "".join(buf)
+
+def shard_dir(tok):
+    return os.path.join(TOKENS_DIR, tok.hash)
+
+def build_shards(tok, src, out_dir=None, shard_tokens=SHARD_TOKENS):
+    """Tokenize `src` into uint16 shards under out_dir (streamed: the corpus never sits in RAM)."""
+    if tok.vocab_size > np.iinfo(np.uint16).max + 1:
+        raise ValueError(f"vocab of {tok.vocab_size} does not fit in uint16 shards")
+    out_dir = out_dir or shard_dir(tok)
+    os.makedirs(out_dir, exist_ok=True)
+    shards, f, used = [], None, 0
+    def close():
+        if f is not None:
+            f.close(); shards.append({"file": name, "tokens": used})
+    t0 = time.time()
+    for chunk in _text_chunks(src):
+        ids = np.asarray(tok.encode_ids(chunk, add_special=False), dtype=np.uint16)
+        while len(ids):
+            if f is None or used == shard_tokens:
+                close()
+                name = f"shard_{len(shards):05d}.bin"
+                f, used = open(os.path.join(out_dir, name), "wb"), 0
+            take = ids[:shard_tokens - used]
+            take.tofile(f); used += len(take)
+            ids = ids[len(take):]
+    close()
+    index = {"tokenizer_hash": tok.hash, "vocab_size": tok.vocab_size, "dtype": "uint16",
+             "source": _source_stamp(src), "shards": shards,
+             "total_tokens": sum(s["tokens"] for s in shards)}
+    with open(os.path.join(out_dir, "index.json.tmp"), "w", encoding="utf-8") as fh:
+        json.dump(index, fh, indent=2)
+    os.replace(os.path.join(out_dir, "index.json.tmp"), os.path.join(out_dir, "index.json"))
+    # a rebuild over an earlier, longer build leaves its extra shards behind; the index no longer
+    # lists them, so they are only wasted disk that looks like data
+    live = {s["file"] for s in shards}
+    for name in os.listdir(out_dir):
+        if name.startswith("shard_") and name.endswith(".bin") and name not in live:
+            os.remove(os.path.join(out_dir, name))
+    print(f"[shards] {index['total_tokens']} tokens -> {len(shards)} shard(s) in {out_dir} ({time.time() - t0:.1f}s)")
+    return index
+
+def ensure_shards(tok, src, force=False):
+    """Shard directory for (tokenizer, src), building it only if missing or stale."""
+    out_dir = shard_dir(tok)
+    try:
+        with open(os.path.join(out_dir, "index.json"), "r", encoding="utf-8") as fh:
+            index = json.load(fh)
+        current = index["tokenizer_hash"] == tok.hash and index["source"] == _source_stamp(src)
+    except (OSError, ValueError, KeyError):
+        current = False
+    if force or not current:
+        build_shards(tok, src, out_dir)
+    return out_dir
+
+class TokenShards:
+    """
+    Read-only view of a shard directory. Shards are np.memmap'd, so only the pages a batch touches
+    are read. Token ranges use global offsets into the concatenated stream; windows never straddle
+    a shard boundary.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as fh:
+            self.index = json.load(fh)
+        self.shards = [np.memmap(os.path.join(path, s["file"]), dtype=np.uint16, mode="r", shape=(s["tokens"],))
+                       for s in self.index["shards"]]
+        self.offsets = np.cumsum([0] + [len(s) for s in self.shards])
+
+    def __len__(self): return int(self.offsets[-1])
+
+    def segments(self, lo, hi, block):
+        """(shard, start, end) pieces of global range [lo, hi) long enough for one x/y window."""
+        out = []
+        for i, s in enumerate(self.shards):
+            a = max(lo, self.offsets[i]) - self.offsets[i]
+            b = min(hi, self.offsets[i + 1]) - self.offsets[i]
+            if b - a >= block + 1: out.append((i, int(a), int(b)))
+        if not out: raise ValueError(f"no room for a {block}-token window in [{lo}, {hi})")
+        return out
+
+    def _gather(self, shard, starts, block):
+        rows = self.shards[shard][starts[:, None] + np.arange(block + 1)]   # one fancy-index gather
+        return torch.from_numpy(rows.astype(np.int64))
+
+    def sample(self, batch, block, lo=0, hi=None, rng=None):
+        """Random (x, y) LongTensors of shape (batch, block) from windows inside [lo, hi)."""
+        rng = rng or np.random.default_rng()
+        segs = self.segments(lo, len(self) if hi is None else hi, block)
+        room = np.array([b - a - block for _, a, b in segs], dtype=np.float64)
+        which = rng.choice(len(segs), size=batch, p=room / room.sum())
+        xy = torch.empty((batch, block + 1), dtype=torch.long)
+        for k in np.unique(which):
+            rows = np.nonzero(which == k)[0]
+            shard, a, b = segs[k]
+            xy[rows] = self._gather(shard, rng.integers(a, b - block, size=len(rows)), block)
+        return xy[:, :-1].contiguous(), xy[:, 1:].contiguous()
+
+    def iter_batches(self, batch, block, lo=0, hi=None):
+        """Non-overlapping windows covering [lo, hi) once, in order (for validation)."""
+        for shard, a, b in self.segments(lo, len(self) if hi is None else hi, block):
+            starts = np.arange(a, b - block, block)
+            for i in range(0, len(starts), batch):
+                xy = self._gather(shard, starts[i:i+batch], block)
+                yield xy[:, :-1].contiguous(), xy[:, 1:].contiguous()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--src", default="data/processed/corpus.txt")
+    ap.add_argument("--force", action="store_true", help="rebuild even if the shards are current")
+    args = ap.parse_args()
+    tok = AresTokenizer()
+    d = ensure_shards(tok, args.src, force=args.force)
+    print(f"[shards] {len(TokenShards(d))} tokens ready in {d}")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
+import os, hashlib
 from tokenizers import Tokenizer
 from tokenizers.decoders import ByteLevel as ByteLevelDecoder  # ⬅ add this
 
 class AresTokenizer:
     def __init__(self, path="tokenizer/tokenizer.json"):
         self.tok = Tokenizer.from_file(path)
+        self.path = path
         # Ensure proper decoding for ByteLevel BPE (fixes the 'Ġ' artifacts)
         try:
             # If a decoder wasn’t saved, attach one now:
@@ -27,10 +29,27 @@ class AresTokenizer:
     @property
     def vocab_size(self): return self.tok.get_vocab_size()
 
+    @property
+    def hash(self):
+        """Short content hash of tokenizer.json: keys on-disk token caches to this exact vocab."""
+        if not hasattr(self, "_hash"):
+            with open(self.path, "rb") as f:
+                self._hash = hashlib.sha256(f.read()).hexdigest()[:16]
+        return self._hash
+
     def encode_ids(self, text, add_special=True):
         ids = self.tok.encode(text).ids
         return ([self.bos] + ids + [self.eos]) if add_special else ids
 
+    def encode_batch(self, texts, add_special=True):
+        """encode_ids for many texts in one call; the tokenizer spreads the batch over its threads."""
+        if (os.cpu_count() or 1) == 1:   # nothing to spread over; the batch API only adds overhead
+            return [self.encode_ids(t, add_special) for t in texts]
+        encs = self.tok.encode_batch(list(texts))
+        if add_special:
+            return [[self.bos] + e.ids + [self.eos] for e in encs]
+        return [e.ids for e in encs]
+
     def decode(self, ids):
         # Drop BOS/EOS/PAD etc. when turning ids back into text
         return self.tok.decode(ids, skip_special_tokens=True)
@@ -1,12 +1,14 @@
 # V2/src/train_sft.py
-import os, math, json, time, torch, torch.nn.functional as F
+import os, math, json, time, bisect, hashlib, itertools, numpy as np, torch, torch.nn.functional as F
 from torch.utils.data import Dataset, DataLoader
 from tqdm import tqdm
 from src.model import TinyGPT
 from src.tokenizer_util import AresTokenizer
 from src.config import cfg
+from src.utils import setup_runtime, attn_dropout_for, loader_kwargs, maybe_compile, StepTimer
 
 INSTRUCTIONS = "data/processed/instructions.jsonl"
+SFT_CACHE = "data/processed/sft_cache"
 
 torch.backends.cuda.matmul.allow_tf32 = True
 try:
@@ -17,52 +19,153 @@ except Exception:
 from torch.amp import autocast, GradScaler
 
 # ---------------- Dataset ----------------
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(1 << 20), b""): h.update(b)
+    return h.hexdigest()[:16]
+
+def build_sft_cache(path, tok, block_size, out_dir):
+    """
+    Tokenize every pair (batched) into three arrays under out_dir:
+      tokens.npy  uint16, all x sequences back to back
+      offsets.npy int64,  x_i = tokens[offsets[i]:offsets[i+1]]
+      masked.npy  int32,  y_i = x_i with its first masked[i] positions set to -100 (the prompt)
+    """
+    prompts, responses = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            j = json.loads(line)
+            prompts.append(j["prompt"]); responses.append(j["response"])
+    P = tok.encode_batch(prompts, add_special=False)
+    R = tok.encode_batch(responses, add_special=False)
+    seqs, masked = [], np.empty(len(P), dtype=np.int32)
+    for i, (p, r) in enumerate(zip(P, R)):
+        x = p + r + [tok.eos]
+        cut = max(0, len(x) - block_size)          # over-long pairs keep their tail, as before
+        seqs.append(x[cut:] if cut else x)
+        masked[i] = max(0, len(p) - cut)
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in seqs], out=offsets[1:])
+    tokens = np.fromiter(itertools.chain.from_iterable(seqs), dtype=np.uint16, count=int(offsets[-1]))
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in (("tokens", tokens), ("offsets", offsets), ("masked", masked)):
+        np.save(os.path.join(out_dir, f"{name}.tmp.npy"), arr)
+    for name in ("tokens", "offsets", "masked"):   # offsets last: its presence marks a complete cache
+        os.replace(os.path.join(out_dir, f"{name}.tmp.npy"), os.path.join(out_dir, f"{name}.npy"))
+
 class SFTDataset(Dataset):
-    def __init__(self, path, tok, block_size):
+    """
+    (x, y) pairs from instructions.jsonl, tokenized once into an on-disk cache keyed by the file's
+    hash, the tokenizer's hash and block_size; later runs memory-map it and skip tokenization.
+    Items are int64 numpy arrays; y masks the prompt with -100.
+    """
+    def __init__(self, path, tok, block_size, cache_dir=SFT_CACHE):
         self.tok, self.block = tok, block_size
-        self.data = []
         if not os.path.exists(path):
             raise FileNotFoundError(f"Missing {path}. Run ingest_dialogue / make_instructions first.")
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                j = json.loads(line)
-                prompt_ids = tok.encode_ids(j["prompt"], add_special=False)
-                resp_ids   = tok.encode_ids(j["response"], add_special=False) + [tok.eos]
-                x = prompt_ids + resp_ids
-                y = [-100]*len(prompt_ids) + resp_ids[:]
-                if len(x) > block_size:
-                    x = x[-block_size:]; y = y[-block_size:]
-                self.data.append((x, y))
-    def __len__(self): return len(self.data)
-    def __getitem__(self, i): return self.data[i]
+        d = os.path.join(cache_dir, f"{_file_hash(path)}_{tok.hash}_b{block_size}")
+        if not os.path.exists(os.path.join(d, "offsets.npy")):
+            t0 = time.time()
+            build_sft_cache(path, tok, block_size, d)
+            print(f"[sft] tokenized {path} -> {d} ({time.time()-t0:.2f}s)")
+        self.tokens = np.load(os.path.join(d, "tokens.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(d, "offsets.npy"))
+        self.masked = np.load(os.path.join(d, "masked.npy"))
+    def __len__(self): return len(self.offsets) - 1
+    def __getitem__(self, i):
+        x = self.tokens[self.offsets[i]:self.offsets[i+1]].astype(np.int64)
+        y = x.copy(); y[:self.masked[i]] = -100
+        return x, y
+    @property
+    def lengths(self): return np.diff(self.offsets)
+
+# ---------------- Batching modes (cfg.sft_batching) ----------------
+class LengthBucketSampler:
+    """
+    Batch sampler for "bucket": each epoch shuffles the pairs, sorts every window of `bucket`
+    batches' worth by length, cuts it into batches and shuffles the batches, so a batch holds
+    pairs of similar length (little padding) while batch order stays random.
+    """
+    def __init__(self, lengths, batch_size, bucket=50, seed=1337):
+        self.lengths, self.bs, self.bucket, self.seed, self.epoch = np.asarray(lengths), batch_size, bucket, seed, 0
+    def __len__(self): return (len(self.lengths) + self.bs - 1) // self.bs
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch); self.epoch += 1
+        order = rng.permutation(len(self.lengths))
+        w = self.bs * self.bucket
+        batches = []
+        for i in range(0, len(order), w):
+            chunk = order[i:i+w]
+            chunk = chunk[np.argsort(self.lengths[chunk], kind="stable")]
+            batches += [chunk[j:j+self.bs].tolist() for j in range(0, len(chunk), self.bs)]
+        for k in rng.permutation(len(batches)):
+            yield batches[k]
+
+def pack_rows(lengths, block_size):
+    """Best-fit decreasing: group pair indices into rows whose total length fits block_size."""
+    rows, free = [], []                      # free: sorted (space left, row id)
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        k = bisect.bisect_left(free, (lengths[i], -1))
+        if k == len(free):
+            rows.append([i]); r, left = len(rows) - 1, block_size - lengths[i]
+        else:
+            left, r = free.pop(k); rows[r].append(i); left -= lengths[i]
+        bisect.insort(free, (left, r))
+    return rows
+
+class PackedSFT(Dataset):
+    """
+    Rows for "pack": several pairs back to back in one block_size row. Each item is (x, y, seg):
+    seg numbers the pairs 1, 2, ... so the model masks attention across pairs and restarts
+    positions for each; every pair keeps its own -100 prompt mask.
+    """
+    def __init__(self, ds, block_size):
+        self.ds = ds
+        lengths = [len(ds[i][0]) for i in range(len(ds))]
+        self.rows = pack_rows(lengths, block_size)
+    def __len__(self): return len(self.rows)
+    def __getitem__(self, r):
+        items = [self.ds[i] for i in self.rows[r]]
+        seg = np.concatenate([np.full(len(x), k + 1, dtype=np.int64) for k, (x, _) in enumerate(items)])
+        return np.concatenate([x for x, _ in items]), np.concatenate([y for _, y in items]), seg
 
 # ---------------- Collate (top-level; Windows-safe) ----------------
 PAD_ID = 0
 BLOCK_SIZE = 256
 def collate(batch):
     cur_max = min(max(len(x) for x,_ in batch), BLOCK_SIZE)
-    X, Y = [], []
-    for x, y in batch:
+    X = torch.full((len(batch), cur_max), PAD_ID, dtype=torch.long)
+    Y = torch.full((len(batch), cur_max), -100, dtype=torch.long)
+    for i, (x, y) in enumerate(batch):
         x = x[-cur_max:]; y = y[-cur_max:]
-        X.append(x + [PAD_ID]*(cur_max - len(x)))
-        Y.append(y + [-100]   *(cur_max - len(y)))
-    return torch.tensor(X, dtype=torch.long), torch.tensor(Y, dtype=torch.long)
+        X[i, :len(x)] = torch.as_tensor(x); Y[i, :len(y)] = torch.as_tensor(y)
+    return X, Y
+
+def collate_packed(batch):
+    cur_max = min(max(len(x) for x,_,_ in batch), BLOCK_SIZE)
+    X = torch.full((len(batch), cur_max), PAD_ID, dtype=torch.long)
+    Y = torch.full((len(batch), cur_max), -100, dtype=torch.long)
+    S = torch.zeros((len(batch), cur_max), dtype=torch.long)   # 0 = padding
+    for i, (x, y, s) in enumerate(batch):
+        X[i, :len(x)] = torch.as_tensor(x); Y[i, :len(y)] = torch.as_tensor(y); S[i, :len(s)] = torch.as_tensor(s)
+    return X, Y, S
 
 @torch.no_grad()
-def evaluate(model, dl, device, use_amp):
+def evaluate(model, dl, device, amp_dtype):
     model.eval()
     losses = []
     for xb, yb in dl:
         xb = xb.to(device, non_blocking=True); yb = yb.to(device, non_blocking=True)
-        with autocast(device_type="cuda", enabled=use_amp):
+        with autocast(device_type=device, dtype=amp_dtype, enabled=amp_dtype is not None):
             logits, _ = model(xb)
             loss = F.cross_entropy(logits.view(-1, logits.size(-1)), yb.view(-1), ignore_index=-100)
         losses.append(loss.item())
     return sum(losses)/len(losses) if losses else math.inf
 
 def main():
-    device = "cuda" if (cfg.device == "cuda" and torch.cuda.is_available()) else "cpu"
-    use_amp = (device == "cuda")
+    device, amp_dtype = setup_runtime(cfg)   # applies the CPU profile (threads, bf16) on CPU
+    use_amp = amp_dtype is not None
     tok = AresTokenizer()
 
     global PAD_ID, BLOCK_SIZE
@@ -79,22 +182,32 @@ def main():
     gen = torch.Generator().manual_seed(getattr(cfg, "seed", 1337))
     train_ds, val_ds = torch.utils.data.random_split(ds, [train_size, val_size], generator=gen)
 
-    is_windows = (os.name == "nt")
-    num_workers = 0  # safest on Windows
-    pin = (device == "cuda")
-
     # Auto batch size so we always have batches
     cfg_bs = int(getattr(cfg, "batch_size", 8))
     bs  = max(1, min(cfg_bs, len(train_ds)))
     vbs = max(1, min(bs,     len(val_ds)))
 
-    print(f"[info] device={device} amp={use_amp} seed={getattr(cfg, 'seed', 1337)}")
+    loader_kw = loader_kwargs(cfg, device)
+    print(f"[info] device={device} amp={amp_dtype if use_amp else False} seed={getattr(cfg, 'seed', 1337)}"
+          + (f" threads={torch.get_num_threads()} workers={loader_kw['num_workers']}" if device == "cpu" else ""))
     print(f"[info] pairs: train={len(train_ds)} | val={len(val_ds)} | batch_size={bs}")
 
-    train_dl = DataLoader(train_ds, batch_size=bs, shuffle=True, drop_last=False,
-                          collate_fn=collate, num_workers=num_workers, pin_memory=pin, persistent_workers=False)
+    mode = getattr(cfg, "sft_batching", "pad")
+    if mode == "pack":
+        packed = PackedSFT(train_ds, cfg.block_size)
+        print(f"[info] packing: {len(train_ds)} pairs -> {len(packed)} rows of <= {cfg.block_size} tokens")
+        train_dl = DataLoader(packed, batch_size=bs, shuffle=True, drop_last=False,
+                              collate_fn=collate_packed, **loader_kw)
+    elif mode == "bucket":
+        sampler = LengthBucketSampler(ds.lengths[train_ds.indices], bs, seed=getattr(cfg, "seed", 1337))
+        train_dl = DataLoader(train_ds, batch_sampler=sampler, collate_fn=collate, **loader_kw)
+    elif mode == "pad":
+        train_dl = DataLoader(train_ds, batch_size=bs, shuffle=True, drop_last=False,
+                              collate_fn=collate, **loader_kw)
+    else:
+        raise SystemExit(f"unknown cfg.sft_batching={mode!r} (pad | bucket | pack)")
     val_dl   = DataLoader(val_ds,   batch_size=vbs, shuffle=False, drop_last=False,
-                          collate_fn=collate, num_workers=num_workers, pin_memory=pin, persistent_workers=False)
+                          collate_fn=collate, **loader_kw)
 
     # Safety: ensure we actually have batches
     if len(train_dl) == 0:
@@ -103,30 +216,24 @@ def main():
     model = TinyGPT(
         vocab_size=tok.vocab_size, block_size=cfg.block_size,
         n_layer=cfg.n_layer, n_head=cfg.n_head, n_embd=cfg.n_embd,
-        dropout=cfg.dropout
+        dropout=cfg.dropout, attn_dropout=attn_dropout_for(cfg, device),
+        checkpoint_every=getattr(cfg, "checkpoint_every", 0)
     ).to(device)
-
-    if getattr(cfg, "compile", False):
-        try: model = torch.compile(model)
-        except Exception as e: print(f"[warn] torch.compile disabled: {e}")
+    raw_model = model                  # saved without torch.compile's wrapper prefixes
+    model = maybe_compile(model, cfg)
 
     opt = torch.optim.AdamW(model.parameters(), lr=cfg.lr)
-    scaler = GradScaler(device="cuda") if use_amp else None
+    scaler = GradScaler(device="cuda") if device == "cuda" else None   # bf16 needs no loss scaling
     os.makedirs(cfg.ckpt_dir, exist_ok=True)
 
     # ------------ One-batch smoke test ------------
-    xb, yb = next(iter(train_dl))
-    xb = xb.to(device); yb = yb.to(device)
+    xb, yb, *sb = next(iter(train_dl))
+    xb = xb.to(device); yb = yb.to(device); sb = sb[0].to(device) if sb else None
     t0 = time.time()
-    if use_amp:
-        with autocast(device_type="cuda", enabled=True):
-            logits, _ = model(xb)
-            loss = F.cross_entropy(logits.view(-1, logits.size(-1)), yb.view(-1), ignore_index=-100)
-        (scaler or GradScaler(device="cuda")).scale(loss).backward()
-    else:
-        logits, _ = model(xb)
+    with autocast(device_type=device, dtype=amp_dtype, enabled=use_amp):
+        logits, _ = model(xb, segment_ids=sb)
         loss = F.cross_entropy(logits.view(-1, logits.size(-1)), yb.view(-1), ignore_index=-100)
-        loss.backward()
+    (scaler.scale(loss) if scaler else loss).backward()
     print(f"[sanity] 1st batch OK in {time.time()-t0:.2f}s | loss={float(loss):.3f}")
     opt.zero_grad(set_to_none=True)
 
@@ -138,47 +245,65 @@ def main():
 
     steps = 0
     pbar = tqdm(total=cfg.max_steps, desc="sft", dynamic_ncols=True)
+    # batch slots holding a real token vs padding, and label tokens actually trained on
+    n_real = n_slots = n_label = 0
+    t_train = time.time()
+    timer = StepTimer(device)
+    log_every = max(1, int(getattr(cfg, "log_every", 50)))
+    pending = 0                        # real tokens of the micro-batches since the last optimizer step
+
+    def report():
+        dt = time.time() - t_train
+        return (f"real-token ratio {n_real / max(1, n_slots):.1%} | "
+                f"{n_label / max(dt, 1e-9):.0f} label tok/s ({mode})")
 
     while steps < cfg.max_steps:
         model.train()
-        for xb, yb in train_dl:
+        for xb, yb, *sb in train_dl:
+            timer.lap("data")
+            real = int((sb[0] > 0).sum()) if sb else int((xb != PAD_ID).sum())
+            n_slots += xb.numel(); n_real += real; pending += real
+            n_label += int((yb != -100).sum())
             xb = xb.to(device, non_blocking=True); yb = yb.to(device, non_blocking=True)
+            sb = sb[0].to(device, non_blocking=True) if sb else None
 
-            if use_amp:
-                with autocast(device_type="cuda", enabled=True):
-                    logits, _ = model(xb)
-                    loss = F.cross_entropy(logits.view(-1, logits.size(-1)), yb.view(-1), ignore_index=-100) / grad_accum
-                scaler.scale(loss).backward()
-            else:
-                logits, _ = model(xb)
+            with autocast(device_type=device, dtype=amp_dtype, enabled=use_amp):
+                logits, _ = model(xb, segment_ids=sb)
                 loss = F.cross_entropy(logits.view(-1, logits.size(-1)), yb.view(-1), ignore_index=-100) / grad_accum
-                loss.backward()
+            timer.lap("fwd")
+            (scaler.scale(loss) if scaler else loss).backward()
+            timer.lap("bwd")
 
             if (steps + 1) % grad_accum == 0:
                 torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-                if use_amp:
+                if scaler:
                     scaler.step(opt); scaler.update()
                 else:
                     opt.step()
                 opt.zero_grad(set_to_none=True)
+                timer.lap("optim")
+                timer.step(pending); pending = 0
 
                 steps += 1
                 pbar.update(1)
                 if steps % 50 == 0:
-                    pbar.set_postfix_str(f"loss={(loss.item()*grad_accum):.3f}")
+                    pbar.set_postfix_str(f"loss={(loss.item()*grad_accum):.3f} real={n_real / max(1, n_slots):.0%}")
+                if steps % log_every == 0:
+                    pbar.write(f"[perf] step {steps} | {timer.report()}")
 
                 if steps % cfg.eval_every == 0:
-                    val = evaluate(model, val_dl, device, use_amp)
+                    val = evaluate(model, val_dl, device, amp_dtype)
                     print(f"\n[eval] steps={steps} val_loss={val:.3f}")
                     if val < best:
                         best = val; no_improve = 0
                         torch.save({
-                            "model": model.state_dict(),
+                            "model": raw_model.state_dict(),
                             "tok_path": "tokenizer/tokenizer.json",
                             "cfg": dict(
                                 vocab_size=tok.vocab_size, block_size=cfg.block_size,
                                 n_layer=cfg.n_layer, n_head=cfg.n_head,
-                                n_embd=cfg.n_embd, dropout=cfg.dropout
+                                n_embd=cfg.n_embd, dropout=cfg.dropout,
+                                attn_dropout=attn_dropout_for(cfg, device)
                             )
                         }, os.path.join(cfg.ckpt_dir, "best_sft.pt"))
                     else:
@@ -186,9 +311,12 @@ def main():
                         if no_improve >= patience:
                             print(f"Early stopping (no improvement for {patience} evals).")
                             pbar.close()
+                            print(f"[info] {report()}")
                             return
+                    timer.skip()
                 if steps >= cfg.max_steps:
                     pbar.close()
+                    print(f"[info] {report()}")
                     return
 
 if __name__ == "__main__":
@@ -1,7 +1,75 @@
-import os, random, numpy as np, torch
+import os, time, random, numpy as np, torch
 
 def set_seed(seed: int):
     random.seed(seed); np.random.seed(seed); torch.manual_seed(seed)
     torch.cuda.manual_seed_all(seed)
 
 def ensure_dir(p: str): os.makedirs(p, exist_ok=True)
+
+def cpu_bf16_supported() -> bool:
+    try: return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception: return False
+
+def setup_runtime(cfg):
+    """
+    Device + mixed precision for training, with cfg's CPU profile applied.
+    Returns (device, amp_dtype): float16 on CUDA (for callers that use AMP + a GradScaler there),
+    bfloat16 on CPU when enabled, else None (plain fp32).
+    """
+    device = "cuda" if (cfg.device == "cuda" and torch.cuda.is_available()) else "cpu"
+    if device == "cuda":
+        return device, torch.float16
+    if cfg.cpu_threads > 0:
+        torch.set_num_threads(cfg.cpu_threads)
+    if cfg.cpu_interop_threads > 0:
+        try: torch.set_num_interop_threads(cfg.cpu_interop_threads)
+        except RuntimeError: pass   # only settable before the first parallel op in the process
+    bf16 = cpu_bf16_supported() if cfg.cpu_bf16 == "auto" else cfg.cpu_bf16 in ("on", True)
+    return device, (torch.bfloat16 if bf16 else None)
+
+def attn_dropout_for(cfg, device):
+    """Attention-prob dropout to train with: 0 on CPU under cfg.cpu_fused_attn, else cfg.attn_dropout."""
+    return 0.0 if (device == "cpu" and cfg.cpu_fused_attn) else cfg.attn_dropout
+
+def loader_kwargs(cfg, device):
+    """DataLoader worker / prefetch / pinning settings from cfg."""
+    n = cfg.num_workers
+    if n < 0: n = 0 if (os.name == "nt" or (os.cpu_count() or 1) <= 2) else 2
+    kw = dict(num_workers=n, pin_memory=(device == "cuda"), persistent_workers=n > 0)
+    if n > 0: kw["prefetch_factor"] = cfg.prefetch_factor
+    return kw
+
+def maybe_compile(model, cfg):
+    if not cfg.compile: return model
+    try: return torch.compile(model)
+    except Exception as e:
+        print(f"[warn] torch.compile disabled: {e}")
+        return model
+
+class StepTimer:
+    """
+    Wall time per training phase (data / forward / backward / optim) and tokens/sec.
+    lap(phase) charges the time since the previous lap to `phase`; report() summarises and resets.
+    """
+    def __init__(self, device="cpu"):
+        self.sync = torch.cuda.synchronize if device == "cuda" else (lambda: None)
+        self.reset()
+    def reset(self):
+        self.phases, self.tokens, self.steps = {}, 0, 0
+        self.mark = time.perf_counter()
+    def lap(self, phase):
+        self.sync()
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.mark
+        self.mark = now
+    def skip(self):
+        """Leave the time since the last lap out of every phase (e.g. an eval pass)."""
+        self.mark = time.perf_counter()
+    def step(self, tokens):
+        self.tokens += tokens; self.steps += 1
+    def report(self):
+        dt = max(sum(self.phases.values()), 1e-9)     # skipped time (evals) excluded
+        parts = " ".join(f"{k} {1000 * v / max(1, self.steps):.0f}ms" for k, v in self.phases.items())
+        line = f"{self.tokens / dt:.0f} tok/s | {1000 * dt / max(1, self.steps):.0f} ms/step ({parts})"
+        self.reset()
+        return line
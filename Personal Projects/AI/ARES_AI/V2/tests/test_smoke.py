@@ -5,3 +5,197 @@ def test_model_forward():
     x = torch.randint(0,256,(2,16))
     logits, loss = m(x, x)
     assert logits.shape == (2,16,256)
+
+def test_kv_cache_matches_full_forward():
+    import torch
+    from src.infer import generate
+    torch.manual_seed(0)
+    m = TinyGPT(vocab_size=64, block_size=16, n_layer=2, n_head=2, n_embd=32).eval()
+    x = torch.randint(0,64,(1,6))
+    with torch.no_grad():
+        full, _ = m(x)
+        cache = m.new_cache(1)
+        pre, _ = m(x[:, :4], cache=cache)
+        step, _ = m(x[:, 4:6], cache=cache)
+    assert torch.allclose(torch.cat([pre, step], 1), full, atol=1e-5)
+    outs = []
+    for use_cache in (False, True):          # 20 new tokens: runs past block_size
+        torch.manual_seed(1)
+        outs.append(generate(m, x, 20, top_k=0, top_p=None, min_tokens=0, use_cache=use_cache))
+    assert outs[0].shape == (1, 26) and torch.equal(outs[0], outs[1])
+
+def test_chat_session_reuses_cache():
+    import torch
+    from src.chat import ChatSession
+    from src.tokenizer_util import AresTokenizer
+    tok = AresTokenizer("tokenizer/tokenizer.json")
+    torch.manual_seed(0)
+    m = TinyGPT(vocab_size=tok.vocab_size, block_size=64, n_layer=2, n_head=2, n_embd=32).eval()
+    s = ChatSession(m, tok, reserve=8, min_tokens=0)
+    for q in ("hello", "what is 2 + 2?", "and 3 + 3?", "thanks"):
+        s.reply(q, max_new_tokens=6)
+        assert s.stats["fed_tokens"] < s.stats["prompt_tokens"] or s.stats["dropped_turns"] or len(s.turns) == 1
+    n = s.cache.pos
+    assert n > 0 and s.cached == s.ids[:n]
+    fresh = m.new_cache(1)
+    with torch.no_grad():
+        m(torch.tensor([s.ids[:n]]), cache=fresh)
+    assert torch.allclose(s.cache.k[:, :, :, :n], fresh.k[:, :, :, :n], atol=1e-5)
+
+def test_loads_pre_fused_qkv_checkpoint():
+    import torch
+    torch.manual_seed(0)
+    m = TinyGPT(vocab_size=64, block_size=16, n_layer=2, n_head=2, n_embd=32).eval()
+    old = {}
+    for k, t in m.state_dict().items():          # rewrite into the old layout
+        if ".qkv." in k:
+            for name, part in zip(("query", "key", "value"), t.chunk(3, dim=0)):
+                old[k.replace("qkv", name)] = part.clone()
+        else:
+            old[k] = t
+            if k.endswith("attn.proj.weight"):
+                old[k.replace("proj.weight", "mask")] = torch.tril(torch.ones(16, 16)).view(1,1,16,16)
+    m2 = TinyGPT(vocab_size=64, block_size=16, n_layer=2, n_head=2, n_embd=32).eval()
+    m2.load_state_dict(old)
+    x = torch.randint(0,64,(2,16))
+    assert torch.equal(m(x)[0], m2(x)[0])
+
+def test_batched_generate_matches_single():
+    import torch
+    from src.infer import generate
+    torch.manual_seed(0)
+    m = TinyGPT(vocab_size=32, block_size=16, n_layer=2, n_head=2, n_embd=32).eval()
+    prompts = [[1,2,3], [4,5,6,7,8,9,10], [11,12,13,14,15]]
+    kw = dict(top_k=1, top_p=None, min_tokens=0)   # greedy, so rows can be compared
+    single = [generate(m, torch.tensor([p]), 14, **kw)[0].tolist() for p in prompts]
+    stop = single[0][5]                            # makes row 0 finish early
+    single_stop = [generate(m, torch.tensor([p]), 14, stop_id=stop, **kw)[0].tolist() for p in prompts]
+    for use_cache in (True, False):
+        assert generate(m, prompts, 14, use_cache=use_cache, **kw) == single
+        assert generate(m, prompts, 14, stop_id=stop, use_cache=use_cache, **kw) == single_stop
+
+def test_sliding_window_perplexity_scores_each_token_once():
+    import math, torch
+    from src.eval import perplexity, encode_text
+    from src.tokenizer_util import AresTokenizer
+    tok = AresTokenizer("tokenizer/tokenizer.json")
+    torch.manual_seed(0)
+    m = TinyGPT(vocab_size=tok.vocab_size, block_size=16, n_layer=1, n_head=2, n_embd=32).eval()
+    text = "the quick brown fox jumps over the lazy dog.\n" * 8
+    ids = encode_text(tok, text, max_tokens=40)
+    nll = 0.0
+    for t in range(1, len(ids)):      # stride 1: token t is predicted from the 16 (or fewer) before it
+        ctx = ids[max(0, t - 16):t]
+        logits, _ = m(torch.tensor([ctx]))
+        nll -= torch.log_softmax(logits[0, -1], -1)[ids[t]].item()
+    ppl = perplexity(m, tok, text, stride=1, batch_size=3, max_tokens=40, progress=False)
+    assert len(ids) == 41 and math.isclose(ppl, math.exp(nll / 40), rel_tol=1e-4)
+
+def test_token_shards_roundtrip(tmp_path):
+    import numpy as np, torch
+    from src.shards import build_shards, TokenShards
+    from src.tokenizer_util import AresTokenizer
+    tok = AresTokenizer("tokenizer/tokenizer.json")
+    src = tmp_path / "corpus.txt"
+    src.write_text("one two three four five six seven eight nine ten.\n\n" * 20, encoding="utf-8")
+    build_shards(tok, str(src), str(tmp_path / "tok"), shard_tokens=64)   # several shards
+    t = TokenShards(str(tmp_path / "tok"))
+    ids = np.concatenate([np.asarray(s) for s in t.shards])
+    assert len(t.shards) > 2 and len(t) == len(ids)
+    x, y = t.sample(8, 16, 0, len(t), np.random.default_rng(0))
+    assert x.shape == (8, 16) and torch.equal(x[:, 1:], y[:, :-1])
+    covered = sum(vx.numel() for vx, _ in t.iter_batches(4, 16))
+    assert 0 < covered <= len(t)
+    src.write_text("one two three.\n", encoding="utf-8")             # rebuild smaller: old shards go
+    build_shards(tok, str(src), str(tmp_path / "tok"), shard_tokens=64)
+    assert sorted(p.name for p in (tmp_path / "tok").glob("shard_*.bin")) == ["shard_00000.bin"]
+
+def test_sft_dataset_cache(tmp_path):
+    import json
+    from src.train_sft import SFTDataset
+    from src.tokenizer_util import AresTokenizer
+    tok = AresTokenizer("tokenizer/tokenizer.json")
+    path = tmp_path / "instructions.jsonl"
+    pairs = [{"prompt": "<|user|> hi\n<|assistant|> ", "response": "hello there"},
+             {"prompt": "<|user|> " + "long " * 40 + "\n<|assistant|> ", "response": "ok"}]
+    path.write_text("".join(json.dumps(p) + "\n" for p in pairs), encoding="utf-8")
+    ds = SFTDataset(str(path), tok, 16, cache_dir=str(tmp_path / "cache"))
+    ds2 = SFTDataset(str(path), tok, 16, cache_dir=str(tmp_path / "cache"))   # served from the cache
+    for d in (ds, ds2):
+        for i, p in enumerate(pairs):
+            pi = tok.encode_ids(p["prompt"], add_special=False)
+            ri = tok.encode_ids(p["response"], add_special=False) + [tok.eos]
+            x, y = d[i]
+            assert list(x) == (pi + ri)[-16:] and list(y) == ([-100] * len(pi) + ri)[-16:]
+
+def test_packed_rows_match_separate_pairs():
+    import numpy as np, torch
+    import src.train_sft as ts
+    torch.manual_seed(0)
+    m = TinyGPT(vocab_size=50, block_size=32, n_layer=2, n_head=2, n_embd=32).eval()
+    pairs = [(np.arange(1, 8), np.r_[[-100]*3, np.arange(4, 8)]), (np.arange(10, 15), np.r_[[-100]*2, np.arange(12, 15)]),
+             (np.arange(20, 29), np.r_[[-100]*4, np.arange(24, 29)])]
+    rows = ts.pack_rows([len(x) for x, _ in pairs], 16)
+    assert sorted(i for r in rows for i in r) == [0, 1, 2] and all(sum(len(pairs[i][0]) for i in r) <= 16 for r in rows)
+    ts.PAD_ID, ts.BLOCK_SIZE = 0, 32
+    packed = ts.PackedSFT(pairs, 32)
+    X, Y, S = ts.collate_packed([packed[r] for r in range(len(packed))])
+    logits, _ = m(X, segment_ids=S)
+    for r, row in enumerate(packed.rows):
+        at = 0
+        for i in row:
+            x, y = pairs[i]
+            ref, _ = m(torch.as_tensor(x)[None])
+            assert torch.allclose(logits[r, at:at+len(x)], ref[0], atol=1e-5)
+            assert Y[r, at:at+len(x)].tolist() == y.tolist()
+            at += len(x)
+
+def test_cpu_runtime_profile():
+    import torch
+    from src.config import TrainConfig
+    from src.utils import setup_runtime, StepTimer
+    c = TrainConfig(); c.device = "cpu"; c.cpu_threads = 1; c.cpu_bf16 = "off"
+    threads = torch.get_num_threads()
+    try:
+        assert setup_runtime(c) == ("cpu", None) and torch.get_num_threads() == 1
+        c.cpu_bf16 = "on"
+        assert setup_runtime(c)[1] is torch.bfloat16
+    finally:
+        torch.set_num_threads(threads)   # don't leave later tests single-threaded
+    t = StepTimer()
+    t.lap("fwd"); t.skip(); t.lap("bwd"); t.step(128)
+    assert "tok/s" in t.report() and t.steps == 0
+
+def test_attn_dropout_cpu_profile():
+    from src.config import TrainConfig
+    from src.utils import attn_dropout_for
+    c = TrainConfig()
+    m = TinyGPT(vocab_size=64, block_size=16, n_layer=1, n_head=2, n_embd=32, dropout=0.1,
+                attn_dropout=attn_dropout_for(c, "cpu"))
+    assert m.blocks[0].attn.attn_dropout == 0.1          # baseline: same as dropout
+    c.cpu_fused_attn = True
+    assert attn_dropout_for(c, "cpu") == 0.0 and attn_dropout_for(c, "cuda") is None
+
+def test_activation_checkpointing_same_grads():
+    import torch
+    grads = []
+    for every in (0, 1, 2):
+        torch.manual_seed(0)
+        m = TinyGPT(vocab_size=64, block_size=16, n_layer=3, n_head=2, n_embd=32, dropout=0.1, checkpoint_every=every)
+        x = torch.randint(0, 64, (2, 16))
+        _, loss = m(x, x)
+        loss.backward()
+        grads.append(torch.cat([p.grad.flatten() for p in m.parameters()]))
+    assert torch.allclose(grads[0], grads[1], atol=1e-6) and torch.allclose(grads[0], grads[2], atol=1e-6)
+
+def test_chat_long_replies_keep_cache():
+    import torch
+    from src.chat import ChatSession
+    from src.tokenizer_util import AresTokenizer
+    tok = AresTokenizer("tokenizer/tokenizer.json")
+    torch.manual_seed(0)
+    m = TinyGPT(vocab_size=tok.vocab_size, block_size=64, n_layer=2, n_head=2, n_embd=32).eval()
+    s = ChatSession(m, tok, min_tokens=200, ban_ids=[tok.eos])   # every reply runs to max_new_tokens
+    for q in ("hello", "what is 2 + 2?", "and 3 + 3?"):
+        s.reply(q, max_new_tokens=200)
+        assert s.stats["prompt_tokens"] <= 64 and s.cache.pos > 0 and s.cached == s.ids[:s.cache.pos]
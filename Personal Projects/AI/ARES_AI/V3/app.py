@@ -1,28 +1,227 @@
 # app.py
-from http.server import SimpleHTTPRequestHandler, HTTPServer
-import os, json
-from model.model import TinyCharRNN
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os, json, math, random, select, socket, time
 from model.tokenizer import CharTokenizer 
+from model.model import TinyCharRNN
+from model.specialize import install as specialize
+from serving import (
+    AdmissionController, LoadedModel, ModelWatcher, ModelCache, ModelLoadError, ResponseCache,
+    list_step_files, response_cache_key, STEP_FILE_RE
+)
+from telemetry import TelemetryListener
+from metrics import Registry
 
 # ---- tiny model setup ----
 DATA_PATH = os.path.join("data", "tiny_shakespeare.txt")
 WEIGHTS_PATH = os.path.join("weights", "model.json")
+CKPT_PATH = os.path.join("weights", "ckpt.json")
+RELOAD_POLL_SEC = 2.0   # how often to check ckpt.json for a new checkpoint
+MODEL_CACHE_MB = 64     # memory budget for extra checkpoints selected per request (~1 MB each at hidden=128)
+SPECIALIZE = True       # shape-specialized forward kernel (model/specialize.py) when it beats the generic one
+
+# generation defaults (overridable per request: max_new / temperature / top_k / sample_seed)
+DEFAULT_MAX_NEW = 160
+MAX_NEW_LIMIT = 1000
+MAX_N = 8                   # alternative replies per /chat request ("n"), generated in lockstep
+DEFAULT_TEMPERATURE = 0.8   # safer, more coherent by default (0.6..0.9)
+DEFAULT_TOP_K = 50          # trim the ultra-low-prob tail
+GREEDY_BELOW = 0.01         # temperatures under this are served as greedy (temperature 0)
+
+# opt-in cache for deterministic replies (temperature <= 0, or an explicit sample_seed)
+RESPONSE_CACHE_ENTRIES = 0  # 0 = off; e.g. 512
+RESPONSE_CACHE_TTL_SEC = 600
+
+# admission control for /chat and /score (bounded queue, load shedding, deadlines)
+MAX_ACTIVE = 2               # requests computing at once (pure Python: more just time-slices the GIL)
+MAX_QUEUE = 16               # waiting requests beyond that → 503
+PER_CLIENT_LIMIT = 4         # active + queued per client IP → 429
+DEFAULT_DEADLINE_SEC = 20.0  # per request, including queue wait; overridable with "deadline_ms"
+MAX_DEADLINE_SEC = 120.0
+
+# /score limits (log-likelihood of many texts in one call)
+SCORE_MAX_TEXTS = 64
+SCORE_MAX_CHARS = 200_000   # total across all texts in one request
+SCORE_CHUNK = 1024          # chars per streamed chunk (hidden state carried across chunks)
 
 # build tokenizer from the same corpus
 with open(os.path.join("data","tiny_shakespeare.txt"), encoding="utf-8") as f:
     corpus = f.read()
 tokenizer = CharTokenizer(corpus)
 
-# load trained weights
-model = TinyCharRNN(len(tokenizer.stoi))
-try:
-    model = TinyCharRNN.load(os.path.join("weights","model.json"))
-except Exception as e:
-    print("Weights not found, using random-initialized model.", e)
+# ---- metrics (GET /metrics, Prometheus text format) ----
+STARTED_AT = time.time()
+registry = Registry()
+HTTP_REQUESTS = registry.counter("ares_http_requests_total", "HTTP responses by route and status", ("route", "status"))
+HTTP_LATENCY = registry.histogram("ares_http_request_duration_seconds",
+                                  "Request line read to response written", ("route",))
+GEN_CHARS = registry.counter("ares_generated_chars_total", "Characters produced by generate()")
+GEN_SECONDS = registry.histogram("ares_generate_duration_seconds", "Wall time spent inside generate()")
+GEN_STOPPED = registry.counter("ares_generate_stopped_total", "Generations cut short", ("reason",))
+SCORED_CHARS = registry.counter("ares_scored_chars_total", "Characters scored by /score")
+ADMISSION_WAIT = registry.histogram("ares_admission_wait_seconds", "Queue wait before a compute slot")
+MODEL_LOAD = registry.histogram("ares_model_load_seconds", "Checkpoint load time (hot reload + model cache)",
+                                buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+MODEL_LOAD_ERRORS = registry.counter("ares_model_load_errors_total", "Checkpoint loads that raised")
+METRIC_ROUTES = ("/chat", "/score", "/status", "/models", "/metrics")
+
+def route_label(path):
+    """Bounded route label: the API endpoints by name, everything else (UI files, 404s) as "static"."""
+    path = path.split("?", 1)[0]
+    return path if path in METRIC_ROUTES else "static"
+
+# load trained weights (ckpt.json → model.json → random init); hot-reloaded in run().
+# prefork.py instead points ARES_FLAT_WEIGHTS at a read-only mmap-able file shared by its workers.
+def load_model(path):
+    """TinyCharRNN.load + the specialized forward kernel (served weights never change in place)."""
+    t0 = time.monotonic()
+    try:
+        model = TinyCharRNN.load(path)
+    except Exception:
+        MODEL_LOAD_ERRORS.inc()
+        raise
+    MODEL_LOAD.observe(time.monotonic() - t0)
+    if SPECIALIZE:
+        specialize(model, kernels=("step",))
+    return model
+
+FLAT_WEIGHTS = os.environ.get("ARES_FLAT_WEIGHTS")
+initial = None
+if FLAT_WEIGHTS:
+    from model.flat import MappedCharRNN
+    flat_model = MappedCharRNN(FLAT_WEIGHTS)
+    if SPECIALIZE:
+        specialize(flat_model, kernels=("step",))
+    initial = LoadedModel(flat_model, flat_model.header.get("source"), flat_model.step)
+watcher = ModelWatcher(CKPT_PATH, fallback_path=WEIGHTS_PATH, vocab_size=len(tokenizer.stoi),
+                       poll_sec=RELOAD_POLL_SEC, loader=load_model, initial=initial)
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_TTL_SEC)
+# weights changed → every cached reply from the old version is stale
+watcher.listeners.append(lambda old, new: response_cache.invalidate(old.version))
+
+# other step checkpoints, loaded on demand for {"step": N} / {"model": "model_step_N.json"}
+model_cache = ModelCache("weights", budget_bytes=MODEL_CACHE_MB * 1024 * 1024, loader=load_model)
+
+def select_model(body, load=True):
+    """
+    Picks the LoadedModel for a request; no selector (or "latest") means the hot-reloaded model.
+    A malformed selector raises ValueError; a well-formed step with no checkpoint raises KeyError. With load=False a known step that is not in memory yet gives
+    None instead of being loaded here; the handler loads it once admitted (ModelLoadError if bad).
+    """
+    sel = body.get("step", body.get("model"))
+    if sel is None or sel == "latest":
+        return watcher.active
+    if isinstance(sel, str):
+        m = STEP_FILE_RE.match(os.path.basename(sel))
+        if m:
+            sel = m.group(1)
+        if not sel.isdigit():
+            raise ValueError(f"bad model selector: {sel!r} (expected a step number or model_step_N.json)")
+    elif isinstance(sel, bool) or not isinstance(sel, int):
+        raise ValueError(f"bad model selector: {sel!r} (expected a step number or model_step_N.json)")
+    step = int(sel)
+    active = watcher.active
+    if active.step == step:
+        return active
+    return model_cache.get(step) if load else model_cache.peek(step)
+
+def parse_gen_params(body):
+    """Validated sampling params from a /chat body; raises ValueError on bad input."""
+    max_new = int(body.get("max_new", DEFAULT_MAX_NEW))
+    if not 0 < max_new <= MAX_NEW_LIMIT:
+        raise ValueError(f"max_new must be in 1..{MAX_NEW_LIMIT}")
+    temperature = float(body.get("temperature", DEFAULT_TEMPERATURE))
+    if not math.isfinite(temperature):
+        raise ValueError("temperature must be a finite number")
+    if temperature < GREEDY_BELOW:
+        temperature = 0.0   # indistinguishable from argmax, and keeps p ** (1/T) well away from underflow
+    top_k = body.get("top_k", DEFAULT_TOP_K)
+    top_k = None if top_k is None or int(top_k) <= 0 else int(top_k)
+    sample_seed = body.get("sample_seed")
+    if sample_seed is not None:
+        sample_seed = int(sample_seed)
+    n = int(body.get("n", 1))
+    if not 0 < n <= MAX_N:
+        raise ValueError(f"n must be in 1..{MAX_N}")
+    return max_new, temperature, top_k, sample_seed, n
+
+admission = AdmissionController(MAX_ACTIVE, MAX_QUEUE, PER_CLIENT_LIMIT)
+
+# live training metrics pushed by train.py (started in run())
+telemetry = TelemetryListener()
+
+# state that already lives in the objects above is read at scrape time only
+registry.gauge("ares_uptime_seconds", "Seconds since the server module loaded").set_function(lambda: time.time() - STARTED_AT)
+registry.gauge("ares_model_step", "Training step of the served checkpoint (-1 = unknown)").set_function(
+    lambda: -1 if watcher.active.step is None else watcher.active.step)
+registry.counter("ares_model_reloads_total", "Hot reloads of the served checkpoint").set_function(lambda: watcher.reloads)
+registry.gauge("ares_admission_active", "Requests holding a compute slot").set_function(lambda: admission.active)
+registry.gauge("ares_admission_queued", "Requests waiting for a compute slot").set_function(lambda: admission.queued)
+registry.counter("ares_admission_shed_total", "Requests rejected by admission control", ("reason",)).set_function(
+    lambda: {"queue_full": admission.shed_queue, "per_client": admission.shed_client, "deadline": admission.shed_timeout})
+registry.counter("ares_model_cache_lookups_total", "Per-request checkpoint cache lookups", ("result",)).set_function(
+    lambda: {"hit": model_cache.hits, "miss": model_cache.misses})
+registry.counter("ares_response_cache_lookups_total", "Response cache lookups", ("result",)).set_function(
+    lambda: {"hit": response_cache.hits, "miss": response_cache.misses})
 
 # ---- HTTP handler ----
 class ChatHandler(SimpleHTTPRequestHandler):
+    def parse_request(self):
+        # timed from here, after the request line arrived, so keep-alive idle time isn't counted
+        self.arrived = time.monotonic()
+        ok = super().parse_request()
+        self.route = route_label(self.path) if ok else "invalid"
+        return ok
+
+    def log_request(self, code="-", size="-"):
+        self.metric_status = code
+        super().log_request(code, size)
+
+    def handle_one_request(self):
+        self.metric_status = None
+        # errors raised before parse_request (e.g. 414 for an over-long request line) are logged
+        # too; don't let them land on the previous keep-alive request's route/latency
+        self.route = "invalid"
+        self.arrived = time.monotonic()
+        super().handle_one_request()
+        if self.metric_status is not None:
+            HTTP_REQUESTS.labels(self.route, int(self.metric_status)).inc()
+            HTTP_LATENCY.labels(self.route).observe(time.monotonic() - self.arrived)
+
+    def _send_json(self, obj, status=200, headers=None):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
     def do_GET(self):
+        if self.path.split("?", 1)[0] == "/metrics":
+            data = registry.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", registry.CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if self.path.split("?", 1)[0] == "/status":
+            status = telemetry.snapshot()
+            active = watcher.active
+            status["model"] = {"step": active.step, "path": active.path,
+                               "loaded_at": active.loaded_at, "reloads": watcher.reloads}
+            status["cache"] = model_cache.stats()
+            status["response_cache"] = response_cache.stats()
+            status["admission"] = admission.stats()
+            return self._send_json(status)
+        if self.path.split("?", 1)[0] == "/models":
+            return self._send_json({
+                "available": sorted(list_step_files("weights")),
+                "active": watcher.active.step,
+                "cache": model_cache.stats(),
+            })
         if self.path in ("/", "/index.html"):
             self.path = "static/index.html"
         elif self.path == "/style.css":
@@ -31,31 +230,176 @@ class ChatHandler(SimpleHTTPRequestHandler):
             self.path = "static/main.js"
         return super().do_GET()
 
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length))
+
+    def _deadline(self, body):
+        """Absolute time.monotonic() deadline for this request (counted from arrival)."""
+        try:
+            sec = float(body["deadline_ms"]) / 1000.0 if "deadline_ms" in body else DEFAULT_DEADLINE_SEC
+        except (TypeError, ValueError):
+            sec = DEFAULT_DEADLINE_SEC
+        return self.arrived + min(max(sec, 0.0), MAX_DEADLINE_SEC)
+
+    def _client_gone(self):
+        """True once the peer has closed its end (readable socket with nothing to read)."""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b""
+        except (OSError, ValueError):
+            return True
+
+    def _admit(self, deadline):
+        """Queue for a compute slot. Sends the 429/503 itself and returns None when shed."""
+        adm = admission.acquire(self.client_address[0], deadline)
+        if adm.status is not None:
+            st = admission.stats()
+            self.log_message("shed %d (%s) | queue=%d active=%d shed=%d",
+                             adm.status, adm.reason, st["queued"], st["active"], st["shed"])
+            self._send_json({"error": adm.reason}, status=adm.status, headers={"Retry-After": "1"})
+            return None
+        ADMISSION_WAIT.observe(adm.wait_sec)
+        return adm
+
+    def _load_selected(self, body):
+        """Cold-load the selected step (called while admitted). Sends the error itself and returns None on failure."""
+        try:
+            return select_model(body)
+        except KeyError as e:            # file removed since the request was accepted
+            self._send_json({"error": str(e.args[0])}, status=404)
+        except ModelLoadError as e:
+            self.log_message("%s", e)
+            self._send_json({"error": str(e)}, status=500)
+        return None
+
     def do_POST(self):
+        if self.path == "/score":
+            return self._score()
         if self.path != "/chat":
             self.send_error(404, "Unknown endpoint")
             return
-        length = int(self.headers.get("Content-Length", 0))
-        body = json.loads(self.rfile.read(length))
+        body = self._read_json()
         msg = body.get("message", "")
-        reply = model.generate(
-            tokenizer,
-            seed=msg,
-            max_new=160,
-            temperature=0.8,   # safer, more coherent by default (0.6..0.9)
-            top_k=50           # trim the ultra‑low‑prob tail
-        )
-
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps({"response": reply}).encode("utf-8"))
+        try:
+            active = select_model(body, load=False)   # pin the weights for this whole request
+        except ValueError as e:
+            return self._send_json({"error": str(e)}, status=400)
+        except KeyError as e:
+            return self._send_json({"error": str(e.args[0])}, status=404)
+        try:
+            max_new, temperature, top_k, sample_seed, n = parse_gen_params(body)
+        except (TypeError, ValueError) as e:
+            return self._send_json({"error": str(e)}, status=400)
+
+        use_cache = body.get("cache", True)
+        cache_key = lambda m: response_cache_key(m, msg, max_new, temperature, top_k, sample_seed, n) if use_cache else None
+        key = None
+        if active is not None:   # a cold step has a fresh version: nothing can be cached for it yet
+            key = cache_key(active)
+            reply = response_cache.get(key)
+            if reply is not None:
+                return self._send_json(dict(self._replies(reply, n), step=active.step, cached=True))
+
+        deadline = self._deadline(body)
+        adm = self._admit(deadline)
+        if adm is None:
+            return
+        stopped = [None]
+        checks = [0]   # = chars generated so far
+        def should_stop():
+            # deadline every char; the socket only every 16 chars (a syscall each time)
+            if time.monotonic() > deadline:
+                stopped[0] = "deadline"
+            elif (checks[0] + 1) % 16 == 0 and self._client_gone():
+                stopped[0] = "disconnected"
+            else:
+                checks[0] += 1
+            return stopped[0] is not None
+        try:
+            if active is None:
+                active = self._load_selected(body)
+                if active is None:
+                    return
+                key = cache_key(active)
+            t0 = time.monotonic()
+            reply = active.model.generate(
+                tokenizer,
+                seed=msg,
+                max_new=max_new,
+                temperature=temperature,
+                top_k=top_k,
+                rng=random.Random(sample_seed) if sample_seed is not None else None,
+                should_stop=should_stop,
+                n=n,
+            )
+        finally:
+            admission.release(self.client_address[0])
+        gen_sec = time.monotonic() - t0
+        GEN_SECONDS.observe(gen_sec)
+        GEN_CHARS.inc(checks[0] * n)
+        if stopped[0]:
+            GEN_STOPPED.labels(stopped[0]).inc()
+        st = admission.stats()
+        self.log_message("chat step=%s wait=%.1fms gen=%.1fms stop=%s | queue=%d active=%d shed=%d",
+                         active.step, 1000 * adm.wait_sec, 1000 * gen_sec,
+                         stopped[0] or "-", st["queued"], st["active"], st["shed"])
+        if stopped[0] == "disconnected":
+            self.close_connection = True
+            self.metric_status = 499   # nothing sent; counted like nginx's "client closed request"
+            return
+        if stopped[0] is None:
+            response_cache.put(key, reply)
+        out = dict(self._replies(reply, n), step=active.step)
+        if stopped[0]:
+            out["truncated"] = stopped[0]
+        self._send_json(out)
+
+    @staticmethod
+    def _replies(reply, n):
+        """n == 1: {"response": str}; n > 1: the first one as "response" too, all of them in "responses"."""
+        return {"response": reply} if n == 1 else {"response": reply[0], "responses": reply}
+
+    def _score(self):
+        """POST /score {"texts": [...], "per_char": false, "step": optional} → log-likelihood per text."""
+        body = self._read_json()
+        texts = body.get("texts")
+        if isinstance(texts, str):
+            texts = [texts]
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            return self._send_json({"error": "texts must be a list of strings"}, status=400)
+        if len(texts) > SCORE_MAX_TEXTS or sum(len(t) for t in texts) > SCORE_MAX_CHARS:
+            return self._send_json({"error": f"at most {SCORE_MAX_TEXTS} texts / {SCORE_MAX_CHARS} chars"}, status=413)
+        unknown = sorted({c for t in texts for c in t if c not in tokenizer.stoi})
+        if unknown:
+            return self._send_json({"error": f"characters not in vocabulary: {''.join(unknown)!r}"}, status=400)
+        try:
+            active = select_model(body, load=False)
+        except ValueError as e:
+            return self._send_json({"error": str(e)}, status=400)
+        except KeyError as e:
+            return self._send_json({"error": str(e.args[0])}, status=404)
+        adm = self._admit(self._deadline(body))
+        if adm is None:
+            return
+        try:
+            if active is None:
+                active = self._load_selected(body)
+                if active is None:
+                    return
+            results = active.model.score_texts(tokenizer, texts, per_char=bool(body.get("per_char")), chunk=SCORE_CHUNK)
+        finally:
+            admission.release(self.client_address[0])
+        SCORED_CHARS.inc(sum(r["chars"] for r in results))
+        self._send_json({"results": results, "step": active.step})
 
 def run():
     os.chdir(os.path.dirname(__file__))
     port = 8000
-    print(f"ARES_AI running → http://localhost:{port}")
-    HTTPServer(("0.0.0.0", port), ChatHandler).serve_forever()
+    telemetry.start()
+    watcher.start()
+    print(f"ARES_AI running → http://localhost:{port} | serving step {watcher.active.step}")
+    ThreadingHTTPServer(("0.0.0.0", port), ChatHandler).serve_forever()
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,119 @@
+# compress.py — low-rank factorize a trained checkpoint and report held-out loss vs chars/sec per rank
+#
+#   python compress.py                                  # ranks 8,16,32,64 of the served checkpoint
+#   python compress.py --ranks 16,32 --finetune 300 --save
+#   python compress.py --ckpt weights/model_step_20000.json --out compress.json
+#
+# Each rank r replaces Whh (H×H) and Why (H×V) with rank-r factor pairs (model/lowrank.py),
+# optionally fine-tunes the factors for a few hundred steps on the training portion to win back
+# the loss, then measures loss on evaluate.py's held-out slice and greedy generation speed.
+# --save writes weights/lowrank_r{r}.json; TinyCharRNN.load() (and so app.py) loads it like any
+# other checkpoint, e.g. by pointing weights/ckpt.json's "path" at it.
+import argparse, json, os, random, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join("data", "tiny_shakespeare.txt")
+CKPT = os.path.join("weights", "ckpt.json")
+WEIGHTS = os.path.join("weights", "model.json")
+
+def chars_per_sec(model, tok, n_chars=300, seed="ROMEO:\n"):
+    """Greedy generation speed (priming excluded), best of 2 runs."""
+    best = 0.0
+    for _ in range(2):
+        h = [0.0] * model.hidden
+        for idx in tok.encode(seed):
+            h, _ = model._step(idx, h)
+        idx = tok.encode(seed)[-1]
+        t0 = time.perf_counter()
+        for _ in range(n_chars):
+            h, probs = model._step(idx, h)
+            idx = max(range(len(probs)), key=probs.__getitem__)
+        best = max(best, n_chars / (time.perf_counter() - t0))
+    return best
+
+def finetune(model, ids, train_end, steps, block_len, lr, seed=0):
+    rnd = random.Random(seed)
+    model.lr = lr
+    loss = None
+    for _ in range(steps):
+        s = rnd.randint(0, train_end - block_len - 2)
+        loss = model.train_step(ids[s:s + block_len], ids[s + 1:s + block_len + 1])
+    return loss
+
+def main():
+    ap = argparse.ArgumentParser(description="Low-rank compression of a TinyCharRNN checkpoint.")
+    ap.add_argument("--ckpt", help="checkpoint to compress (default: what ckpt.json points at, else model.json)")
+    ap.add_argument("--ranks", default="8,16,32,64", help="comma-separated ranks (applied to Whh and Why)")
+    ap.add_argument("--finetune", type=int, default=0, help="recovery fine-tune steps per rank (0 = off)")
+    ap.add_argument("--block-len", type=int, default=64)
+    ap.add_argument("--lr", type=float, default=0.002)
+    ap.add_argument("--iters", type=int, default=30, help="subspace iterations for the factorization")
+    ap.add_argument("--max-chars", type=int, default=20000, help="held-out chars to score (0 = whole slice)")
+    ap.add_argument("--save", action="store_true", help="write weights/lowrank_r{r}.json")
+    ap.add_argument("--out", help="also write the table as JSON")
+    args = ap.parse_args()
+    if args.out:
+        args.out = os.path.abspath(args.out)
+
+    os.chdir(HERE)
+    sys.path.insert(0, HERE)
+    from model.tokenizer import CharTokenizer
+    from model.model import TinyCharRNN
+    from model.lowrank import LowRankCharRNN
+    from model.specialize import install as specialize
+    from serving import read_ckpt_pointer
+    from evaluate import split_point, validation_text, validation_loss
+
+    with open(DATA, encoding="utf-8") as f:
+        text = f.read()
+    tok = CharTokenizer(text)
+    ids = tok.encode(text)
+    val_ids = tok.encode(validation_text(text, args.max_chars or None))
+    src = args.ckpt or read_ckpt_pointer(CKPT)[0] or WEIGHTS
+    dense = TinyCharRNN.load(src)
+    print(f"[compress] {src}: hidden={dense.hidden} vocab={dense.vocab_size} | scoring {len(val_ids)} held-out chars")
+
+    rows = []
+    def report(name, model, params, energy=None, loss_ft=None):
+        t0 = time.time()
+        loss, _ = validation_loss(model, val_ids)
+        cps = chars_per_sec(model, tok)
+        rows.append({"model": name, "params": params, "energy_hh": energy and energy["Whh"],
+                     "energy_hy": energy and energy["Why"], "val_loss": loss, "train_loss_ft": loss_ft,
+                     "chars_per_sec": cps, "eval_sec": time.time() - t0})
+
+    H, V = dense.hidden, dense.vocab_size
+    dense_params = V * H + H * H + H * V + H + V
+    report("dense", dense, dense_params)
+    fast = TinyCharRNN.load(src)
+    if specialize(fast, kernels=("step",)):
+        report("dense+specialized", fast, dense_params)
+
+    for r in [int(x) for x in args.ranks.split(",") if x.strip()]:
+        t0 = time.time()
+        model, energy = LowRankCharRNN.from_dense(dense, r, iters=args.iters)
+        loss_ft = None
+        if args.finetune:
+            loss_ft = finetune(model, ids, split_point(len(ids)), args.finetune, args.block_len, args.lr)
+        print(f"[compress] rank {model.rank_hh}/{model.rank_hy}: factorized"
+              f"{f' + {args.finetune} fine-tune steps' if args.finetune else ''} in {time.time() - t0:.1f}s")
+        report(f"rank {model.rank_hh}", model, model.n_params(), energy, loss_ft)
+        if args.save:
+            path = os.path.join("weights", f"lowrank_r{model.rank_hh}.json")
+            model.save(path)
+            rows[-1]["path"] = path
+
+    base = rows[0]
+    print(f"\n{'model':<18} {'params':>8} {'kept_hh':>8} {'kept_hy':>8} {'val_loss':>9} {'Δloss':>7} {'chars/s':>8} {'speedup':>8}")
+    for row in rows:
+        kept = lambda e: f"{e:8.1%}" if e is not None else f"{'-':>8}"
+        print(f"{row['model']:<18} {row['params']:>8} {kept(row['energy_hh'])} {kept(row['energy_hy'])} "
+              f"{row['val_loss']:>9.4f} {row['val_loss'] - base['val_loss']:>+7.3f} "
+              f"{row['chars_per_sec']:>8.0f} {row['chars_per_sec'] / base['chars_per_sec']:>7.2f}x")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"source": src, "finetune_steps": args.finetune, "rows": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
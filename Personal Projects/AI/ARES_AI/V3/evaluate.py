@@ -0,0 +1,142 @@
+# evaluate.py — held-out loss for every weights/model_step_*.json, in parallel, with a result cache
+#
+#   python evaluate.py                       # all checkpoints, all cores
+#   python evaluate.py --max-chars 20000 --out leaderboard.json
+#
+# The last VAL_FRACTION of the corpus is the validation slice. train.py and sweep.py never
+# sample training windows from it (checkpoints trained before that change have seen it).
+# Results are cached in weights/eval_cache.json by checkpoint content hash + slice settings,
+# so re-running only scores new or changed checkpoints.
+import argparse, hashlib, json, math, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join("data", "tiny_shakespeare.txt")
+WEIGHTS_DIR = "weights"
+CACHE_PATH = os.path.join(WEIGHTS_DIR, "eval_cache.json")
+
+VAL_FRACTION = 0.05   # tail of the corpus held out from training
+EVAL_STREAMS = 8      # the slice is cut into this many contiguous streams scored in lockstep
+EVAL_CHUNK = 1024     # chars per scoring chunk (hidden state carried across chunks)
+
+def split_point(n):
+    """Index where the held-out tail starts for a corpus of n chars/tokens."""
+    return n - int(n * VAL_FRACTION)
+
+def validation_text(text, max_chars=None):
+    val = text[split_point(len(text)):]
+    return val[:max_chars] if max_chars else val
+
+def validation_loss(model, ids, streams=EVAL_STREAMS, chunk=EVAL_CHUNK):
+    """
+    Mean per-char cross-entropy (nats) of `ids`. The ids are cut into `streams` contiguous
+    pieces advanced together through TinyCharRNN.score, `chunk` ids at a time with each
+    stream's hidden state carried over, so memory stays flat however long the slice is.
+    Returns (loss, chars_scored).
+    """
+    streams = max(1, min(streams, len(ids) // 2 or 1))
+    per = math.ceil(len(ids) / streams)
+    pieces = [ids[i * per:(i + 1) * per] for i in range(streams)]
+    pieces = [p for p in pieces if p]
+    state = [None] * len(pieces)
+    total, n = 0.0, 0
+    for start in range(0, per, chunk):
+        live = [k for k in range(len(pieces)) if start < len(pieces[k])]
+        results, st = model.score([pieces[k][start:start + chunk] for k in live], state=[state[k] for k in live])
+        for j, k in enumerate(live):
+            state[k] = st[j]
+            total -= results[j]["logprob"]
+            n += results[j]["n"]
+    return (total / n if n else float("nan")), n
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+def _eval_one(task):
+    """Worker: load one checkpoint and score the validation ids."""
+    sys.path.insert(0, HERE)
+    from model.model import TinyCharRNN
+    t0 = time.time()
+    model = TinyCharRNN.load(task["path"])
+    loss, n = validation_loss(model, task["ids"], task["streams"], task["chunk"])
+    return {"path": task["path"], "val_loss": loss, "chars": n, "eval_sec": time.time() - t0}
+
+def _load_cache():
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(cache):
+    tmp = CACHE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1)
+    os.replace(tmp, CACHE_PATH)
+
+def main():
+    ap = argparse.ArgumentParser(description="Held-out loss leaderboard for all step checkpoints.")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--max-chars", type=int, default=0, help="score only the first N chars of the slice (0 = all)")
+    ap.add_argument("--streams", type=int, default=EVAL_STREAMS)
+    ap.add_argument("--out", help="also write the table as JSON")
+    ap.add_argument("--no-cache", action="store_true", help="ignore cached results (they are still updated)")
+    args = ap.parse_args()
+
+    os.chdir(HERE)
+    sys.path.insert(0, HERE)
+    from model.tokenizer import CharTokenizer
+    from serving import list_step_files
+
+    with open(DATA, encoding="utf-8") as f:
+        text = f.read()
+    tok = CharTokenizer(text)
+    val = validation_text(text, args.max_chars or None)
+    ids = tok.encode(val)
+    slice_key = f"val{VAL_FRACTION}:{split_point(len(text))}+{len(val)}:s{args.streams}:c{EVAL_CHUNK}"
+    print(f"[eval] validation slice: {len(val)} chars (last {VAL_FRACTION:.0%} of corpus)")
+
+    steps = list_step_files(WEIGHTS_DIR)
+    if not steps:
+        raise SystemExit("no weights/model_step_*.json checkpoints found")
+    cache = _load_cache()
+    rows, todo = {}, []
+    for step, path in sorted(steps.items()):
+        key = f"{file_hash(path)}|{slice_key}"
+        hit = None if args.no_cache else cache.get(key)
+        if hit:
+            rows[step] = dict(hit, step=step, path=path, cached=True)
+        else:
+            todo.append((step, path, key))
+
+    t0 = time.time()
+    if todo:
+        print(f"[eval] scoring {len(todo)} checkpoint(s) on {min(args.workers, len(todo))} worker(s)"
+              f" ({len(rows)} cached)")
+        tasks = [{"path": p, "ids": ids, "streams": args.streams, "chunk": EVAL_CHUNK} for _, p, _ in todo]
+        with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(todo)))) as pool:
+            for (step, path, key), res in zip(todo, pool.map(_eval_one, tasks)):
+                entry = {"val_loss": res["val_loss"], "chars": res["chars"], "eval_sec": round(res["eval_sec"], 2)}
+                cache[key] = entry
+                rows[step] = dict(entry, step=step, path=path, cached=False)
+        _save_cache(cache)
+
+    best = min(rows.values(), key=lambda r: r["val_loss"])
+    print(f"\n{'step':>7} {'val_loss':>9} {'ppl':>8} {'eval_s':>7}")
+    for step in sorted(rows):
+        r = rows[step]
+        mark = "  <- best" if r is best else ""
+        src = " (cached)" if r["cached"] else ""
+        print(f"{step:>7} {r['val_loss']:>9.4f} {math.exp(r['val_loss']):>8.2f} {r['eval_sec']:>7.2f}{src}{mark}")
+    print(f"\n[eval] best: step {best['step']} ({best['path']}) | wall {time.time() - t0:.1f}s")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"slice": slice_key, "rows": [rows[s] for s in sorted(rows)], "best_step": best["step"]}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
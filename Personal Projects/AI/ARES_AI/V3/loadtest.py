@@ -0,0 +1,250 @@
+# loadtest.py — stdlib load generator for app.py (/chat + static routes)
+#
+#   python loadtest.py                              # in-process server, 4 closed-loop clients, 20s
+#   python loadtest.py --mode open --rate 3 --duration 60
+#   python loadtest.py --url http://localhost:8000 --mix chat=1,index=1,status=1 --out run.json
+#
+# Prints one JSON report (throughput, p50/p95/p99 latency + time-to-first-byte, errors)
+# so server changes can be compared run over run on the same machine.
+import argparse, http.client, json, math, os, random, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+DEFAULT_PROMPTS = [
+    "ROMEO:\n",
+    "JULIET:\nO Romeo, Romeo",
+    "KING RICHARD III:\nNow is the winter",
+    "First Citizen:\nBefore we proceed any further, hear me speak.",
+    "Hello.",
+]
+
+# route name -> (method, path)
+ROUTES = {
+    "chat":   ("POST", "/chat"),
+    "index":  ("GET",  "/"),
+    "status": ("GET",  "/status"),
+    "models": ("GET",  "/models"),
+}
+
+def percentile(sorted_vals, q):
+    """Nearest-rank percentile of an already-sorted list (q in 0..100)."""
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(q / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+def parse_mix(spec):
+    """'chat=8,index=2' -> [(name, weight), ...]"""
+    mix = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, w = part.partition("=")
+        if name not in ROUTES:
+            raise SystemExit(f"unknown route {name!r}; choose from {', '.join(ROUTES)}")
+        mix.append((name, float(w or 1)))
+    if not mix:
+        raise SystemExit("empty --mix")
+    return mix
+
+class Stats:
+    """Per-route samples; one lock, appended to from worker threads."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lat = {}      # route -> [seconds]
+        self.ttfb = {}
+        self.ok = {}
+        self.errors = {}   # route -> {kind: count}
+        self.bytes = 0
+
+    def record(self, route, ok, latency=None, ttfb=None, nbytes=0, error=None):
+        with self.lock:
+            if ok:
+                self.ok[route] = self.ok.get(route, 0) + 1
+                self.lat.setdefault(route, []).append(latency)
+                self.ttfb.setdefault(route, []).append(ttfb)
+                self.bytes += nbytes
+            else:
+                errs = self.errors.setdefault(route, {})
+                errs[error] = errs.get(error, 0) + 1
+
+def _summary(vals):
+    vals = sorted(vals)
+    if not vals:
+        return None
+    ms = lambda x: round(1000.0 * x, 2)
+    return {
+        "mean_ms": ms(sum(vals) / len(vals)),
+        "p50_ms": ms(percentile(vals, 50)), "p95_ms": ms(percentile(vals, 95)),
+        "p99_ms": ms(percentile(vals, 99)), "max_ms": ms(vals[-1]),
+    }
+
+def do_request(host, port, route, prompt, args, timeout):
+    """Returns (status, ttfb_sec, total_sec, nbytes) measured from just before connect."""
+    method, path = ROUTES[route]
+    body, headers = None, {}
+    if method == "POST":
+        req = {"message": prompt, "max_new": args.max_new}
+        if args.temperature is not None:
+            req["temperature"] = args.temperature
+        body = json.dumps(req).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Content-Length": str(len(body))}
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()          # returns once the status line + headers arrived
+        t_first = time.perf_counter()
+        data = resp.read()
+        t_end = time.perf_counter()
+        return resp.status, t_first - t0, t_end - t0, len(data)
+    finally:
+        conn.close()
+
+def run_load(host, port, args, prompts):
+    mix = parse_mix(args.mix)
+    names = [n for n, _ in mix]
+    weights = [w for _, w in mix]
+    stats = Stats()
+    rnd = random.Random(args.seed)
+    rnd_lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    issued = [0]
+
+    def next_job():
+        with rnd_lock:
+            if args.requests and issued[0] >= args.requests:
+                return None
+            issued[0] += 1
+            return rnd.choices(names, weights)[0], rnd.choice(prompts)
+
+    def one(route, prompt, queued_at=None):
+        try:
+            status, ttfb, total, n = do_request(host, port, route, prompt, args, args.timeout)
+        except Exception as e:
+            stats.record(route, False, error=type(e).__name__)
+            return
+        # open loop: also charge the time spent waiting for a free client (no coordinated omission)
+        wait = max(0.0, time.perf_counter() - total - queued_at) if queued_at is not None else 0.0
+        if 200 <= status < 300:
+            stats.record(route, True, latency=total + wait, ttfb=ttfb + wait, nbytes=n)
+        else:
+            stats.record(route, False, error=f"http_{status}")
+
+    t_start = time.perf_counter()
+    if args.mode == "closed":
+        # N clients, each sends its next request as soon as the previous one finishes
+        def client():
+            while time.perf_counter() < deadline:
+                job = next_job()
+                if job is None:
+                    return
+                one(*job)
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(args.concurrency)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    else:
+        # Poisson arrivals at --rate req/s, independent of how fast the server answers
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            next_at = time.perf_counter()
+            while True:
+                with rnd_lock:
+                    next_at += rnd.expovariate(args.rate)
+                if next_at >= deadline:
+                    break
+                job = next_job()
+                if job is None:
+                    break
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(one, job[0], job[1], next_at)
+    wall = time.perf_counter() - t_start
+
+    routes = {}
+    all_lat, all_ttfb = [], []
+    for route in names:
+        lat, ttfb = stats.lat.get(route, []), stats.ttfb.get(route, [])
+        all_lat += lat; all_ttfb += ttfb
+        routes[route] = {
+            "ok": stats.ok.get(route, 0),
+            "errors": stats.errors.get(route, {}),
+            "latency": _summary(lat), "ttfb": _summary(ttfb),
+        }
+    ok = sum(stats.ok.values())
+    errors = sum(sum(e.values()) for e in stats.errors.values())
+    return {
+        "config": {
+            "mode": args.mode, "concurrency": args.concurrency,
+            "rate": args.rate if args.mode == "open" else None,
+            "duration_sec": args.duration, "requests": args.requests, "mix": args.mix,
+            "max_new": args.max_new, "temperature": args.temperature, "prompts": len(prompts),
+            "target": f"{host}:{port}",
+        },
+        "wall_sec": round(wall, 3),
+        "completed": ok, "errors": errors,
+        "throughput_rps": round(ok / wall, 3) if wall > 0 else None,
+        "bytes_per_sec": round(stats.bytes / wall, 1) if wall > 0 else None,
+        "latency": _summary(all_lat), "ttfb": _summary(all_ttfb),
+        "routes": routes,
+    }
+
+def start_local_server():
+    """Imports app.py (which loads the model) and serves ChatHandler on an ephemeral port."""
+    from http.server import ThreadingHTTPServer
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(here)
+    sys.path.insert(0, here)
+    import app
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), app.ChatHandler)
+    srv.daemon_threads = True
+    app.ChatHandler.log_message = lambda *a, **k: None   # keep the report readable
+    threading.Thread(target=srv.serve_forever, name="loadtest-server", daemon=True).start()
+    return srv
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test the ARES V3 HTTP server.")
+    ap.add_argument("--url", help="target a running server (default: start ChatHandler in-process)")
+    ap.add_argument("--mode", choices=("closed", "open"), default="closed",
+                    help="closed: N clients back-to-back; open: Poisson arrivals at --rate")
+    ap.add_argument("--concurrency", type=int, default=4, help="clients (closed) / max in-flight (open)")
+    ap.add_argument("--rate", type=float, default=2.0, help="open-loop arrivals per second")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds to generate load")
+    ap.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = no cap)")
+    ap.add_argument("--mix", default="chat=1", help="route weights, e.g. chat=8,index=1,status=1")
+    ap.add_argument("--prompts", help="file with one prompt per line (default: built-in set)")
+    ap.add_argument("--max-new", type=int, default=160)
+    ap.add_argument("--temperature", type=float, default=None)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="also write the JSON report here")
+    args = ap.parse_args()
+    if args.out:
+        args.out = os.path.abspath(args.out)   # the in-process server chdirs into V3/
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = [line.rstrip("\n").replace("\\n", "\n") for line in f if line.strip()]
+
+    srv = None
+    if args.url:
+        u = urlsplit(args.url)
+        host, port = u.hostname, u.port or 80
+    else:
+        srv = start_local_server()
+        host, port = srv.server_address[0], srv.server_address[1]
+
+    report = run_load(host, port, args, prompts)
+    if srv is not None:
+        srv.shutdown()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# metrics.py — tiny Prometheus-style metrics registry (stdlib-only)
+#
+#   REQUESTS = registry.counter("ares_http_requests_total", "HTTP responses", ("route", "status"))
+#   REQUESTS.labels("/chat", 200).inc()
+#   LATENCY = registry.histogram("ares_http_request_duration_seconds", "Request latency", ("route",))
+#   LATENCY.labels("/chat").observe(0.42)
+#   registry.exposition()   # text format 0.0.4, served at GET /metrics
+#
+# Recording is cheap: each label set gets its own small object with its own lock, held for a couple
+# of float adds (uncontended in practice, never held across I/O). Label children are cached in a
+# dict, so the hot path is one dict lookup + one lock. Values that already live elsewhere (queue
+# depth, cache hits, ...) use set_function() and are only read when /metrics is scraped.
+import math, threading
+from bisect import bisect_left
+
+# seconds; covers a static file (~ms) up to a long /chat generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _fmt(v):
+    v = float(v)
+    if math.isinf(v): return "+Inf" if v > 0 else "-Inf"
+    if v != v: return "NaN"
+    return str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labelstr(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Value:
+    __slots__ = ("lock", "value")
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = float(value)   # single store, atomic under the GIL
+
+    def get(self):
+        return self.value
+
+class _HistogramValue:
+    __slots__ = ("lock", "bounds", "counts", "sum", "count")
+    def __init__(self, bounds):
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last slot = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)     # first bucket with le >= value
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        self._fn = None
+
+    def _new(self):
+        return _Value()
+
+    def labels(self, *values):
+        """Child for one label set (created on first use, then a dict lookup)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new())
+        return child
+
+    def set_function(self, fn):
+        """
+        Read the value at scrape time instead of recording it. `fn()` returns a number, or for a
+        labelled metric a dict {label values tuple: number}.
+        """
+        self._fn = fn
+        return self
+
+    def _samples(self):
+        if self._fn is not None:
+            v = self._fn()
+            if isinstance(v, dict):
+                return [(tuple(k) if isinstance(k, tuple) else (k,), x) for k, x in v.items()]
+            return [((), v)]
+        return [(k, c.get()) for k, c in list(self._children.items())]
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, v in self._samples():
+            lines.append(f"{self.name}{_labelstr(self.labelnames, key)} {_fmt(v)}")
+        return lines
+
+class Counter(_Metric):
+    """Monotonic count (requests, chars, errors). Unlabelled counters take inc() directly."""
+    kind = "counter"
+
+    def inc(self, amount=1.0):
+        if amount < 0:
+            raise ValueError("counters only go up")
+        self.labels().inc(amount)
+
+class Gauge(_Metric):
+    """Value that goes up and down (queue depth, active step)."""
+    kind = "gauge"
+
+    def set(self, value): self.labels().set(value)
+    def inc(self, amount=1.0): self.labels().inc(amount)
+    def dec(self, amount=1.0): self.labels().dec(amount)
+
+class Histogram(_Metric):
+    """Fixed-bucket distribution; exposes cumulative _bucket{le=...}, _sum and _count."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != math.inf))
+
+    def _new(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            counts, total, n = child.snapshot()
+            acc = 0
+            for le, c in zip(self.buckets + (math.inf,), counts):
+                acc += c
+                le_pair = 'le="%s"' % _fmt(le)
+                lines.append(f"{self.name}_bucket{_labelstr(self.labelnames, key, le_pair)} {acc}")
+            lines.append(f"{self.name}_sum{_labelstr(self.labelnames, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labelstr(self.labelnames, key)} {n}")
+        return lines
+
+class Registry:
+    """Ordered set of metrics rendered together by exposition()."""
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"duplicate metric {metric.name}")
+            self._metrics[metric.name] = metric
+        if not metric.labelnames:
+            metric.labels()   # unlabelled series exist (at 0) from the start, as scrapers expect
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def exposition(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:   # a broken callback must not take down the whole scrape
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
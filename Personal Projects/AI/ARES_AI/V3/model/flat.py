@@ -0,0 +1,98 @@
+# model/flat.py — flat float64 weight file + a read-only TinyCharRNN that serves straight from mmap
+#
+# Layout:  b"ARESFLT1" | uint64 header_len | JSON header (space-padded to 8 bytes) | float64 data
+# Sections are row-major: E, Whh, Why, bh, by, plus the transposes WhhT / WhyT so the forward
+# pass can use column dot products without building its own copy.
+import json, mmap, os, struct, sys
+from array import array
+from operator import mul
+from mymath import tanh, softmax
+from model.model import TinyCharRNN
+
+MAGIC = b"ARESFLT1"
+
+def _sections(model):
+    V, H = model.vocab_size, model.hidden
+    return [
+        ("E",    V, H, model.E),
+        ("Whh",  H, H, model.Whh),
+        ("Why",  H, V, model.Why),
+        ("bh",   1, H, [model.bh]),
+        ("by",   1, V, [model.by]),
+        ("WhhT", H, H, [list(c) for c in zip(*model.Whh)]),
+        ("WhyT", V, H, [list(c) for c in zip(*model.Why)]),
+    ]
+
+def export_flat(model, path, step=None, source=None):
+    """Write `model` as a flat weight file (atomic: tmp + os.replace)."""
+    if not hasattr(model, "Whh"):
+        raise TypeError(f"flat export needs a dense TinyCharRNN, got {type(model).__name__}")
+    data = array("d")
+    layout = {}
+    for name, rows, cols, mat in _sections(model):
+        layout[name] = [len(data), rows, cols]
+        for row in mat:
+            data.extend(row)
+    header = {
+        "vocab_size": model.vocab_size, "hidden": model.hidden, "lr": model.lr,
+        "step": step, "source": source, "byteorder": sys.byteorder, "sections": layout,
+    }
+    hdr = json.dumps(header).encode("utf-8")
+    hdr += b" " * ((-(len(MAGIC) + 8 + len(hdr))) % 8)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(hdr)))
+        f.write(hdr)
+        data.tofile(f)
+    os.replace(tmp, path)
+    return path
+
+class MappedCharRNN(TinyCharRNN):
+    """
+    Inference-only TinyCharRNN backed by a read-only mmap of a flat weight file.
+    Weight rows are memoryview slices into the mapping, so N processes mapping the same
+    file share one physical copy. train_step/save are not supported (weights are read-only).
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path}: not a flat weight file")
+        (hlen,) = struct.unpack("<Q", self._mm[len(MAGIC):len(MAGIC) + 8])
+        start = len(MAGIC) + 8
+        self.header = json.loads(self._mm[start:start + hlen].decode("utf-8"))
+        if self.header.get("byteorder") != sys.byteorder:
+            raise ValueError(f"{path}: written on a {self.header.get('byteorder')}-endian machine")
+        self.vocab_size = self.header["vocab_size"]
+        self.hidden = self.header["hidden"]
+        self.lr = self.header.get("lr", 0.03)
+        self.step = self.header.get("step")
+
+        flat = memoryview(self._mm)[start + hlen:].cast("d")
+        def rows(name):
+            off, r, c = self.header["sections"][name]
+            return [flat[off + i * c : off + (i + 1) * c] for i in range(r)]
+        self.E, self.Whh, self.Why = rows("E"), rows("Whh"), rows("Why")
+        self.bh, self.by = rows("bh")[0], rows("by")[0]
+        self.WhhT, self.WhyT = rows("WhhT"), rows("WhyT")
+
+    @staticmethod
+    def load(path):
+        return MappedCharRNN(path)
+
+    def _columns(self):
+        return self.WhhT, self.WhyT
+
+    def _step(self, idx, h_prev):
+        pre = [x + sum(map(mul, h_prev, c)) + b for x, c, b in zip(self.E[idx], self.WhhT, self.bh)]
+        h = tanh(pre)
+        logits = [sum(map(mul, h, c)) + b for c, b in zip(self.WhyT, self.by)]
+        return h, softmax(logits)
+
+    def train_step(self, idx_seq, tgt_seq):
+        raise TypeError("MappedCharRNN is read-only; train a TinyCharRNN and re-export")
+
+    def save(self, path):
+        raise TypeError("MappedCharRNN is read-only; save the source TinyCharRNN instead")
@@ -0,0 +1,190 @@
+# model/lowrank.py — rank-r factorized TinyCharRNN (Whh ≈ Ahh·Bhh, Why ≈ Ahy·Bhy), pure Python
+#
+# Built from a trained dense checkpoint with LowRankCharRNN.from_dense (see compress.py), saved as
+# a normal JSON checkpoint with "kind": "lowrank"; TinyCharRNN.load() recognises it, so app.py,
+# evaluate.py and the model cache serve it like any other checkpoint.
+import json, random
+from operator import mul, sub
+from itertools import repeat
+from mymath import tanh, softmax, cross_entropy, zeros_matrix, zeros_vec
+from model.model import TinyCharRNN, _safe_save_json
+
+def _dot_rows(M, v):
+    """M (rows) · v -> one dot product per row."""
+    return [sum(map(mul, row, v)) for row in M]
+
+def _normalize(v):
+    n = sum(map(mul, v, v)) ** 0.5
+    return [x / n for x in v] if n > 1e-12 else v
+
+def factorize(M, rank, iters=30, seed=0):
+    """
+    Best rank-`rank` approximation M (m×n) ≈ P (m×rank) · Q (rank×n) by subspace iteration on MᵀM
+    (power iteration on `rank` vectors at once, re-orthonormalised with Gram-Schmidt each round).
+    The scale of each component is split evenly (√σ on both sides) so that neither factor dwarfs
+    the other; with all of σ in P, SGD on the pair blows up during the recovery fine-tune.
+    Returns (P, Q, energy) where energy = ||P·Q||² / ||M||² (share of the Frobenius norm kept).
+    """
+    m, n = len(M), len(M[0])
+    rank = max(1, min(rank, m, n))
+    cols = [list(c) for c in zip(*M)]
+    rng = random.Random(seed)
+    V = [[rng.gauss(0.0, 1.0) for _ in range(n)] for _ in range(rank)]
+    for _ in range(iters):
+        Z = [_dot_rows(cols, _dot_rows(M, v)) for v in V]   # MᵀM v
+        V = []
+        for z in Z:
+            for q in V:
+                d = sum(map(mul, z, q))
+                z = [a - d * b for a, b in zip(z, q)]
+            V.append(_normalize(z))
+    MV = [_dot_rows(M, v) for v in V]                       # σ_k · u_k, length m each
+    total = sum(sum(map(mul, row, row)) for row in M)
+    kept = sum(sum(map(mul, c, c)) for c in MV)
+    scale = [sum(map(mul, c, c)) ** 0.25 or 1.0 for c in MV]   # √σ_k
+    P = [list(r) for r in zip(*[[x / s for x in c] for c, s in zip(MV, scale)])]
+    Q = [[x * s for x in v] for v, s in zip(V, scale)]
+    return P, Q, (kept / total if total else 1.0)
+
+def _sgd(rows, grads, eta, clip):
+    """rows -= eta * clip(grads), row by row, in place."""
+    lo, hi, neg = repeat(-clip), repeat(clip), repeat(eta)
+    for r, g in zip(rows, grads):
+        r[:] = map(sub, r, map(mul, neg, map(max, lo, map(min, hi, g))))
+
+class LowRankCharRNN(TinyCharRNN):
+    """
+    TinyCharRNN with both dense products factorized:
+      h_t = tanh( E[x_t] + (h_{t-1} Ahh) Bhh + b_h )      Ahh: H×r, Bhh: r×H
+      y_t = softmax( (h_t Ahy) Bhy + b_y )                Ahy: H×s, Bhy: s×V
+    A step costs 2·H·r + H·s + s·V multiply-adds instead of H·H + H·V. Same generate/score
+    interface as the dense model; train_step updates the factors (used for the recovery fine-tune).
+    """
+    def __init__(self, vocab_size, hidden, rank_hh, rank_hy, lr=0.03):
+        self.vocab_size = vocab_size
+        self.hidden = hidden
+        self.lr = lr
+        self.rank_hh, self.rank_hy = rank_hh, rank_hy
+        self.E   = zeros_matrix(vocab_size, hidden)
+        self.Ahh = zeros_matrix(hidden, rank_hh)
+        self.Bhh = zeros_matrix(rank_hh, hidden)
+        self.Ahy = zeros_matrix(hidden, rank_hy)
+        self.Bhy = zeros_matrix(rank_hy, vocab_size)
+        self.bh  = zeros_vec(hidden)
+        self.by  = zeros_vec(vocab_size)
+        self._cols = None
+
+    @staticmethod
+    def from_dense(model, rank_hh, rank_hy=None, iters=30):
+        """Factorize a trained TinyCharRNN. Returns (LowRankCharRNN, {"Whh": energy, "Why": energy})."""
+        rank_hy = rank_hh if rank_hy is None else rank_hy
+        Ahh, Bhh, e_hh = factorize(model.Whh, rank_hh, iters)
+        Ahy, Bhy, e_hy = factorize(model.Why, rank_hy, iters)
+        m = LowRankCharRNN(model.vocab_size, model.hidden, len(Bhh), len(Bhy), lr=model.lr)
+        m.E = [list(r) for r in model.E]
+        m.bh, m.by = list(model.bh), list(model.by)
+        m.Ahh, m.Bhh, m.Ahy, m.Bhy = Ahh, Bhh, Ahy, Bhy
+        return m, {"Whh": e_hh, "Why": e_hy}
+
+    def to_dense(self):
+        """Equivalent dense TinyCharRNN (Whh = Ahh·Bhh, Why = Ahy·Bhy), e.g. for model/flat.py exports."""
+        m = TinyCharRNN.__new__(TinyCharRNN)   # no random init: every field is set below
+        m.vocab_size, m.hidden, m.lr = self.vocab_size, self.hidden, self.lr
+        BhhT = [list(c) for c in zip(*self.Bhh)]
+        BhyT = [list(c) for c in zip(*self.Bhy)]
+        m.E = [list(r) for r in self.E]
+        m.Whh = [_dot_rows(BhhT, a) for a in self.Ahh]
+        m.Why = [_dot_rows(BhyT, a) for a in self.Ahy]
+        m.bh, m.by = list(self.bh), list(self.by)
+        return m
+
+    def n_params(self):
+        H, V = self.hidden, self.vocab_size
+        return V * H + 2 * H * self.rank_hh + (H + V) * self.rank_hy + H + V
+
+    # ---------- forward ----------
+    def _columns(self):
+        """Column views of the four factors, cached until the next train_step."""
+        if self._cols is None:
+            self._cols = tuple([list(c) for c in zip(*M)] for M in (self.Ahh, self.Bhh, self.Ahy, self.Bhy))
+        return self._cols
+
+    def _step(self, idx, h_prev):
+        AhhT, BhhT, AhyT, BhyT = self._columns()
+        u = [sum(map(mul, h_prev, c)) for c in AhhT]
+        h = tanh([x + sum(map(mul, u, c)) + b for x, c, b in zip(self.E[idx], BhhT, self.bh)])
+        z = [sum(map(mul, h, c)) for c in AhyT]
+        return h, softmax([sum(map(mul, z, c)) + b for c, b in zip(BhyT, self.by)])
+
+    def _step_batch(self, idxs, hs, cols=None):
+        """One _step per sequence: with r-wide factors there is no long column walk worth sharing."""
+        steps = [self._step(i, h) for i, h in zip(idxs, hs)]
+        return [s[0] for s in steps], [s[1] for s in steps]
+
+    # ---------- backward (BPTT through the factors) ----------
+    def train_step(self, idx_seq, tgt_seq, clip=0.25):
+        AhhT, BhhT, AhyT, BhyT = self._columns()
+        E, bh, by = self.E, self.bh, self.by
+        h = [0.0] * self.hidden
+        hs, us, zs, dls = [h], [], [], []
+        loss = 0.0
+        for x, y in zip(idx_seq, tgt_seq):
+            u = [sum(map(mul, h, c)) for c in AhhT]
+            h = tanh([e + sum(map(mul, u, c)) + b for e, c, b in zip(E[x], BhhT, bh)])
+            z = [sum(map(mul, h, c)) for c in AhyT]
+            p = softmax([sum(map(mul, z, c)) + b for c, b in zip(BhyT, by)])
+            loss += cross_entropy(p, y)
+            p[y] -= 1.0                        # now dL/dlogits
+            hs.append(h); us.append(u); zs.append(z); dls.append(p)
+
+        T = len(dls)
+        dzs, dps, dus = [None] * T, [None] * T, [None] * T
+        dn = [0.0] * self.hidden
+        for t in range(T - 1, -1, -1):
+            h = hs[t + 1]
+            dz = _dot_rows(self.Bhy, dls[t])
+            dh = [a + b for a, b in zip(_dot_rows(self.Ahy, dz), dn)]
+            dp = [g * (1.0 - v * v) for g, v in zip(dh, h)]
+            du = _dot_rows(self.Bhh, dp)
+            dn = _dot_rows(self.Ahh, du)
+            dzs[t], dps[t], dus[t] = dz, dp, du
+
+        # factor grads = sums over time of outer products, one dot product over T per entry
+        outer = lambda A, B: [[sum(map(mul, a, b)) for b in zip(*B)] for a in zip(*A)]
+        gBhy, gAhy = outer(zs, dls), outer(hs[1:], dzs)
+        gBhh, gAhh = outer(us, dps), outer(hs[:-1], dus)
+        gby = [sum(c) for c in zip(*dls)]
+        gbh = [sum(c) for c in zip(*dps)]
+        gE = {}
+        for x, dp in zip(idx_seq, dps):
+            g = gE.get(x)
+            gE[x] = dp if g is None else [a + b for a, b in zip(g, dp)]
+
+        eta = self.lr
+        _sgd(self.Bhy, gBhy, eta, clip); _sgd(self.Ahy, gAhy, eta, clip)
+        _sgd(self.Bhh, gBhh, eta, clip); _sgd(self.Ahh, gAhh, eta, clip)
+        _sgd([E[i] for i in gE], list(gE.values()), eta, clip)
+        _sgd([bh, by], [gbh, gby], eta, clip)
+        self._cols = None
+        return loss / T
+
+    # ---------- persistence ----------
+    def save(self, path):
+        _safe_save_json(path, {
+            "kind": "lowrank", "vocab_size": self.vocab_size, "hidden": self.hidden,
+            "rank_hh": self.rank_hh, "rank_hy": self.rank_hy,
+            "E": self.E, "Ahh": self.Ahh, "Bhh": self.Bhh, "Ahy": self.Ahy, "Bhy": self.Bhy,
+            "bh": self.bh, "by": self.by, "lr": self.lr,
+        })
+
+    @staticmethod
+    def from_dict(d):
+        m = LowRankCharRNN(d["vocab_size"], d["hidden"], d["rank_hh"], d["rank_hy"], lr=d.get("lr", 0.03))
+        m.E, m.Ahh, m.Bhh, m.Ahy, m.Bhy = d["E"], d["Ahh"], d["Bhh"], d["Ahy"], d["Bhy"]
+        m.bh, m.by = d["bh"], d["by"]
+        return m
+
+    @staticmethod
+    def load(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return LowRankCharRNN.from_dict(json.load(f))
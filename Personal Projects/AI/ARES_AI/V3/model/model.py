@@ -1,5 +1,6 @@
 # model/model.py — minimal char RNN (pure Python, stdlib-only)
-import json, random, os
+import json, math, random, os
+from operator import mul
 from mymath import (
     randn_matrix, zeros_matrix, zeros_vec, vecTmat,
     add_inplace, tanh, dtanh, softmax, cross_entropy, clip_vec, clip_mat
@@ -47,6 +48,32 @@ class TinyCharRNN:
         probs = softmax(logits)
         return h, probs
 
+    # ---------- forward B independent steps in lockstep ----------
+    def _columns(self):
+        """Column views of Whh / Why (transposed copies). Rebuild after any weight update."""
+        return [list(c) for c in zip(*self.Whh)], [list(c) for c in zip(*self.Why)]
+
+    def _step_batch(self, idxs, hs, cols=None):
+        """
+        Same math as _step for B sequences at once. Each weight column is walked once and
+        dotted with every sequence's hidden state via sum(map(mul, ...)), which runs the
+        inner loop in C. Pass `cols` from _columns() to reuse the transpose across steps.
+        """
+        WhhT, WhyT = cols or self._columns()
+        E, bh, by = self.E, self.bh, self.by
+        B = len(idxs)
+        pres = [[] for _ in range(B)]
+        for col in WhhT:
+            for b in range(B):
+                pres[b].append(sum(map(mul, hs[b], col)))
+        new_hs = [tanh([xi + wi + bi for xi, wi, bi in zip(E[idxs[b]], pres[b], bh)]) for b in range(B)]
+        logits = [[] for _ in range(B)]
+        for col in WhyT:
+            for b in range(B):
+                logits[b].append(sum(map(mul, new_hs[b], col)))
+        probs = [softmax([l + c for l, c in zip(logits[b], by)]) for b in range(B)]
+        return new_hs, probs
+
     # ---------- forward over a sequence ----------
     def forward(self, idx_seq, h0=None):
         h = [0.0]*self.hidden if h0 is None else h0[:]
@@ -158,14 +185,89 @@ class TinyCharRNN:
 
         return loss / len(idx_seq)
 
+    # ---------- scoring (log-likelihood) ----------
+    def score(self, seqs, per_char=False, state=None):
+        """
+        Log-likelihood of each id sequence under the model, all sequences advanced in lockstep.
+        - seqs: list of id lists; seqs[b][t] is scored given everything before it
+        - state: per-sequence (h, last_idx) carried over from a previous chunk, or None
+                 (a fresh sequence can't score its first char: there is no context yet)
+        Returns (results, state): results[b] = {"n", "logprob", "per_char"?} for this chunk,
+        state[b] = (h, last_idx) to pass with the next chunk of the same text.
+        """
+        B = len(seqs)
+        state = state or [None]*B
+        inputs, targets, hs = [], [], []
+        for b in range(B):
+            seq = seqs[b]
+            if state[b] is None:
+                hs.append([0.0]*self.hidden)
+                inputs.append(seq[:-1]); targets.append(seq[1:])
+            else:
+                h, last = state[b]
+                hs.append(h)
+                inputs.append([last] + seq[:-1]); targets.append(seq)
+        results = [{"n": len(targets[b]), "logprob": 0.0} for b in range(B)]
+        if per_char:
+            for r in results: r["per_char"] = []
+
+        T = max((len(t) for t in targets), default=0)
+        cols = self._columns() if T else None
+        for t in range(T):
+            active = [b for b in range(B) if t < len(targets[b])]
+            new_hs, probs = self._step_batch([inputs[b][t] for b in active], [hs[b] for b in active], cols)
+            for k, b in enumerate(active):
+                hs[b] = new_hs[k]
+                lp = -cross_entropy(probs[k], targets[b][t])
+                results[b]["logprob"] += lp
+                if per_char:
+                    results[b]["per_char"].append(lp)
+
+        new_state = []
+        for b in range(B):
+            if seqs[b]:
+                new_state.append((hs[b], seqs[b][-1]))
+            else:
+                new_state.append(state[b])
+        return results, new_state
+
+    def score_texts(self, tokenizer, texts, per_char=False, chunk=1024):
+        """
+        Score many strings at once. Each text is encoded and scored `chunk` chars at a time with
+        the hidden state carried across chunks, so working memory doesn't grow with text length.
+        Returns one dict per text: chars, logprob (total, nats), mean_logprob, ppl [, per_char].
+        """
+        B = len(texts)
+        totals = [{"chars": 0, "logprob": 0.0} for _ in range(B)]
+        if per_char:
+            for r in totals: r["per_char"] = []
+        state = [None]*B
+        longest = max((len(t) for t in texts), default=0)
+        for start in range(0, longest, chunk):
+            live = [b for b in range(B) if start < len(texts[b])]
+            seqs = [tokenizer.encode(texts[b][start:start + chunk]) for b in live]
+            results, st = self.score(seqs, per_char=per_char, state=[state[b] for b in live])
+            for k, b in enumerate(live):
+                state[b] = st[k]
+                totals[b]["chars"] += results[k]["n"]
+                totals[b]["logprob"] += results[k]["logprob"]
+                if per_char:
+                    totals[b]["per_char"].extend(results[k]["per_char"])
+        for r in totals:
+            n = r["chars"]
+            r["mean_logprob"] = r["logprob"] / n if n else None
+            r["ppl"] = math.exp(-r["mean_logprob"]) if n else None
+        return totals
+
     # ---------- sampling helpers (temperature + top-k) ----------
-    def _pick(self, probs, temperature=1.0, top_k=None):
+    def _pick(self, probs, temperature=1.0, top_k=None, rng=None):
         """
         Returns an index sampled from `probs` using temperature scaling and optional top-k filtering.
         - temperature <= 0: greedy (argmax)
         - 0 < temperature ~ 0.6..0.9: safer/more coherent
         - temperature > 1.0: more creative/chaotic
         - top_k: restrict to k highest-probability tokens before sampling
+        - rng: optional random.Random for reproducible sampling (default: module RNG)
         """
         # greedy if temperature<=0
         if temperature is None or temperature <= 0:
@@ -175,12 +277,14 @@ class TinyCharRNN:
                     bestp = p; best = i
             return best
 
-        # temperature scaling directly on probabilities
-        T = temperature if temperature > 1e-8 else 1e-8
+        # temperature scaling p ** (1/T), in log space relative to the most likely token: that one
+        # gets weight exactly 1, so a tiny T can't underflow every weight to 0 (s >= 1 below)
+        inv_t = 1.0 / temperature
+        log_top = math.log(max(probs))
         scaled = []
         s = 0.0
         for p in probs:
-            q = p ** (1.0 / T)
+            q = math.exp((math.log(p) - log_top) * inv_t) if p > 0.0 else 0.0
             scaled.append(q); s += q
         invs = 1.0 / s
         for i in range(len(scaled)):
@@ -194,7 +298,7 @@ class TinyCharRNN:
             s2 = 0.0
             for i in idxs:
                 s2 += scaled[i]
-            r = random.random()
+            r = (rng or random).random()
             acc = 0.0
             for i in idxs:
                 acc += scaled[i] / s2
@@ -203,7 +307,7 @@ class TinyCharRNN:
             return idxs[-1]
 
         # full categorical
-        r = random.random()
+        r = (rng or random).random()
         acc = 0.0
         for i, p in enumerate(scaled):
             acc += p
@@ -212,13 +316,19 @@ class TinyCharRNN:
         return len(scaled) - 1
 
     # ---------- generation ----------
-    def generate(self, tokenizer, seed="A", max_new=200, temperature=1.0, top_k=None):
+    def generate(self, tokenizer, seed="A", max_new=200, temperature=1.0, top_k=None, rng=None,
+                 should_stop=None, n=1):
         """
         Generate text continuing from `seed`.
         - tokenizer: must provide encode(str)->List[int], decode(List[int])->str
         - seed: initial text to prime hidden state
         - max_new: number of new tokens to append
-        - temperature/top_k: sampling controls (see _pick)
+        - temperature/top_k/rng: sampling controls (see _pick)
+        - should_stop: optional callable checked before each new token; True ends early
+          (the text generated so far is returned)
+        - n: number of samples. n > 1 returns a list of n strings: the seed is primed once, the
+          hidden state forked n ways and the n continuations advanced together via _step_batch,
+          each sampled with its own RNG (derived from `rng`, so a seeded rng stays reproducible)
         """
         # prime hidden with the seed (limit to last 64 chars to bound warmup time)
         h = [0.0]*self.hidden
@@ -228,12 +338,32 @@ class TinyCharRNN:
 
         # continue
         idx = out[-1] if out else 0
+        if n > 1:
+            return self._generate_n(tokenizer, out, h, idx, n, max_new, temperature, top_k, rng, should_stop)
         for _ in range(max_new):
+            if should_stop is not None and should_stop():
+                break
             h, probs = self._step(idx, h)
-            idx = self._pick(probs, temperature=temperature, top_k=top_k)
+            idx = self._pick(probs, temperature=temperature, top_k=top_k, rng=rng)
             out.append(idx)
         return tokenizer.decode(out)
 
+    def _generate_n(self, tokenizer, out, h, idx, n, max_new, temperature, top_k, rng, should_stop):
+        """n continuations of an already-primed state, one batched step per new char."""
+        base = rng or random
+        rngs = [random.Random(base.getrandbits(64)) for _ in range(n)]
+        outs = [out[:] for _ in range(n)]
+        hs, idxs = [h] * n, [idx] * n       # hidden vectors are replaced each step, never mutated
+        cols = self._columns()
+        for _ in range(max_new):
+            if should_stop is not None and should_stop():
+                break
+            hs, probs = self._step_batch(idxs, hs, cols)
+            idxs = [self._pick(p, temperature=temperature, top_k=top_k, rng=r) for p, r in zip(probs, rngs)]
+            for o, i in zip(outs, idxs):
+                o.append(i)
+        return [tokenizer.decode(o) for o in outs]
+
     # ---------- persistence ----------
     def save(self, path):
         data = {
@@ -247,6 +377,12 @@ class TinyCharRNN:
     def load(path):
         with open(path, "r", encoding="utf-8") as f:
             d = json.load(f)
-        m = TinyCharRNN(d["vocab_size"], d["hidden"], lr=d.get("lr", 0.03))
+        if d.get("kind") == "lowrank":           # factorized checkpoint written by compress.py
+            from model.lowrank import LowRankCharRNN
+            return LowRankCharRNN.from_dict(d)
+        # bypass __init__: its random init (and random.seed) would be thrown away here, and the
+        # server loads checkpoints mid-serving, where reseeding would reset every request's sampling
+        m = TinyCharRNN.__new__(TinyCharRNN)
+        m.vocab_size, m.hidden, m.lr = d["vocab_size"], d["hidden"], d.get("lr", 0.03)
         m.E, m.Whh, m.Why, m.bh, m.by = d["E"], d["Whh"], d["Why"], d["bh"], d["by"]
         return m
@@ -0,0 +1,265 @@
+# model/specialize.py — shape-specialized kernels for TinyCharRNN, generated and compile()d per (hidden, vocab)
+#
+# hidden and vocab_size are fixed once a model exists, so the per-element Python loops in _step and
+# train_step can be written out ahead of time for that exact shape:
+#   - forward: the hidden/logit vectors are unrolled list displays with literal indices; each entry
+#     is one C-level dot product (sum(map(mul, ...))) against a weight column bound as a local
+#   - backward: dh/dpre and the carry into h_{t-1} are unrolled the same way; the per-timestep
+#     outer products (dWhy, dWhh) are deferred and done once per sequence as dot products over time
+#   - update: clip + SGD runs row-wise through map() instead of element by element
+# Compiled code objects are marshalled to model/__pycache__/kernels/, keyed by shape, Python version
+# and this generator's source. Each kernel is benchmarked against the generic method on first use
+# and only installed if it is faster; anything failing here leaves the model on the generic path.
+#
+#   python -m model.specialize --hidden 128 --vocab 65      # generate, benchmark, print the verdict
+import argparse, copy, hashlib, json, marshal, os, random, sys, time
+
+KERNEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__", "kernels")
+MIN_SPEEDUP = 1.05     # keep a kernel only if it beats the generic one by at least this much
+BENCH_SEQ_LEN = 32     # sequence length used when benchmarking train_step
+
+def _generate(H, V):
+    """Python source for step/train_step kernels specialized to hidden=H, vocab=V."""
+    hs = range(H)
+    vs = range(V)
+    cols_h = ", ".join(f"C{i}" for i in hs)
+    cols_v = ", ".join(f"D{j}" for j in vs)
+    rows_h = ", ".join(f"W{i}" for i in hs)
+    rows_v = ", ".join(f"Y{i}" for i in hs)
+    comma = "," if H == 1 else ""
+    commav = "," if V == 1 else ""
+    hidden = ",\n            ".join(f"tanh(x[{i}] + sum(map(mul, h, C{i})) + bh[{i}])" for i in hs)
+    logits = ",\n            ".join(f"sum(map(mul, h, D{j})) + by[{j}]" for j in vs)
+    dpre = ",\n                ".join(f"(sum(map(mul, Y{i}, dl)) + dn[{i}]) * (1.0 - h[{i}] * h[{i}])" for i in hs)
+    carry = ",\n                ".join(f"sum(map(mul, W{i}, dp))" for i in hs)
+    return f'''\
+# generated by model/specialize.py for hidden={H} vocab={V}
+from math import tanh, exp, log
+from operator import mul, add, sub
+from itertools import repeat
+
+H = {H}
+V = {V}
+
+def make_step(E, WhhT, WhyT, bh, by):
+    """step(idx, h_prev) -> (h, probs) closed over the given column views of Whh / Why."""
+    {cols_h}{comma} = WhhT
+    {cols_v}{commav} = WhyT
+    def step(idx, h):
+        x = E[idx]
+        h = [
+            {hidden},
+        ]
+        l = [
+            {logits},
+        ]
+        m = max(l)
+        e = [exp(v - m) for v in l]
+        s = sum(e)
+        return h, [v / s for v in e]
+    return step
+
+def _update(rows, grads, eta, clip):
+    lo, hi, neg = repeat(-clip), repeat(clip), repeat(eta)
+    for r, g in zip(rows, grads):
+        r[:] = map(sub, r, map(mul, neg, map(max, lo, map(min, hi, g))))
+
+def train_step(m, xs, ys, clip=0.25):
+    """Same update as TinyCharRNN.train_step; returns the mean loss."""
+    E, Whh, Why, bh, by = m.E, m.Whh, m.Why, m.bh, m.by
+    step = make_step(E, list(zip(*Whh)), list(zip(*Why)), bh, by)
+    {rows_h}{comma} = Whh
+    {rows_v}{comma} = Why
+
+    h = [0.0] * H
+    hs = [h]          # hs[t + 1] = h_t; hs[0] is the zero initial state
+    dls = []          # dL/dlogits per step (the probs with 1 subtracted at the target)
+    loss = 0.0
+    for x, y in zip(xs, ys):
+        h, p = step(x, h)
+        hs.append(h)
+        loss -= log(p[y] + 1e-9)
+        p[y] -= 1.0
+        dls.append(p)
+
+    T = len(dls)
+    dpres = [None] * T
+    dn = [0.0] * H
+    for t in range(T - 1, -1, -1):
+        dl = dls[t]
+        h = hs[t + 1]
+        dp = [
+                {dpre},
+        ]
+        dpres[t] = dp
+        dn = [
+                {carry},
+        ]
+
+    # parameter grads: sum over time of outer products, one dot product over T per entry
+    HT = list(zip(*hs[1:])); HP = list(zip(*hs[:-1]))
+    DL = list(zip(*dls));    DP = list(zip(*dpres))
+    gWhy = [[sum(map(mul, a, b)) for b in DL] for a in HT]
+    gWhh = [[sum(map(mul, a, b)) for b in DP] for a in HP]
+    gby = [sum(c) for c in DL]
+    gbh = [sum(c) for c in DP]
+    gE = {{}}
+    for x, dp in zip(xs, dpres):
+        g = gE.get(x)
+        gE[x] = dp if g is None else list(map(add, g, dp))
+
+    eta = m.lr
+    _update(Why, gWhy, eta, clip)
+    _update(Whh, gWhh, eta, clip)
+    _update([E[i] for i in gE], list(gE.values()), eta, clip)
+    _update([bh, by], [gbh, gby], eta, clip)
+    return loss / T
+'''
+
+def _cache_key(H, V):
+    gen = hashlib.sha256(_generate.__code__.co_code + repr(_generate.__code__.co_consts).encode()).hexdigest()[:10]
+    return f"rnn_h{H}_v{V}_{sys.implementation.cache_tag}_{gen}"
+
+def load_kernels(H, V, cache_dir=KERNEL_DIR):
+    """Module namespace (dict) with make_step/train_step for this shape; compiled once, then from disk."""
+    key = _cache_key(H, V)
+    path = os.path.join(cache_dir, key + ".bin")
+    code = None
+    try:
+        with open(path, "rb") as f:
+            code = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    if code is None:
+        code = compile(_generate(H, V), f"<specialized h={H} v={V}>", "exec")
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                marshal.dump(code, f)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass   # read-only tree: still usable, just compiled again next time
+    ns = {}
+    exec(code, ns)
+    return ns
+
+def _bench(fn, reps):
+    best = float("inf")
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def benchmark(model, ns, steps=200, reps=3):
+    """
+    Best-of-reps seconds (generic, specialized) per kernel. step runs against the model's own
+    class method on its weights (read-only); train_step runs on deep copies, and only for models
+    that use TinyCharRNN's generic train_step.
+    """
+    from model.model import TinyCharRNN
+    rng = random.Random(0)
+    idxs = [rng.randrange(model.vocab_size) for _ in range(steps)]
+    h0 = [rng.uniform(-0.5, 0.5) for _ in range(model.hidden)]
+    cols = model._columns()
+    step = ns["make_step"](model.E, cols[0], cols[1], model.bh, model.by)
+
+    def run(f):
+        h = h0
+        for i in idxs:
+            h, _ = f(i, h)
+    generic_step = lambda i, h: type(model)._step(model, i, h)
+    res = {"step": (_bench(lambda: run(generic_step), reps), _bench(lambda: run(step), reps))}
+
+    xs = idxs[:BENCH_SEQ_LEN]; ys = idxs[1:BENCH_SEQ_LEN + 1]
+    if type(model).train_step is TinyCharRNN.train_step:
+        a, b = copy.deepcopy(model), copy.deepcopy(model)
+        res["train_step"] = (_bench(lambda: TinyCharRNN.train_step(a, xs, ys), reps),
+                             _bench(lambda: ns["train_step"](b, xs, ys), reps))
+    return res
+
+def verdict(model, ns, cache_dir=KERNEL_DIR):
+    """{kernel: speedup} for this shape and model class; measured once, remembered next to the code."""
+    path = os.path.join(cache_dir, f"{_cache_key(model.hidden, model.vocab_size)}_{type(model).__name__}.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    res = {k: round(g / s, 3) for k, (g, s) in benchmark(model, ns).items()}
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(res, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+    return res
+
+def install(model, kernels=("step", "train_step"), cache_dir=KERNEL_DIR, force=False):
+    """
+    Swap the specialized kernels onto `model` (instance attributes; save/load are unaffected) where
+    they beat the generic ones, unless force=True. Returns the list of kernels installed.
+    train_step is skipped for read-only models. The step kernel closes over column copies of
+    Whh/Why; every train_step (specialized or generic) bumps a version and the kernel rebuilds
+    them lazily, so forward/generate always see the current weights.
+    """
+    if not hasattr(model, "Whh"):
+        return []   # not a dense model (e.g. LowRankCharRNN): nothing to specialize
+    try:
+        ns = load_kernels(model.hidden, model.vocab_size, cache_dir)
+        speed = {} if force else verdict(model, ns, cache_dir)
+    except Exception as e:
+        print("[specialize] falling back to generic kernels:", e)
+        return []
+    from model.model import TinyCharRNN
+    wanted = [k for k in kernels if force or speed.get(k, 0.0) >= MIN_SPEEDUP]
+    if type(model).train_step is not TinyCharRNN.train_step:
+        wanted = [k for k in wanted if k != "train_step"]   # e.g. MappedCharRNN is read-only
+    installed = []
+    state = {"version": 0, "built": -1, "fn": None}
+
+    if "step" in wanted:
+        def step(idx, h_prev):
+            if state["built"] != state["version"]:
+                WhhT, WhyT = model._columns()
+                state["fn"] = ns["make_step"](model.E, WhhT, WhyT, model.bh, model.by)
+                state["built"] = state["version"]
+            return state["fn"](idx, h_prev)
+        model._step = step
+        installed.append("step")
+    if "train_step" in wanted:
+        kernel = ns["train_step"]
+        def train_step(idx_seq, tgt_seq):
+            loss = kernel(model, idx_seq, tgt_seq)
+            state["version"] += 1
+            return loss
+        model.train_step = train_step
+        installed.append("train_step")
+    elif "step" in wanted:
+        generic = model.train_step   # updates Whh/Why in place: the step kernel's columns go stale
+        def train_step(idx_seq, tgt_seq, *args, **kwargs):
+            try:
+                return generic(idx_seq, tgt_seq, *args, **kwargs)
+            finally:
+                state["version"] += 1
+        model.train_step = train_step
+    return installed
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate, benchmark and cache specialized TinyCharRNN kernels.")
+    ap.add_argument("--hidden", type=int, default=128)
+    ap.add_argument("--vocab", type=int, default=65)
+    ap.add_argument("--steps", type=int, default=200)
+    args = ap.parse_args()
+
+    from model.model import TinyCharRNN
+    t0 = time.perf_counter()
+    ns = load_kernels(args.hidden, args.vocab)
+    print(f"[specialize] kernels for hidden={args.hidden} vocab={args.vocab} ready in {time.perf_counter() - t0:.2f}s")
+    model = TinyCharRNN(args.vocab, args.hidden, seed=0)
+    for name, (g, s) in benchmark(model, ns, steps=args.steps).items():
+        keep = "keep" if g / s >= MIN_SPEEDUP else "generic"
+        print(f"  {name:<11} generic {g * 1000:8.1f} ms   specialized {s * 1000:8.1f} ms   x{g / s:5.2f}  -> {keep}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# model/widen.py — function-preserving widening of a TinyCharRNN (Net2Net "Net2WiderNet")
+#
+# New hidden units copy existing ones: unit j of the wide model replays unit g(j) of the narrow one
+# (same embedding column, bias and incoming recurrent weights), so the wide hidden state is the
+# narrow one with some entries repeated. Every unit's *outgoing* weights (recurrent and to the
+# logits) are then scaled by a share, and the shares of one unit's copies sum to 1, so the next
+# pre-activations and logits are exactly what the narrow model computes. The shares are random
+# rather than 1/copies: copies that start identical would otherwise get identical gradients and
+# never diverge.
+import random
+from model.model import TinyCharRNN
+
+def widen(model, hidden, seed=0):
+    """Copy of dense `model` with `hidden` units whose outputs match the original's (up to float rounding)."""
+    H = model.hidden
+    if hidden < H:
+        raise ValueError(f"can only widen: {H} -> {hidden}")
+    rng = random.Random(seed)
+    g = list(range(H)) + [rng.randrange(H) for _ in range(hidden - H)]   # new unit -> source unit
+
+    # per source unit: random positive shares over its copies, summing to 1
+    copies = {}
+    for j, src in enumerate(g):
+        copies.setdefault(src, []).append(j)
+    share = [0.0] * hidden
+    for js in copies.values():
+        w = [rng.uniform(0.5, 1.5) for _ in js]
+        s = sum(w)
+        for j, wj in zip(js, w):
+            share[j] = wj / s
+
+    wide = TinyCharRNN(model.vocab_size, hidden, lr=model.lr)
+    wide.E   = [[row[g[j]] for j in range(hidden)] for row in model.E]
+    wide.bh  = [model.bh[g[j]] for j in range(hidden)]
+    wide.Whh = [[model.Whh[g[i]][g[j]] * share[i] for j in range(hidden)] for i in range(hidden)]
+    wide.Why = [[w * share[i] for w in model.Why[g[i]]] for i in range(hidden)]
+    wide.by  = list(model.by)
+    return wide
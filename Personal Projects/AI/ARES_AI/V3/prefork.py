@@ -0,0 +1,233 @@
+# prefork.py — multi-process V3 server: one master, N forked workers, one shared weight file
+#
+#   python prefork.py --workers 4          # POSIX only (falls back to app.py's server elsewhere)
+#
+# The master binds the port and exports the served checkpoint to a flat float64 file
+# (model/flat.py). Every worker mmaps that file read-only, so N workers cost about one
+# model's worth of RAM instead of N boxed-list copies. The master also:
+#   - restarts workers that crash
+#   - runs the training-telemetry listener and shares it with the workers' /status (telemetry.py)
+#   - watches weights/ckpt.json (or takes SIGHUP) and rolls workers onto new weights:
+#     the new generation starts first, then the old one drains in-flight requests and exits
+import argparse, os, signal, socket, sys, threading, time
+from http.server import ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CKPT_PATH = os.path.join("weights", "ckpt.json")      # same files app.py serves from
+WEIGHTS_PATH = os.path.join("weights", "model.json")
+CRASH_WINDOW_SEC = 10.0    # more than `workers` crashes in this window → back off before respawning
+DRAIN_GRACE_SEC  = 30.0    # how long shutdown waits for workers before SIGKILL
+
+class _WorkerServer(ThreadingHTTPServer):
+    """Serves on a listening socket inherited from the master (non-blocking, shared by all workers)."""
+    daemon_threads = False   # server_close() must wait for in-flight requests when draining
+    block_on_close = True
+
+    def get_request(self):
+        conn, addr = self.socket.accept()   # BlockingIOError if another worker won the race
+        conn.setblocking(True)
+        return conn, addr
+
+def export_current():
+    """Flat-export whatever ckpt.json (or model.json) points at. Returns (flat_path, step, source)."""
+    from model.model import TinyCharRNN
+    from model.flat import export_flat
+    from serving import read_ckpt_pointer
+    path, step = read_ckpt_pointer(CKPT_PATH)
+    if not path or not os.path.exists(path):
+        path, step = WEIGHTS_PATH, None
+    model = TinyCharRNN.load(path)          # dispatches on the checkpoint's "kind"
+    if not hasattr(model, "Whh"):           # low-rank (compress.py): flat files hold dense weights
+        if not hasattr(model, "to_dense"):
+            raise TypeError(f"{path}: cannot flat-export a {type(model).__name__} checkpoint")
+        model = model.to_dense()
+    tag = step if step is not None else "latest"
+    out = os.path.join("weights", f"serve_{tag}_{os.getpid()}_{int(time.time() * 1000)}.flat")
+    export_flat(model, out, step=step, source=path)
+    return out, step, path
+
+class Master:
+    def __init__(self, sock, n_workers, poll_sec):
+        self.sock = sock
+        self.n_workers = n_workers
+        self.poll_sec = poll_sec
+        self.generation = 0
+        self.workers = {}          # pid -> generation
+        self.flat_files = {}       # generation -> flat path (removed once that generation is gone)
+        self.crashes = []
+        self.stopping = False
+        self.reload_requested = False
+        self.app = None
+
+    # ---------- weights ----------
+    def _publish(self, flat_path, step, source):
+        """Point the (about to be forked) app module at a new mapping."""
+        from model.flat import MappedCharRNN
+        from serving import LoadedModel
+        model = MappedCharRNN(flat_path)
+        if self.app.SPECIALIZE:
+            self.app.specialize(model, kernels=("step",))   # built before fork, shared by the workers
+        self.app.watcher.active = LoadedModel(model, source, step)
+        self.flat_files[self.generation] = flat_path
+
+    def boot(self):
+        os.chdir(HERE)
+        sys.path.insert(0, HERE)
+        flat_path, step, source = export_current()
+        # exported before app is imported, so its watcher starts from the mapping instead of
+        # loading its own list-based copy of the same checkpoint
+        os.environ["ARES_FLAT_WEIGHTS"] = flat_path
+        import app as app_module   # tokenizer/corpus load once here, shared copy-on-write
+        from telemetry import SharedTelemetry
+        self.app = app_module
+        # only one process can bind the telemetry port: the master listens, workers read the copy
+        self.app.telemetry = SharedTelemetry(self.app.telemetry)
+        self.app.telemetry.start()
+        self.flat_files[self.generation] = flat_path
+        self.ckpt_mtime = self._ckpt_mtime()
+        print(f"[master] pid={os.getpid()} serving step {step} from {flat_path}")
+
+    def _ckpt_mtime(self):
+        try: return os.stat(CKPT_PATH).st_mtime_ns
+        except OSError: return None
+
+    def reload(self):
+        try:
+            flat_path, step, source = export_current()
+        except Exception as e:
+            print("[master] reload failed (keeping current workers):", e)
+            return
+        old_gen = self.generation
+        self.generation += 1
+        self._publish(flat_path, step, source)
+        for _ in range(self.n_workers):
+            self.spawn()
+        for pid, gen in list(self.workers.items()):
+            if gen == old_gen:
+                self._signal(pid, signal.SIGTERM)   # drain in-flight requests, then exit
+        print(f"[master] rolled to generation {self.generation} (step {step})")
+
+    # ---------- workers ----------
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                worker_main(self.sock, self.app)
+            except BaseException as e:
+                print(f"[worker {os.getpid()}] died:", e)
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = self.generation
+        return pid
+
+    def _signal(self, pid, sig):
+        try: os.kill(pid, sig)
+        except ProcessLookupError: pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            gen = self.workers.pop(pid, None)
+            if gen == self.generation and not self.stopping:
+                now = time.time()
+                self.crashes = [t for t in self.crashes if now - t < CRASH_WINDOW_SEC] + [now]
+                print(f"[master] worker {pid} exited unexpectedly (status {status}); restarting")
+                if len(self.crashes) > self.n_workers:
+                    time.sleep(1.0)
+                self.spawn()
+
+    def _cleanup_files(self):
+        live = set(self.workers.values())
+        for gen in [g for g in self.flat_files if g != self.generation and g not in live]:
+            try: os.remove(self.flat_files.pop(gen))
+            except OSError: pass
+
+    # ---------- main loop ----------
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_hup)
+        for _ in range(self.n_workers):
+            self.spawn()
+        last_poll = time.time()
+        while not self.stopping:
+            time.sleep(0.2)
+            self.reap()
+            self._cleanup_files()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            elif self.poll_sec and time.time() - last_poll >= self.poll_sec:
+                last_poll = time.time()
+                mtime = self._ckpt_mtime()
+                if mtime is not None and mtime != self.ckpt_mtime:
+                    self.ckpt_mtime = mtime
+                    self.reload()
+        self.shutdown()
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_hup(self, signum, frame):
+        self.reload_requested = True
+
+    def shutdown(self):
+        print(f"[master] stopping {len(self.workers)} workers")
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.time() + DRAIN_GRACE_SEC
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGKILL)
+        self.reap()
+        self.generation += 1       # lets _cleanup_files remove every generation's file
+        self._cleanup_files()
+        self.sock.close()
+
+def worker_main(sock, app):
+    server = _WorkerServer(sock.getsockname()[:2], app.ChatHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    # SIGTERM = graceful: stop accepting, finish in-flight requests (server_close joins them)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # Ctrl+C is the master's job
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    server.serve_forever(poll_interval=0.5)
+    server.server_close()
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-fork ARES V3 server with shared mmap'd weights.")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--poll", type=float, default=2.0, help="ckpt.json poll interval (0 = only reload on SIGHUP)")
+    args = ap.parse_args()
+
+    if not hasattr(os, "fork"):
+        print("[prefork] os.fork is not available on this platform; running the single-process server.")
+        os.chdir(HERE); sys.path.insert(0, HERE)
+        import app
+        return app.run()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.setblocking(False)
+
+    master = Master(sock, max(1, args.workers), args.poll)
+    master.boot()
+    print(f"ARES_AI (prefork x{master.n_workers}) running → http://localhost:{args.port}")
+    master.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+# serving.py — server-side helpers for app.py (stdlib-only)
+import json, os, re, threading, time
+from collections import OrderedDict
+from model.model import TinyCharRNN
+
+STEP_FILE_RE = re.compile(r"^model_step_(\d+)\.json$")
+
+def resolve_ckpt_path(path):
+    """ckpt.json may be written on Windows ("weights\\model_step_N.json"); normalise for this OS."""
+    return os.path.normpath(path.replace("\\", "/"))
+
+def read_ckpt_pointer(ckpt_path):
+    """Returns (path, step) from ckpt.json, or (None, None) if missing/broken."""
+    try:
+        with open(ckpt_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        path = meta.get("path")
+        if not path:
+            return None, None
+        return resolve_ckpt_path(path), int(meta.get("step", 0))
+    except (OSError, ValueError, TypeError):
+        return None, None
+
+class LoadedModel:
+    """An immutable (model, where-it-came-from) pair. Swapped as a whole, never mutated."""
+    def __init__(self, model, path=None, step=None):
+        self.model = model
+        self.path = path
+        self.step = step
+        self.loaded_at = time.time()
+        # identity of the weights: changes on every reload, even if the step number is reused
+        self.version = f"{path}@{step}#{self.loaded_at:.6f}"
+
+class ModelWatcher:
+    """
+    Hot reload for the served model.
+      - polls ckpt.json's mtime every `poll_sec` seconds in a daemon thread
+      - loads the new checkpoint in that thread (requests keep being served)
+      - swaps `self.active` in one assignment, so a request that already grabbed
+        the old LoadedModel finishes on the old weights
+    """
+    def __init__(self, ckpt_path, fallback_path=None, vocab_size=None, poll_sec=2.0, loader=TinyCharRNN.load,
+                 initial=None):
+        self.ckpt_path = ckpt_path
+        self.fallback_path = fallback_path
+        self.vocab_size = vocab_size
+        self.poll_sec = poll_sec
+        self.loader = loader
+        self.listeners = []          # callables(old, new) run after each swap
+        self.reloads = 0
+        self.failures = 0
+        self._seen_mtime = None
+        self._stop = threading.Event()
+        self.thread = None
+        if initial is not None:
+            self._seen_mtime = self._mtime()
+            self.active = initial
+        else:
+            self.active = self._initial()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.ckpt_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _initial(self):
+        self._seen_mtime = self._mtime()
+        path, step = read_ckpt_pointer(self.ckpt_path)
+        if path and os.path.exists(path):
+            try:
+                return LoadedModel(self.loader(path), path, step)
+            except Exception as e:
+                print(f"[reload] {path} failed, trying fallback:", e)
+        if self.fallback_path:
+            try:
+                return LoadedModel(self.loader(self.fallback_path), self.fallback_path, None)
+            except Exception as e:
+                print("Weights not found, using random-initialized model.", e)
+        return LoadedModel(TinyCharRNN(self.vocab_size or 1))
+
+    def check(self):
+        """One poll: reload if ckpt.json changed and points at a new checkpoint. Returns True on swap."""
+        mtime = self._mtime()
+        if mtime is None or mtime == self._seen_mtime:
+            return False
+        path, step = read_ckpt_pointer(self.ckpt_path)
+        if not path or not os.path.exists(path):
+            return False               # pointer mid-update; try again next poll
+        cur = self.active
+        if path == cur.path and step == cur.step:
+            self._seen_mtime = mtime
+            return False
+        t0 = time.time()
+        try:
+            model = self.loader(path)
+        except Exception as e:
+            self.failures += 1
+            print(f"[reload] {path} failed (will retry):", e)
+            return False
+        new = LoadedModel(model, path, step)
+        self.active = new              # atomic reference swap
+        self._seen_mtime = mtime
+        self.reloads += 1
+        print(f"[reload] now serving step {step} ({path}) | load {time.time() - t0:.2f}s")
+        for fn in self.listeners:
+            try: fn(cur, new)
+            except Exception as e: print("[reload] listener failed:", e)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.poll_sec):
+            self.check()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+# -------------------------
+# Multi-checkpoint cache
+# -------------------------
+def estimate_model_bytes(model):
+    """Rough resident size of a list-of-floats model: ~32 bytes per float (object + slot) + list headers."""
+    V, H = model.vocab_size, model.hidden
+    floats = V * H + H * H + H * V + H + V
+    rows = V + H + H + 2
+    return floats * 32 + rows * 64
+
+def list_step_files(weights_dir):
+    """{step: path} for every model_step_N.json in `weights_dir`."""
+    out = {}
+    try:
+        names = os.listdir(weights_dir)
+    except FileNotFoundError:
+        return out
+    for name in names:
+        m = STEP_FILE_RE.match(name)
+        if m:
+            out[int(m.group(1))] = os.path.join(weights_dir, name)
+    return out
+
+class ModelLoadError(Exception):
+    """A step checkpoint exists but could not be loaded (truncated/corrupt file, read error)."""
+
+class _PendingLoad:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class ModelCache:
+    """
+    LRU cache of loaded step checkpoints, bounded by an estimated memory budget.
+      - get(step) returns a LoadedModel; a cold step is loaded once even if many
+        requests ask for it at the same time (the rest wait on the first load)
+      - least-recently-used models are evicted once the budget is exceeded
+        (the most recent one is always kept, even if it alone is over budget)
+      - peek(step) returns the LoadedModel only if it is already in memory, so callers can
+        defer a cold load (e.g. until the request holds a compute slot)
+    Unknown steps raise KeyError; a file that fails to load raises ModelLoadError.
+    """
+    def __init__(self, weights_dir, budget_bytes=64 * 1024 * 1024, loader=TinyCharRNN.load):
+        self.weights_dir = weights_dir
+        self.budget_bytes = budget_bytes
+        self.loader = loader
+        self.entries = OrderedDict()   # path -> (LoadedModel, bytes)
+        self.loading = {}              # path -> _PendingLoad
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.coalesced = self.load_errors = 0
+
+    def path_for(self, step):
+        """Only model_step_N.json inside weights_dir can be served (no arbitrary paths)."""
+        name = f"model_step_{int(step)}.json"
+        path = os.path.join(self.weights_dir, name)
+        if not os.path.exists(path):
+            raise KeyError(f"no checkpoint for step {step}")
+        return path
+
+    def peek(self, step):
+        """The cached LoadedModel for `step`, or None if it would need a load (KeyError if unknown)."""
+        path = self.path_for(step)
+        with self.lock:
+            hit = self.entries.get(path)
+            if hit is None:
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return hit[0]
+
+    def get(self, step):
+        path = self.path_for(step)
+        with self.lock:
+            hit = self.entries.get(path)
+            if hit is not None:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return hit[0]
+            pending = self.loading.get(path)
+            owner = pending is None
+            if owner:
+                pending = self.loading[path] = _PendingLoad()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            pending.done.wait()
+        else:
+            try:
+                pending.result = LoadedModel(self.loader(path), path, int(step))
+            except Exception as e:
+                pending.error = e
+            with self.lock:
+                del self.loading[path]
+                if pending.error is None:
+                    self._insert(path, pending.result)
+                else:
+                    self.load_errors += 1
+            pending.done.set()
+
+        if pending.error is not None:
+            raise ModelLoadError(f"checkpoint for step {step} could not be loaded: {pending.error}") from pending.error
+        return pending.result
+
+    def _insert(self, path, loaded):
+        size = estimate_model_bytes(loaded.model)
+        self.entries[path] = (loaded, size)
+        self.bytes += size
+        while self.bytes > self.budget_bytes and len(self.entries) > 1:
+            _, (_, old_size) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "steps": [e[0].step for e in self.entries.values()],
+                "bytes": self.bytes, "budget_bytes": self.budget_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "coalesced": self.coalesced, "load_errors": self.load_errors,
+            }
+
+# -------------------------
+# Response cache (deterministic requests only)
+# -------------------------
+def response_cache_key(loaded, seed_text, max_new, temperature, top_k, sample_seed, n=1):
+    """
+    Key for a cacheable generation, or None if the reply is not reproducible.
+    Greedy (temperature <= 0) ignores top_k and the RNG, so those are normalised away;
+    sampled replies are only cacheable with an explicit sample_seed.
+    """
+    if temperature is None or temperature <= 0:
+        return (loaded.version, seed_text, max_new, 0.0, None, None, n)
+    if sample_seed is None:
+        return None
+    return (loaded.version, seed_text, max_new, float(temperature), top_k, sample_seed, n)
+
+class ResponseCache:
+    """Thread-safe LRU with a max entry count and a per-entry TTL. max_entries <= 0 disables it."""
+    def __init__(self, max_entries=0, ttl_sec=600.0):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.entries = OrderedDict()   # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        if key is None or not self.enabled:
+            return None
+        now = time.time()
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[0] < now:
+                del self.entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        if key is None or not self.enabled:
+            return
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl_sec, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, version=None):
+        """Drop every entry (or only those produced by one model version)."""
+        with self.lock:
+            if version is None:
+                self.entries.clear()
+            else:
+                for key in [k for k in self.entries if k[0] == version]:
+                    del self.entries[key]
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled, "entries": len(self.entries),
+                "max_entries": self.max_entries, "ttl_sec": self.ttl_sec,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "expired": self.expired, "invalidations": self.invalidations,
+            }
+
+# -------------------------
+# Admission control
+# -------------------------
+class Admission:
+    """Outcome of AdmissionController.acquire: `status` is None when admitted, else 429/503."""
+    def __init__(self, status, wait_sec, reason=None):
+        self.status = status
+        self.wait_sec = wait_sec
+        self.reason = reason
+
+class AdmissionController:
+    """
+    Bounds the work in flight:
+      - at most `max_active` requests compute at once; up to `max_queue` more wait (FIFO-ish)
+      - a full queue sheds with 503, a client over `per_client` active+queued gets 429
+      - a queued request gives up (503) when its deadline passes before a slot frees up
+    """
+    def __init__(self, max_active=2, max_queue=16, per_client=4):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.cond = threading.Condition()
+        self.active = 0
+        self.queued = 0
+        self.by_client = {}
+        self.admitted = self.shed_queue = self.shed_client = self.shed_timeout = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self, client, deadline):
+        """Blocks until admitted or rejected. `deadline` is a time.monotonic() timestamp."""
+        t0 = time.monotonic()
+        with self.cond:
+            if self.by_client.get(client, 0) >= self.per_client:
+                self.shed_client += 1
+                return Admission(429, 0.0, "too many concurrent requests from this client")
+            if self.active >= self.max_active and self.queued >= self.max_queue:
+                self.shed_queue += 1
+                return Admission(503, 0.0, "server overloaded (queue full)")
+            self.by_client[client] = self.by_client.get(client, 0) + 1
+            self.queued += 1
+            try:
+                while self.active >= self.max_active:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        self._drop_client(client)
+                        self.shed_timeout += 1
+                        return Admission(503, time.monotonic() - t0, "deadline expired while queued")
+                    self.cond.wait(left)
+            finally:
+                self.queued -= 1
+            self.active += 1
+            wait = time.monotonic() - t0
+            self.admitted += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            return Admission(None, wait)
+
+    def release(self, client):
+        with self.cond:
+            self.active -= 1
+            self._drop_client(client)
+            self.cond.notify()
+
+    def _drop_client(self, client):
+        n = self.by_client.get(client, 0) - 1
+        if n > 0: self.by_client[client] = n
+        else: self.by_client.pop(client, None)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "active": self.active, "queued": self.queued,
+                "max_active": self.max_active, "max_queue": self.max_queue, "per_client": self.per_client,
+                "admitted": self.admitted,
+                "shed": self.shed_queue + self.shed_client + self.shed_timeout,
+                "shed_queue_full": self.shed_queue, "shed_per_client": self.shed_client,
+                "shed_deadline": self.shed_timeout,
+                "wait_avg_ms": round(1000.0 * self.wait_total / self.admitted, 2) if self.admitted else 0.0,
+                "wait_max_ms": round(1000.0 * self.wait_max, 2),
+            }
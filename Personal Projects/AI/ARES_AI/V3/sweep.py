@@ -0,0 +1,264 @@
+# sweep.py — parallel hyperparameter sweep for TinyCharRNN with successive halving (stdlib-only)
+#
+#   python sweep.py                                   # built-in grid, all cores
+#   python sweep.py --spec my_sweep.json --name lr_vs_hidden --min-steps 200 --max-steps 5400 --eta 3
+#
+# Spec (JSON). Either a grid ...
+#   {"grid":   {"block_len": [64, 128], "base_lr": [0.01, 0.03], "hidden": [64, 128]},
+#    "fixed":  {"lr_decay": 0.5, "lr_decay_every": 10000}}
+# ... or random search:
+#   {"random": {"trials": 12, "space": {"base_lr": {"log_uniform": [0.003, 0.1]},
+#                                      "hidden": [64, 96, 128], "block_len": {"int_uniform": [32, 192]}}}}
+#
+# Every trial trains in its own directory (sweeps/<name>/trial_NNN/) from one shared token cache.
+# Rungs run at min_steps, min_steps*eta, ... max_steps; after each rung only the best 1/eta
+# (by held-out loss) keep training. Re-running the same --name resumes where it stopped; a trial
+# whose saved config/seed no longer matches starts over. Diverged trials keep their last good weights.
+import argparse, itertools, json, math, os, random, sys, time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from evaluate import split_point
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join("data", "tiny_shakespeare.txt")
+SWEEP_ROOT = "sweeps"
+
+# knobs a trial understands (same names/meaning as the constants at the top of train.py)
+DEFAULTS = {"block_len": 128, "base_lr": 0.03, "hidden": 128, "lr_decay": 0.5, "lr_decay_every": 10000}
+DEFAULT_SPEC = {"grid": {"block_len": [64, 128], "base_lr": [0.01, 0.03, 0.1], "hidden": [64, 128]}}
+
+VAL_WINDOW = 128        # chars per evaluation window
+
+# -------------------------
+# Spec → trial configs
+# -------------------------
+def _sample(dist, rnd):
+    if isinstance(dist, list):
+        return rnd.choice(dist)
+    if isinstance(dist, dict):
+        if "log_uniform" in dist:
+            lo, hi = dist["log_uniform"]
+            return math.exp(rnd.uniform(math.log(lo), math.log(hi)))
+        if "uniform" in dist:
+            return rnd.uniform(*dist["uniform"])
+        if "int_uniform" in dist:
+            return rnd.randint(*dist["int_uniform"])
+    return dist
+
+def expand_spec(spec, seed=0):
+    fixed = dict(DEFAULTS, **spec.get("fixed", {}))
+    configs = []
+    if "grid" in spec:
+        keys = list(spec["grid"])
+        for values in itertools.product(*(spec["grid"][k] for k in keys)):
+            configs.append(dict(fixed, **dict(zip(keys, values))))
+    if "random" in spec:
+        rnd = random.Random(seed)
+        space = spec["random"].get("space", {})
+        for _ in range(int(spec["random"].get("trials", 8))):
+            configs.append(dict(fixed, **{k: _sample(v, rnd) for k, v in space.items()}))
+    unknown = {k for c in configs for k in c} - set(DEFAULTS)
+    if unknown:
+        raise SystemExit(f"unknown sweep parameter(s): {', '.join(sorted(unknown))}")
+    for c in configs:
+        c["block_len"] = int(c["block_len"]); c["hidden"] = int(c["hidden"])
+        c["lr_decay_every"] = int(c["lr_decay_every"])
+    return configs
+
+def rung_steps(min_steps, max_steps, eta):
+    steps, r = [], min_steps
+    while r < max_steps:
+        steps.append(r)
+        r *= eta
+    steps.append(max_steps)
+    return steps
+
+# -------------------------
+# Shared token cache
+# -------------------------
+def build_token_cache(sweep_dir):
+    """Encode the corpus once; every worker reads the same uint16 file."""
+    from model.tokenizer import CharTokenizer
+    path = os.path.join(sweep_dir, "tokens.u16")
+    meta_path = os.path.join(sweep_dir, "tokens.json")
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            return path, json.load(f)
+    with open(DATA, encoding="utf-8") as f:
+        text = f.read()
+    tok = CharTokenizer(text)
+    ids = array("H", tok.encode(text))
+    with open(path + ".tmp", "wb") as f:
+        ids.tofile(f)
+    os.replace(path + ".tmp", path)
+    meta = {"vocab_size": len(tok.stoi), "n_tokens": len(ids), "train_end": split_point(len(ids))}
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return path, meta
+
+def load_tokens(path):
+    ids = array("H")
+    with open(path, "rb") as f:
+        ids.frombytes(f.read())
+    return ids
+
+def val_windows(ids, train_end, n_windows):
+    """Evenly spaced, fixed windows from the held-out tail (same for every trial)."""
+    span = len(ids) - train_end - (VAL_WINDOW + 1)
+    if span <= 0:
+        return []
+    stride = max(1, span // max(1, n_windows))
+    return [list(ids[s : s + VAL_WINDOW + 1]) for s in range(train_end, train_end + span, stride)][:n_windows]
+
+# -------------------------
+# One trial segment (runs in a worker process)
+# -------------------------
+def run_trial(task):
+    """Train one trial from its saved state up to task['target_steps'], then score held-out windows."""
+    from model.model import TinyCharRNN
+    cfg, tdir = task["config"], task["dir"]
+    os.makedirs(tdir, exist_ok=True)
+    state_path, model_path = os.path.join(tdir, "state.json"), os.path.join(tdir, "model.json")
+
+    ids = load_tokens(task["tokens"])
+    train_end = task["meta"]["train_end"]
+    fresh = {"config": cfg, "seed": task["seed"], "step": 0, "wall_sec": 0.0, "loss_ema": None,
+             "diverged": False, "history": []}
+    state = fresh
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("config") != cfg or saved.get("seed") != task["seed"]:
+            # trial dirs are named by index only: a different --spec/--seed under the same --name
+            # must not pick up another configuration's weights or result
+            print(f"[sweep] trial {task['id']}: saved state is for a different config/seed, restarting",
+                  file=sys.stderr)
+        else:
+            state = saved
+    if state is not fresh and (state.get("diverged") or state["step"] >= task["target_steps"]) \
+            and "val_loss" in state:
+        # already trained this far, or stopped for good (resumed sweep): reuse the recorded result
+        return {"id": task["id"], "step": state["step"], "val_loss": state["val_loss"],
+                "train_loss_ema": state["loss_ema"], "wall_sec": state["wall_sec"], "segment_sec": 0.0}
+    if state is not fresh and os.path.exists(model_path):
+        model = TinyCharRNN.load(model_path)
+    else:
+        state = fresh
+        model = TinyCharRNN(task["meta"]["vocab_size"], hidden=cfg["hidden"], lr=cfg["base_lr"],
+                            seed=task["seed"])
+
+    rnd = random.Random(task["seed"] * 1000003 + state["step"])
+    B = cfg["block_len"]
+    t0 = time.time()
+    ema = state["loss_ema"]
+    done, diverged = state["step"], False
+    for step in range(state["step"] + 1, task["target_steps"] + 1):
+        model.lr = cfg["base_lr"] * (cfg["lr_decay"] ** (step // cfg["lr_decay_every"]))
+        s = rnd.randint(0, train_end - B - 2)
+        loss = model.train_step(ids[s : s + B], ids[s + 1 : s + B + 1])
+        if not math.isfinite(loss):
+            diverged = True
+            break
+        ema = loss if ema is None else 0.98 * ema + 0.02 * loss
+        done = step
+    train_sec = time.time() - t0
+
+    if diverged:
+        # the weights are non-finite now: keep the last good model.json and never resume from here
+        val_loss = float("inf")
+    else:
+        windows = val_windows(ids, train_end, task["val_windows"])
+        results, _ = model.score(windows)
+        n = sum(r["n"] for r in results)
+        val_loss = -sum(r["logprob"] for r in results) / n if n else float("nan")
+
+    state.update({
+        "step": done, "wall_sec": state["wall_sec"] + train_sec, "loss_ema": ema,
+        "val_loss": val_loss, "diverged": diverged,
+    })
+    state["history"].append({"step": done, "wall_sec": round(state["wall_sec"], 2),
+                             "train_loss_ema": ema, "val_loss": val_loss, "diverged": diverged})
+    if not diverged:
+        model.save(model_path)
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+    return {"id": task["id"], "step": state["step"], "val_loss": val_loss, "train_loss_ema": ema,
+            "wall_sec": state["wall_sec"], "segment_sec": train_sec}
+
+# -------------------------
+# Driver
+# -------------------------
+def _fmt_loss(x):
+    return f"{x:.4f}" if x is not None and math.isfinite(x) else "diverged"
+
+def print_leaderboard(rows):
+    print(f"\n{'rank':>4} {'trial':>5} {'val_loss':>9} {'steps':>6} {'wall':>8}  config")
+    for rank, r in enumerate(rows, 1):
+        c = r["config"]
+        desc = (f"BLOCK_LEN={c['block_len']} BASE_LR={c['base_lr']:.4g} HIDDEN={c['hidden']} "
+                f"LR_DECAY={c['lr_decay']} LR_DECAY_EVERY={c['lr_decay_every']}")
+        print(f"{rank:>4} {r['id']:>5} {_fmt_loss(r['val_loss']):>9} {r['step']:>6} {r['wall_sec']:>7.0f}s  {desc}"
+              + ("" if r["alive"] else "  (stopped)"))
+
+def main():
+    ap = argparse.ArgumentParser(description="Parallel successive-halving sweep for V3 TinyCharRNN.")
+    ap.add_argument("--spec", help="JSON spec file (grid and/or random); default: small built-in grid")
+    ap.add_argument("--name", default="sweep", help="sweep directory under sweeps/ (re-use to resume)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--min-steps", type=int, default=100, help="training steps at the first rung")
+    ap.add_argument("--max-steps", type=int, default=2700, help="training steps for the survivors")
+    ap.add_argument("--eta", type=int, default=3, help="keep the best 1/eta after each rung")
+    ap.add_argument("--val-windows", type=int, default=16, help=f"held-out windows of {VAL_WINDOW} chars")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    os.chdir(HERE)
+    sys.path.insert(0, HERE)
+    spec = DEFAULT_SPEC
+    if args.spec:
+        with open(args.spec, encoding="utf-8") as f:
+            spec = json.load(f)
+    configs = expand_spec(spec, seed=args.seed)
+    if not configs:
+        raise SystemExit("spec produced no trials")
+
+    sweep_dir = os.path.join(SWEEP_ROOT, args.name)
+    os.makedirs(sweep_dir, exist_ok=True)
+    tokens, meta = build_token_cache(sweep_dir)
+    rungs = rung_steps(args.min_steps, args.max_steps, max(2, args.eta))
+    print(f"[sweep] {len(configs)} trials | rungs {rungs} | workers {args.workers} | dir {sweep_dir}")
+
+    trials = [{"id": i, "config": c, "alive": True, "step": 0, "val_loss": None, "wall_sec": 0.0}
+              for i, c in enumerate(configs)]
+    t_start = time.time()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for k, target in enumerate(rungs):
+            alive = [t for t in trials if t["alive"]]
+            tasks = [{"id": t["id"], "config": t["config"], "target_steps": target,
+                      "dir": os.path.join(sweep_dir, f"trial_{t['id']:03d}"),
+                      "tokens": tokens, "meta": meta, "val_windows": args.val_windows,
+                      "seed": args.seed + t["id"]} for t in alive]
+            for res in pool.map(run_trial, tasks):
+                t = trials[res["id"]]
+                t.update(step=res["step"], val_loss=res["val_loss"], wall_sec=res["wall_sec"])
+            alive.sort(key=lambda t: t["val_loss"] if math.isfinite(t["val_loss"]) else float("inf"))
+            keep = max(1, math.ceil(len(alive) / args.eta)) if k + 1 < len(rungs) else len(alive)
+            for t in alive[keep:]:
+                t["alive"] = False
+            print(f"[rung {k}] {target} steps | best {_fmt_loss(alive[0]['val_loss'])} (trial {alive[0]['id']}) "
+                  f"| keeping {keep}/{len(alive)} | elapsed {time.time() - t_start:.0f}s")
+
+    rows = sorted(trials, key=lambda t: (-t["step"], t["val_loss"] if math.isfinite(t["val_loss"]) else float("inf")))
+    print_leaderboard(rows)
+    board = {"rungs": rungs, "eta": args.eta, "wall_sec": time.time() - t_start, "trials": []}
+    for r in rows:
+        with open(os.path.join(sweep_dir, f"trial_{r['id']:03d}", "state.json"), encoding="utf-8") as f:
+            history = json.load(f)["history"]
+        board["trials"].append(dict(r, history=history))
+    with open(os.path.join(sweep_dir, "leaderboard.json"), "w", encoding="utf-8") as f:
+        json.dump(board, f, indent=2)
+    print(f"\n[sweep] leaderboard → {os.path.join(sweep_dir, 'leaderboard.json')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# telemetry.py — fire-and-forget training metrics over loopback UDP (stdlib-only)
+#
+# The trainer publishes one small JSON datagram every few steps; app.py listens and
+# keeps the most recent records in a ring buffer for /status. Datagrams never block:
+# if nobody is listening the kernel just drops them.
+# Under prefork.py only the master can bind the port; SharedTelemetry copies its listener's
+# records into shared memory that the forked workers read for their /status.
+import json, mmap, socket, struct, threading, time
+from collections import deque
+
+TELEMETRY_HOST = "127.0.0.1"
+TELEMETRY_PORT = 8765
+MAX_DATAGRAM   = 2048         # records are ~200 bytes; anything bigger is dropped
+
+class TelemetryPublisher:
+    """Non-blocking sender. Every error is swallowed so training can't stall on it."""
+    def __init__(self, host=TELEMETRY_HOST, port=TELEMETRY_PORT):
+        self.addr = (host, port)
+        self.sent = 0
+        self.dropped = 0
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+        except OSError:
+            self.sock = None
+
+    def publish(self, record):
+        if self.sock is None:
+            return False
+        try:
+            data = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            if len(data) > MAX_DATAGRAM:
+                self.dropped += 1
+                return False
+            self.sock.sendto(data, self.addr)
+            self.sent += 1
+            return True
+        except OSError:
+            # no listener (ICMP refused), full socket buffer, etc.
+            self.dropped += 1
+            return False
+
+    def close(self):
+        if self.sock is not None:
+            try: self.sock.close()
+            except OSError: pass
+            self.sock = None
+
+class TelemetryListener:
+    """
+    Background receiver: keeps the last `history` records in a ring buffer.
+    `latest()` / `snapshot()` are safe to call from request threads.
+    """
+    def __init__(self, host=TELEMETRY_HOST, port=TELEMETRY_PORT, history=120):
+        self.addr = (host, port)
+        self.records = deque(maxlen=history)
+        self.received_at = None
+        self.lock = threading.Lock()
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(self.addr)
+        except OSError as e:
+            print(f"[telemetry] listener disabled ({self.addr[0]}:{self.addr[1]}): {e}")
+            return False
+        sock.settimeout(1.0)
+        self.sock = sock
+        self.thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self.thread.start()
+        return True
+
+    def _run(self):
+        while self.sock is not None:
+            try:
+                data, _ = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                # Windows reports ICMP errors on recvfrom; just keep listening
+                if self.sock is None: return
+                continue
+            try:
+                rec = json.loads(data.decode("utf-8"))
+            except ValueError:
+                continue
+            if not isinstance(rec, dict):
+                continue
+            with self.lock:
+                self.records.append(rec)
+                self.received_at = time.time()
+
+    def latest(self):
+        with self.lock:
+            return self.records[-1] if self.records else None
+
+    def snapshot(self, last=30):
+        with self.lock:
+            recs = list(self.records)[-last:] if last else []
+            latest = self.records[-1] if self.records else None
+            age = (time.time() - self.received_at) if self.received_at else None
+        return {
+            "training": latest,
+            "age_sec": None if age is None else round(age, 2),
+            "history": recs,
+        }
+
+    def stop(self):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            try: sock.close()
+            except OSError: pass
+
+class SharedTelemetry:
+    """
+    A TelemetryListener readable from forked children. Create it before forking: the process that
+    calls start() runs the listener and re-publishes its records every `interval` seconds into an
+    anonymous shared mmap; every process (the forked workers included) reads them with snapshot(),
+    same result shape as TelemetryListener.snapshot(). A sequence number, odd while a write is in
+    progress, lets readers retry instead of parsing a half-written copy.
+    """
+    SIZE = 1 << 18     # 256 KB: the full ring buffer of ~200-byte records fits with room to spare
+    _HDR = struct.Struct("<QQ")   # sequence, payload length
+
+    def __init__(self, listener=None, interval=0.5):
+        self.listener = listener or TelemetryListener()
+        self.interval = interval
+        self.buf = mmap.mmap(-1, self.SIZE)   # MAP_SHARED | MAP_ANONYMOUS: survives fork() shared
+        self.thread = None
+
+    def start(self):
+        if not self.listener.start():
+            return False
+        self.thread = threading.Thread(target=self._run, name="telemetry-share", daemon=True)
+        self.thread.start()
+        return True
+
+    def _run(self):
+        last = None
+        while self.listener.sock is not None:
+            with self.listener.lock:
+                state = (list(self.listener.records), self.listener.received_at)
+            if state[1] != last:
+                last = state[1]
+                self._write({"records": state[0], "received_at": state[1]})
+            time.sleep(self.interval)
+
+    def _write(self, state):
+        data = json.dumps(state, separators=(",", ":")).encode("utf-8")
+        while len(data) > self.SIZE - self._HDR.size and state["records"]:
+            state["records"] = state["records"][len(state["records"]) // 2:]   # keep the newest half
+            data = json.dumps(state, separators=(",", ":")).encode("utf-8")
+        seq = self._HDR.unpack_from(self.buf, 0)[0]
+        self._HDR.pack_into(self.buf, 0, seq + 1, 0)          # odd: write in progress
+        self.buf[self._HDR.size:self._HDR.size + len(data)] = data
+        self._HDR.pack_into(self.buf, 0, seq + 2, len(data))
+
+    def _read(self):
+        for _ in range(10):
+            seq, n = self._HDR.unpack_from(self.buf, 0)
+            if seq == 0:
+                return None            # nothing received yet
+            if seq % 2 == 0:
+                data = bytes(self.buf[self._HDR.size:self._HDR.size + n])
+                if self._HDR.unpack_from(self.buf, 0)[0] == seq:
+                    return json.loads(data.decode("utf-8"))
+            time.sleep(0.001)
+        return None
+
+    def latest(self):
+        state = self._read()
+        return state["records"][-1] if state and state["records"] else None
+
+    def snapshot(self, last=30):
+        state = self._read() or {"records": [], "received_at": None}
+        recs, at = state["records"], state["received_at"]
+        age = (time.time() - at) if at else None
+        return {
+            "training": recs[-1] if recs else None,
+            "age_sec": None if age is None else round(age, 2),
+            "history": recs[-last:] if last else [],
+        }
+
+    def stop(self):
+        self.listener.stop()
@@ -2,6 +2,10 @@
 import os, random, time, json
 from model.tokenizer import CharTokenizer
 from model.model import TinyCharRNN  # model.save() is already atomic in your updated model.py
+from model.specialize import install as specialize
+from model.widen import widen
+from telemetry import TelemetryPublisher
+from evaluate import split_point
 
 DATA    = os.path.join("data", "tiny_shakespeare.txt")
 WEIGHTS = os.path.join("weights", "model.json")
@@ -17,6 +21,11 @@ SAVE_EVERY     = 1000         # checkpoint cadence
 PREVIEW_TEMP   = 0.8          # sampling temperature for previews (0.6..0.9)
 PREVIEW_TOPK   = 50           # top-k cutoff for previews (None to disable)
 BASE_LR        = 0.03         # base learning rate (decays during run)
+LR_DECAY       = 0.5          # multiply LR by this ...
+LR_DECAY_EVERY = 10000        # ... every N steps
+HIDDEN         = 128          # RNN hidden size (fresh model; a smaller checkpoint is widened to this on resume)
+TELEMETRY_EVERY = 10          # publish a live metrics record every N steps (0 = off)
+SPECIALIZE     = True         # shape-specialized step/train_step kernels (model/specialize.py) where faster
 
 # -------------------------
 # Time helpers
@@ -103,6 +112,7 @@ def save_ckpt(model, step):
     model.save(step_path)      # atomic inside model.save
     _ckpt_pointer_write(step_path, step)  # atomic pointer
     model.save(WEIGHTS)        # atomic latest copy
+    return step_path
 
 def load_ckpt_if_any(model):
     """
@@ -134,6 +144,18 @@ def load_ckpt_if_any(model):
     # Fresh start
     return model, 1
 
+def match_hidden(model):
+    """
+    Resumed checkpoint narrower than HIDDEN → Net2Net-widen it (outputs unchanged, training continues
+    from there). A wider checkpoint keeps its own size.
+    """
+    if model.hidden < HIDDEN and hasattr(model, "Whh"):
+        print(f"[resume] widening hidden {model.hidden} -> {HIDDEN} (function-preserving)")
+        return widen(model, HIDDEN)
+    if model.hidden != HIDDEN:
+        print(f"[resume] checkpoint has hidden={model.hidden}; keeping it (HIDDEN={HIDDEN} ignored)")
+    return model
+
 # -------------------------
 # Pre-run warmup ETA (does NOT change final weights)
 # -------------------------
@@ -155,9 +177,13 @@ with open(DATA, encoding="utf-8") as f:
 
 tok = CharTokenizer(text)
 ids = tok.encode(text)
+train_end = split_point(len(ids))   # the tail is evaluate.py's held-out slice
 
-model = TinyCharRNN(vocab_size=len(tok.stoi), hidden=128, lr=BASE_LR)
+model = TinyCharRNN(vocab_size=len(tok.stoi), hidden=HIDDEN, lr=BASE_LR)
 model, start_step = load_ckpt_if_any(model)
+model = match_hidden(model)
+if SPECIALIZE:
+    print(f"[kernels] specialized: {', '.join(specialize(model)) or 'none (generic is faster)'}")
 
 # snapshot weights -> warmup -> restore (so warmup doesn't affect real training)
 os.makedirs("weights", exist_ok=True)
@@ -165,6 +191,8 @@ _tmp = os.path.join("weights", "_tmp_warmup.json")
 model.save(_tmp)  # atomic
 sps = estimate_steps_per_sec(model, ids, block_len=BLOCK_LEN, warmup_steps=300)
 model = TinyCharRNN.load(_tmp)
+if SPECIALIZE:
+    specialize(model)   # verdict is cached, so this is just the swap
 try: os.remove(_tmp)
 except OSError: pass
 
@@ -178,17 +206,20 @@ print(f"[start] {run_started_at} | steps={TOTAL_STEPS} | block={BLOCK_LEN} | bas
 # -------------------------
 last_step = start_step - 1
 ema_step = None
+ema_loss = None
+last_ckpt = None
+telemetry = TelemetryPublisher() if TELEMETRY_EVERY else None
 
 try:
     for step in range(start_step, TOTAL_STEPS + 1):
         t_step = time.time()
         last_step = step
 
-        # gentle LR decay every 10k steps
-        model.lr = BASE_LR * (0.5 ** (step // 10000))
+        # gentle step decay (halves every 10k steps by default)
+        model.lr = BASE_LR * (LR_DECAY ** (step // LR_DECAY_EVERY))
 
         # sample a slice
-        start = random.randint(0, len(ids) - BLOCK_LEN - 2)
+        start = random.randint(0, train_end - BLOCK_LEN - 2)
         x = ids[start : start + BLOCK_LEN]
         y = ids[start + 1 : start + BLOCK_LEN + 1]
 
@@ -197,6 +228,7 @@ try:
         # timing / ETA
         dt = time.time() - t_step
         ema_step = dt if ema_step is None else (0.98 * ema_step + 0.02 * dt)
+        ema_loss = loss if ema_loss is None else (0.98 * ema_loss + 0.02 * loss)
         elapsed = time.time() - TRAIN_START_TS
         eta = (TOTAL_STEPS - step) * (ema_step if ema_step is not None else 0.0)
 
@@ -211,7 +243,17 @@ try:
 
         # checkpoint
         if step % SAVE_EVERY == 0 or step == TOTAL_STEPS:
-            save_ckpt(model, step)
+            last_ckpt = save_ckpt(model, step)
+
+        # live metrics (UDP datagram, never blocks; dropped if nobody listens)
+        if telemetry is not None and (step % TELEMETRY_EVERY == 0 or step == start_step):
+            telemetry.publish({
+                "step": step, "total": TOTAL_STEPS,
+                "loss": round(loss, 4), "loss_ema": round(ema_loss, 4),
+                "chars_per_sec": round(BLOCK_LEN / max(1e-9, ema_step), 1),
+                "eta_sec": round(eta, 1), "elapsed_sec": round(elapsed, 1),
+                "lr": model.lr, "last_ckpt": last_ckpt, "ts": time.time(),
+            })
 
 except KeyboardInterrupt:
     try:
@@ -222,5 +264,9 @@ except KeyboardInterrupt:
         print("\n[interrupt] second interrupt during save — previous checkpoint remains safe.")
 
 # final persist
-save_ckpt(model, TOTAL_STEPS)
+last_ckpt = save_ckpt(model, TOTAL_STEPS)
+if telemetry is not None:
+    telemetry.publish({"step": TOTAL_STEPS, "total": TOTAL_STEPS, "done": True,
+                       "last_ckpt": last_ckpt, "ts": time.time()})
+    telemetry.close()
 print(f"[done] {CurrentTime()} | total elapsed={TotalCompletionActual()}")